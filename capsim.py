@@ -111,7 +111,7 @@ from batch                import make_batch
 from database             import edit_database, make_database
 from soliddatabase        import edit_soliddatabase, make_soliddatabase
 from solver               import solve_system, solve_batch
-from postprocess          import postprocess_data, postprocess_batch
+from postprocess          import postprocess_data
 from graphprocess         import graphprocess_data
 
 # The current version  and the previous versions
@@ -170,10 +170,16 @@ while(1):
                     system = get_summary(system, database, materials)
                     #run the simulation
                     if system is not None:
-                        output, main = solve_system(system)
-                        #postprocess
-                        if output is not None:
-                            main = postprocess_data(system, output)
+                        #boundary concentration histories are written to
+                        #the output files like a batch
+                        if len(system.historyfilenames) > 0:
+                            system.filename = system.cpsmfilename
+                            outputs, main   = solve_batch([system], 'Separate')
+                        else:
+                            output, main = solve_system(system)
+                            #postprocess
+                            if output is not None:
+                                main = postprocess_data(system, output)
                         if main == 1: break
                     else: break
 
@@ -232,6 +238,30 @@ while(1):
             system.depoption    = 'Time step size'
             system.depgrid      = system.Vdep * system.delt
 
+        try:    a = system.nljacobian
+        except: system.nljacobian   = 0
+        try:    a = system.nlpredictor
+        except: system.nlpredictor  = 'Linear extrapolation'
+        try:    a = system.gridoption
+        except:
+            system.gridoption   = 'Uniform'
+            system.gridnodes    = int(sum(system.players) / 3)
+        try:    a = system.deltoption
+        except:
+            system.deltoption   = 'Fixed'
+            system.deltmax      = float(system.tfinal) / system.outputsteps
+            system.delterror    = 0.001
+        try:    a = system.deltmin
+        except: system.deltmin      = system.delt / 100
+        try:    a = system.historyfilenames
+        except: system.historyfilenames = []
+        try:    a = system.outputvariables
+        except: system.get_outputspecification('C; F; q; qm; W; Cw; Fi', '', '')
+        try:    a = system.observations
+        except:
+            system.observations     = []
+            system.observationsteps = 0
+
         try:    a = system.sigma
         except:
             system.sigma    = 10
@@ -245,13 +275,23 @@ while(1):
 
             if system is not None:
 
-                output, main = solve_system(system)
+                #boundary concentration histories are written to the output
+                #files like a batch
+
+                if len(system.historyfilenames) > 0:
 
-                #postprocess
+                    system.filename = system.cpsmfilename
+                    outputs, main   = solve_batch([system], 'Separate')
 
-                if output is not None:
+                else:
 
-                    main = postprocess_data(system, output)
+                    output, main = solve_system(system)
+
+                    #postprocess
+
+                    if output is not None:
+
+                        main = postprocess_data(system, output)
 
                 if main == 1: break
 
@@ -264,12 +304,10 @@ while(1):
 
         if main != 1:
 
+            #the results are written by the batch solver as each system
+            #finishes, so only the file names are returned
             outputs, main = solve_batch(systems, type)
 
-            if outputs is not None:
-
-                main = postprocess_batch(type, systems, outputs)
-
             if main == 1: break
 
     if option == 3:
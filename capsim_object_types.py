@@ -19,6 +19,7 @@ Filepath =wreg.QueryValueEx(CapSimKey, 'FilePath')[0]
 CapSimKey.Close()
 
 from capsim_functions import freundlich, langmuir, millquirk, boudreau, notort, round_to_n
+from numpy            import array, zeros, maximum
 from Tkinter          import Tk, Toplevel, Canvas, Frame, Label, Entry, Text, \
                              Button, Scrollbar, OptionMenu, StringVar, \
                              DoubleVar, IntVar, FLAT, RAISED, Checkbutton
@@ -916,57 +917,62 @@ class Sorption:
 
         
     def get_K(self, component, C, Cmax):
-        """Takes the concentration "C" for the chemical "chemical" at 
-         temperature "temp" and returns the partition coefficient at a point."""
+        """Takes the concentration "C" for the chemical "chemical" at
+        temperature "temp" and returns the partition coefficient.  "C" may be
+        a number or an array of concentrations at many points."""
+
+        C = array(C, dtype = float)
+        K = zeros(C.shape)
 
         if self.kinetic == self.kinetics[0]:
             if self.isotherm == self.isotherms[0]:
-                K = self.K
+                K = K + self.K
             if self.isotherm == self.isotherms[1]:
-                K = component.foc * 10**self.Koc
+                K = K + component.foc * 10**self.Koc
             if self.isotherm == self.isotherms[2]:
                 Fmin = 0.0001
                 if Cmax < 0.0001: Cmax = 0.0001
-                if C <= Fmin * Cmax:                  K = freundlich(Fmin * Cmax, self.Kf, self.N)[0]
-                else:                                 K = freundlich(C, self.Kf, self.N)[0]
+                K = freundlich(maximum(C, Fmin * Cmax), self.Kf, self.N)[0]
             if self.isotherm == self.isotherms[3]:
                 K = langmuir(C, self.qmax, self.b)[0]
-        else:
-            K = 0
+
         return K
 
     def get_NR(self, C, Cmax):
         """Takes the concentration "C" for the chemical "chemical" at
-         temperature "temp" and returns the partition coefficient at a point."""
+        temperature "temp" and returns the derivative of the isotherm.  "C"
+        may be a number or an array of concentrations at many points."""
+
+        C      = array(C, dtype = float)
+        K_diff = zeros(C.shape)
 
         if self.isotherm == self.isotherms[2]:
             Fmin = 0.0001
             if Cmax < 0.0001: Cmax = 0.0001
-            if C <=Fmin * Cmax:                   K_diff = freundlich(Fmin * Cmax, self.Kf, self.N)[1]
-            else:                                 K_diff = freundlich(C, self.Kf, self.N)[1]
+            K_diff = freundlich(maximum(C, Fmin * Cmax), self.Kf, self.N)[1]
         if self.isotherm == self.isotherms[3]:
             K_diff = langmuir(C, self.qmax, self.b)[1]
 
         return K_diff
 
-    def get_q(self, C):
-        """Takes the pore water concentrations "C" for the "Chemical" instance 
-        at "temp" and returns the solid-phase concentrations "q." """
+    def get_q(self, component, C):
+        """Takes the pore water concentrations "C" for the "Chemical" instance
+        at "temp" and returns the solid-phase concentrations "q" on
+        "component."  "C" may be a number or an array."""
+
+        C = array(C, dtype = float)
+        q = zeros(C.shape)
 
         if self.kinetic == self.kinetics[0]:
             if self.isotherm == self.isotherms[0]:
                 q = self.K * C
             if self.isotherm == self.isotherms[1]:
-                q = self.foc * 10**self.Koc * C
+                q = component.foc * 10**self.Koc * C
             if self.isotherm == self.isotherms[2]:
-                if C <= 0:
-                    q = 0
-                else:
-                    q = freundlich(C, self.Kf, self.N)[0] * C
+                i    = C > 0
+                q[i] = freundlich(C[i], self.Kf, self.N)[0] * C[i]
             if self.isotherm == self.isotherms[3]:
                 q = langmuir(C, self.qmax, self.b)[0] * C
-        else:
-            q = 0
 
         return q
 
@@ -1271,12 +1277,17 @@ class Layer:
         and the particle biodiffusion coefficient times the bulk density times 
         the partition coefficient."""
 
-        if   self.tort == self.torts[0]: tort = millquirk
-        elif self.tort == self.torts[1]: tort = boudreau
-        elif self.tort == self.torts[2]: tort = notort
+        tort = self.get_tortuosity()
 
         return (Dw * tort(e) + self.alpha * abs(Vdar))
 
+    def get_tortuosity(self):
+        """Returns the tortuosity correction function of the layer."""
+
+        if   self.tort == self.torts[0]: return millquirk
+        elif self.tort == self.torts[1]: return boudreau
+        elif self.tort == self.torts[2]: return notort
+
 class Reaction:
     """Stores basic properties of kinetic process for [layernumber]layer and [chemicalnumber] chemical"""
     
@@ -1866,6 +1877,22 @@ class System:
         self.tfinal       = 100
         self.outputsteps  = 100
 
+        #output specification: the stored variables, the depth window
+        #(top, bottom) and the chemical names (None for all)
+        self.outputvariables = ['C', 'F', 'q', 'qm', 'W', 'Cw', 'Fi']
+        self.outputdepths    = None
+        self.outputchemicals = None
+
+        #observation points (depth, variable, chemical name) with a variable
+        #of 'C', 'F', 'q', 'W' or 'Cw', sampled at every solver step, or at
+        #"observationsteps" times if it is not zero
+        self.observations     = []
+        self.observationsteps = 0
+
+        #names of the CSV files in the batch file directory with boundary
+        #concentration histories that are evaluated by superposition
+        self.historyfilenames = []
+
     def copy(self):
 
         system = System(self.version, self.fonttype, self.formulatype)
@@ -2000,6 +2027,15 @@ class System:
         self.tidalsteps   = solveroptions.tidalsteps.get()
         self.nonlinear    = solveroptions.nonlinear.get()
         self.nlerror      = solveroptions.nlerror.get()/100
+        self.nljacobian   = solveroptions.nljacobian.get()
+        self.nlpredictor  = solveroptions.nlpredictor.get()
+        self.gridoption   = solveroptions.gridoption.get()
+        self.gridnodes    = solveroptions.gridnodes.get()
+        self.deltoption   = solveroptions.deltoption.get()
+        self.deltmin      = min(solveroptions.deltmin.get(), self.delt)
+        if solveroptions.deltmax.get() > 0: self.deltmax = max(solveroptions.deltmax.get(), self.delt)
+        else:                               self.deltmax = max(float(self.tfinal) / self.outputsteps, self.delt)
+        self.delterror    = solveroptions.delterror.get()/100
         self.averageoption= solveroptions.averageoption.get()
         self.depgrid      = solveroptions.depgrid.get()
         self.depoption    = solveroptions.depoption
@@ -2011,6 +2047,51 @@ class System:
         self.csvfileoption = solveroptions.csvfileoption.get()
         self.csvfilename   = solveroptions.csvfilename.get()
 
+        self.historyfilenames = [name.strip() for name in solveroptions.historyname.get().split(';') if name.strip() != '']
+
+        self.get_outputspecification(solveroptions.outputvariables.get(), solveroptions.outputdepths.get(), solveroptions.outputchemicals.get())
+
+        self.observations     = self.read_observations(solveroptions.observations.get())
+        self.observationsteps = solveroptions.observationsteps.get()
+
+    def get_outputspecification(self, variables, depths, chemicals):
+        """Gets the output specification from the entries separated by
+        semicolons in "variables," "depths" (top and bottom) and "chemicals."
+        The pore water concentrations are always kept, and all the depths or
+        chemicals are kept if "depths" or "chemicals" is blank."""
+
+        names                = [name.strip() for name in variables.split(';')]
+        self.outputvariables = [name for name in ['C', 'F', 'q', 'qm', 'W', 'Cw', 'Fi'] if name == 'C' or names.count(name) > 0]
+
+        try:
+            top, bot          = [float(depth) for depth in depths.split(';')]
+            self.outputdepths = (min(top, bot), max(top, bot))
+        except: self.outputdepths = None
+
+        names = [name.strip() for name in chemicals.split(';') if name.strip() != '']
+        if len(names) > 0:  self.outputchemicals = names
+        else:               self.outputchemicals = None
+
+    def read_observations(self, points):
+        """Returns the observation points (depth, variable, chemical name)
+        from the entries "depth: variable: chemical" separated by semicolons
+        in "points," or None if an entry cannot be read, has a variable other
+        than 'C', 'F', 'q', 'W' or 'Cw' or names a chemical that is not in the
+        system."""
+
+        chemicals    = [chemical.name for chemical in self.chemicals]
+        observations = []
+        for entry in points.split(';'):
+            if entry.strip() != '':
+                try:    depth, name, chemical = [value.strip() for value in entry.split(':', 2)]
+                except: return None
+                try:    depth = float(depth)
+                except: return None
+                if ['C', 'F', 'q', 'W', 'Cw'].count(name) == 0 or chemicals.count(chemical) == 0: return None
+                observations.append((depth, name, chemical))
+
+        return observations
+
 class PlotData:
 
     def __init__(self, name):
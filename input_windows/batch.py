@@ -362,6 +362,21 @@ class BatchFile:
                     systems[-1].depoption    = content[row_solver[num] + 16][2]
                     systems[-1].depgrid      = int(content[row_solver[num] + 17][2])
                     systems[-1].averageoption= content[row_solver[num] + 18][2]
+                    systems[-1].nljacobian   = int(get_solveroption(content, row_solver[num], 'Iterations per Jacobian', 0))
+                    systems[-1].nlpredictor  = get_solveroption(content, row_solver[num], 'Initial guess', 'Linear extrapolation')
+                    systems[-1].gridoption   = get_solveroption(content, row_solver[num], 'Grid spacing', 'Uniform')
+                    systems[-1].gridnodes    = int(get_solveroption(content, row_solver[num], 'Graded grid points', int(sum(systems[-1].players) / 3)))
+                    systems[-1].deltoption   = get_solveroption(content, row_solver[num], 'Time step control', 'Fixed')
+                    systems[-1].deltmin      = float(get_solveroption(content, row_solver[num], 'Minimum time step', 0))
+                    systems[-1].deltmax      = float(get_solveroption(content, row_solver[num], 'Maximum time step', (systems[-1].tfinal - systems[-1].tstart) / systems[-1].outputsteps))
+                    systems[-1].delterror    = float(get_solveroption(content, row_solver[num], 'Time step error(%)', 0.1))/100
+                    systems[-1].historyfilenames = [name.strip() for name in get_solveroption(content, row_solver[num], 'Boundary history files', '').split(';') if name.strip() != '']
+                    systems[-1].get_outputspecification(get_solveroption(content, row_solver[num], 'Output variables', 'C; F; q; qm; W; Cw; Fi'),
+                                                        get_solveroption(content, row_solver[num], 'Output depths', ''),
+                                                        get_solveroption(content, row_solver[num], 'Output chemicals', ''))
+                    systems[-1].observations     = systems[-1].read_observations(get_solveroption(content, row_solver[num], 'Observation points', ''))
+                    systems[-1].observationsteps = int(get_solveroption(content, row_solver[num], 'Observation times', 0))
+                    if systems[-1].observations is None: return self.show_error()
 
                     systems[-1].taucoefs           = {}
                     systems[-1].taucoefs['Q']      = float(content[row_ow[num] + 1][2])
@@ -681,6 +696,21 @@ class BatchFile:
                     systems[-1].depoption    = content[row_solver[num] + 14][2]
                     systems[-1].depgrid      = int(content[row_solver[num] + 15][2])
                     systems[-1].averageoption= content[row_solver[num] + 16][2]
+                    systems[-1].nljacobian   = int(get_solveroption(content, row_solver[num], 'Iterations per Jacobian', 0))
+                    systems[-1].nlpredictor  = get_solveroption(content, row_solver[num], 'Initial guess', 'Linear extrapolation')
+                    systems[-1].gridoption   = get_solveroption(content, row_solver[num], 'Grid spacing', 'Uniform')
+                    systems[-1].gridnodes    = int(get_solveroption(content, row_solver[num], 'Graded grid points', int(sum(systems[-1].players) / 3)))
+                    systems[-1].deltoption   = get_solveroption(content, row_solver[num], 'Time step control', 'Fixed')
+                    systems[-1].deltmin      = float(get_solveroption(content, row_solver[num], 'Minimum time step', 0))
+                    systems[-1].deltmax      = float(get_solveroption(content, row_solver[num], 'Maximum time step', (systems[-1].tfinal - systems[-1].tstart) / systems[-1].outputsteps))
+                    systems[-1].delterror    = float(get_solveroption(content, row_solver[num], 'Time step error(%)', 0.1))/100
+                    systems[-1].historyfilenames = [name.strip() for name in get_solveroption(content, row_solver[num], 'Boundary history files', '').split(';') if name.strip() != '']
+                    systems[-1].get_outputspecification(get_solveroption(content, row_solver[num], 'Output variables', 'C; F; q; qm; W; Cw; Fi'),
+                                                        get_solveroption(content, row_solver[num], 'Output depths', ''),
+                                                        get_solveroption(content, row_solver[num], 'Output chemicals', ''))
+                    systems[-1].observations     = systems[-1].read_observations(get_solveroption(content, row_solver[num], 'Observation points', ''))
+                    systems[-1].observationsteps = int(get_solveroption(content, row_solver[num], 'Observation times', 0))
+                    if systems[-1].observations is None: return self.show_error()
 
                     systems[-1].taucoefs           = {}
                     systems[-1].taucoefs['Q']      = float(content[row_ow[num] + 1][2])
@@ -754,3 +784,15 @@ def make_batch(system):
     root.destroy()
 
     return root.window.systems, root.window.type, root.main.get()
+
+def get_solveroption(content, row, label, default):
+    """Returns the value of the solver option "label" from the "Solver
+    Options" section starting at "row," or "default" for files written before
+    the option was added."""
+
+    row = row + 1
+    while row < len(content) and len(content[row]) > 2 and content[row][0] == '':
+        if content[row][1] == label: return content[row][2]
+        row = row + 1
+
+    return default
@@ -21,6 +21,7 @@ class InputOptions:
         self.version     = system.version
         self.top         = None
 
+        self.system      = system
         self.adv         = system.adv
         self.timeunit    = system.timeunit
 
@@ -29,6 +30,14 @@ class InputOptions:
         self.inputname     = StringVar(value = 'input')
         self.csvfileoption = StringVar(value = self.csvfileoptions[0])
         self.csvfilename   = StringVar(value = 'input')
+        self.historyname   = StringVar(value = '')
+
+        self.outputvariables = StringVar(value = 'C; F; q; qm; W; Cw; Fi')
+        self.outputdepths    = StringVar(value = '')
+        self.outputchemicals = StringVar(value = '')
+
+        self.observations     = StringVar(value = '')
+        self.observationsteps = IntVar(value = 0)
 
         try:
             self.inputname.set(    system.cpsmfilename)
@@ -36,6 +45,20 @@ class InputOptions:
             self.csvfilename.set(  system.csvfilename)
         except: pass
 
+        try:    self.historyname.set('; '.join(system.historyfilenames))
+        except: pass
+
+        try:
+            self.outputvariables.set('; '.join(system.outputvariables))
+            if system.outputdepths is not None:     self.outputdepths.set(str(system.outputdepths[0]) + '; ' + str(system.outputdepths[1]))
+            if system.outputchemicals is not None:  self.outputchemicals.set('; '.join(system.outputchemicals))
+        except: pass
+
+        try:
+            self.observations.set('; '.join(['%s: %s: %s' % point for point in system.observations]))
+            self.observationsteps.set(system.observationsteps)
+        except: pass
+
     def make_widgets(self):
         """Make the widgets."""
 
@@ -60,6 +83,30 @@ class InputOptions:
         self.saveasentry   = Entry(self.frame, justify = 'center', width = 14, textvariable = self.csvfilename)
         self.saveassuffix  = Label(self.frame, text = '.csv')
 
+        self.historylabel  = Label(self.frame, text = 'Boundary history files:')
+        self.historyentry  = Entry(self.frame, justify = 'center', width = 14, textvariable = self.historyname)
+        self.historysuffix = Label(self.frame, text = '.csv (separated by ;)')
+
+        self.variableslabel  = Label(self.frame, text = 'Output variables:')
+        self.variablesentry  = Entry(self.frame, justify = 'center', width = 14, textvariable = self.outputvariables)
+        self.variablessuffix = Label(self.frame, text = '(C, F, q, qm, W, Cw, Fi)')
+
+        self.depthslabel     = Label(self.frame, text = 'Output depths:')
+        self.depthsentry     = Entry(self.frame, justify = 'center', width = 14, textvariable = self.outputdepths)
+        self.depthssuffix    = Label(self.frame, text = '(top; bottom, blank for all)')
+
+        self.chemicalslabel  = Label(self.frame, text = 'Output chemicals:')
+        self.chemicalsentry  = Entry(self.frame, justify = 'center', width = 14, textvariable = self.outputchemicals)
+        self.chemicalssuffix = Label(self.frame, text = '(blank for all)')
+
+        self.observationlabel  = Label(self.frame, text = 'Observation points:')
+        self.observationentry  = Entry(self.frame, justify = 'center', width = 14, textvariable = self.observations)
+        self.observationsuffix = Label(self.frame, text = '(depth: C, F, q, W or Cw: chemical; ...)')
+
+        self.stepslabel        = Label(self.frame, text = 'Observation times:')
+        self.stepsentry        = Entry(self.frame, justify = 'center', width = 14, textvariable = self.observationsteps)
+        self.stepssuffix       = Label(self.frame, text = '(0 for every time step)')
+
         #show the widgets that don't change on the grid
 
         self.instructions.grid(     row = 0, padx = 8, columnspan = 4, sticky = 'W')
@@ -77,6 +124,30 @@ class InputOptions:
         self.inputoptionlabel.grid( row = 3, column = 1, sticky = 'E',  padx = 2)
         self.inputoptionmenu.grid(  row = 3, column = 2, sticky = 'W',  padx = 1, columnspan = 2)
 
+        self.historylabel.grid(     row = 5, column = 1, sticky = 'E', padx = 2)
+        self.historyentry.grid(     row = 5, column = 2, sticky = 'WE',padx = 1)
+        self.historysuffix.grid(    row = 5, column = 3, sticky = 'W', padx = 2)
+
+        self.variableslabel.grid(   row = 6, column = 1, sticky = 'E', padx = 2)
+        self.variablesentry.grid(   row = 6, column = 2, sticky = 'WE',padx = 1)
+        self.variablessuffix.grid(  row = 6, column = 3, sticky = 'W', padx = 2)
+
+        self.depthslabel.grid(      row = 7, column = 1, sticky = 'E', padx = 2)
+        self.depthsentry.grid(      row = 7, column = 2, sticky = 'WE',padx = 1)
+        self.depthssuffix.grid(     row = 7, column = 3, sticky = 'W', padx = 2)
+
+        self.chemicalslabel.grid(   row = 8, column = 1, sticky = 'E', padx = 2)
+        self.chemicalsentry.grid(   row = 8, column = 2, sticky = 'WE',padx = 1)
+        self.chemicalssuffix.grid(  row = 8, column = 3, sticky = 'W', padx = 2)
+
+        self.observationlabel.grid( row = 9, column = 1, sticky = 'E', padx = 2)
+        self.observationentry.grid( row = 9, column = 2, sticky = 'WE',padx = 1)
+        self.observationsuffix.grid(row = 9, column = 3, sticky = 'W', padx = 2)
+
+        self.stepslabel.grid(       row = 10, column = 1, sticky = 'E', padx = 2)
+        self.stepsentry.grid(       row = 10, column = 2, sticky = 'WE',padx = 1)
+        self.stepssuffix.grid(      row = 10, column = 3, sticky = 'W', padx = 2)
+
         self.updatewidgets()
 
 
@@ -97,12 +168,29 @@ class InputOptions:
         else:
             self.blank6.grid(           row = 4, column = 0)
 
-        self.blank7.grid(           row = 5, column = 0)
+        self.blank7.grid(           row = 11, column = 0)
 
         self.focusbutton = None
         self.master.geometry()
         self.master.center()
 
+    def error_check(self, event = None):
+        """Checks the observation points and the number of observation
+        times."""
+
+        error = 0
+        try:
+            if self.system.read_observations(self.observations.get()) is None: error = 1
+            if self.observationsteps.get() < 0:                                error = 1
+        except: error = 1
+
+        return error
+
+    def warning(self):
+
+        tkmb.showerror(title = self.version, message = 'The observation points must be "depth: variable: chemical" separated by ";" with a variable of C, F, q, W or Cw and a chemical of the system, and the number of observation times can not be negative.')
+        self.focusbutton = None
+        self.master.tk.lift()
 
 
 def get_inputoptions(system, step):
@@ -120,6 +208,10 @@ def get_inputoptions(system, step):
             system.cpsmfilename  = 'input'
             system.csvfileoption = 'None'
             system.csvfilename   = 'input'
+            system.historyfilenames = []
+            system.get_outputspecification('C; F; q; qm; W; Cw; Fi', '', '')
+            system.observations     = []
+            system.observationsteps = 0
 
 
     root.destroy()
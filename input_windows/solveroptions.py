@@ -44,13 +44,22 @@ class SolverOptions:
             
         
         self.pvariables     = ['Use defaults', 'Specify manually']
-        self.nonlinears     = ['Newton method', 'Fixed Point Iteration']
+        self.nonlinears     = ['Newton method', 'Modified Newton method', 'Fixed Point Iteration']
+        self.nlpredictors   = ['Linear solve', 'Linear extrapolation', 'Quadratic extrapolation']
 
         self.ptypes         = ['Uniform size',  'Uniform Number', 'User-defined']
         self.tvariables     = ['slowest layer', 'geometric mean', 'User-defined']
         self.depoptions     = ['Time step size','Layer Grid size','User defined']
 
-        self.timeoptions    = ['Crank-Nicolson', 'Implicit']
+        self.timeoptions    = ['Crank-Nicolson', 'Implicit', 'Strang splitting', 'Steady state', 'Matrix exponential']
+
+        #there is no steady state with deposition, consolidation, oscillating
+        #flow or component mixing
+        if self.adv == 'Period oscillation' or self.dep == 'Deposition' or system.con == 'Consolidation' or system.biomix == 1:
+            self.timeoptions.remove('Steady state')
+
+        self.deltoptions    = ['Fixed', 'Adaptive']
+        self.gridoptions    = ['Uniform', 'Graded']
         self.averageoptions = ['Instaneous', 'Average']                                                     #simulation duration
 
         self.duration       = DoubleVar(value = 100)                                                        #simulation duration
@@ -60,6 +69,12 @@ class SolverOptions:
         self.ptotal         = IntVar(value = 0)                                                             #minimum grid points
         self.delt           = DoubleVar(value =  0)                                                         #minimumu time steps
         self.timeoption     = StringVar(value = self.timeoptions[0])
+        self.deltoption     = StringVar(value = self.deltoptions[0])                                        #time step control
+        self.gridoption     = StringVar(value = self.gridoptions[0])                                        #grid spacing
+        self.gridnodes      = IntVar(value = 0)                                                             #graded grid points
+        self.deltmin        = DoubleVar(value = 0)                                                          #minimum adaptive time step
+        self.deltmax        = DoubleVar(value = 0)                                                          #maximum adaptive time step
+        self.delterror      = DoubleVar(value = 0.1)                                                        #adaptive time step error tolerance
         self.ptype          = self.ptypes[2]
         self.tvariable      = self.tvariables[2]
         self.depoption      = self.depoptions[2]
@@ -70,6 +85,8 @@ class SolverOptions:
         self.depgrid        = IntVar(value = 1)                                                             #time steps within a depsition layer
         self.nonlinear      = StringVar(value = self.nonlinears[0])                                         #iteration flag
         self.nlerror        = DoubleVar(value = 1)                                                          #iteration error tolerance
+        self.nljacobian     = IntVar(value = 0)                                                             #iterations between Jacobian updates
+        self.nlpredictor    = StringVar(value = self.nlpredictors[1])                                       #initial guess for the iterations
 
         for layer in system.layers:
             self.players.append(10)
@@ -96,6 +113,26 @@ class SolverOptions:
 
         except: pass
 
+        if self.timeoptions.count(self.timeoption.get()) == 0: self.timeoption.set(self.timeoptions[0])
+
+        try:    self.nljacobian.set(system.nljacobian)
+        except: pass
+
+        try:    self.nlpredictor.set(system.nlpredictor)
+        except: pass
+
+        try:
+            self.gridoption.set(system.gridoption)
+            self.gridnodes.set(system.gridnodes)
+        except: pass
+
+        try:
+            self.deltoption.set(system.deltoption)
+            self.deltmin.set(system.deltmin)
+            self.deltmax.set(system.deltmax)
+            self.delterror.set(system.delterror * 100)
+        except: pass
+
         self.editflag = editflag
 
         if editflag == 1:
@@ -123,6 +160,19 @@ class SolverOptions:
         self.timeoptionmenu.config(width = 16)
         self.timeoptionwidget = Label(self.frame, textvariable = self.timeoption, width = 15, justify = 'center')
 
+        self.deltoptionlabel  = Label(self.frame, text = 'Time step control:')
+        self.deltoptionmenu   = OptionMenu(self.frame, self.deltoption, *self.deltoptions, command = self.updatedeltoption)
+        self.deltoptionmenu.config(width = 16)
+
+        self.deltminlabel     = Label(self.frame, text = 'Minimum time step ('+ self.timeunit + '):')
+        self.deltminentry     = Entry(self.frame, width = 15, justify= 'center', textvariable = self.deltmin)
+
+        self.deltmaxlabel     = Label(self.frame, text = 'Maximum time step ('+ self.timeunit + '):')
+        self.deltmaxentry     = Entry(self.frame, width = 15, justify= 'center', textvariable = self.deltmax)
+
+        self.delterrorlabel   = Label(self.frame, text = 'Time step error tolerance(%):')
+        self.delterrorentry   = Entry(self.frame, width = 15, justify= 'center', textvariable = self.delterror)
+
         self.averageoptionlabel = Label(self.frame, text = 'Oscillation output options:')
         self.averageoptionmenu  = OptionMenu(self.frame, self.averageoption, *self.averageoptions)
         self.averageoptionmenu.config(width = 16)
@@ -135,6 +185,13 @@ class SolverOptions:
         self.ptotalvalue      = Label(self.frame, textvariable = self.ptotal)
         self.ptotalentry      = Entry(self.frame, width = 15, justify= 'center', textvariable = self.ptotal)
 
+        self.gridoptionlabel  = Label(self.frame, text = 'Grid spacing:')
+        self.gridoptionmenu   = OptionMenu(self.frame, self.gridoption, *self.gridoptions, command = self.updategridoption)
+        self.gridoptionmenu.config(width = 16)
+
+        self.gridnodeslabel   = Label(self.frame, text = 'Number of graded grid points:')
+        self.gridnodesentry   = Entry(self.frame, width = 15, justify= 'center', textvariable = self.gridnodes)
+
         self.deltlabel        = Label(self.frame, text = 'Time step ('+ self.timeunit + '):')
         self.deltvalue        = Label(self.frame, textvariable = self.delt)
         self.deltentry        = Entry(self.frame, width = 15, justify= 'center', textvariable = self.delt)
@@ -145,6 +202,17 @@ class SolverOptions:
         self.tidallabel       = Label(self.frame, text = 'Time steps per oscillation circle:')
         self.tidalvalue       = Label(self.frame, textvariable = self.tidalsteps)
 
+        self.nonlinearlabel   = Label(self.frame, text = 'Non-linear solver:')
+        self.nonlinearmenu    = OptionMenu(self.frame, self.nonlinear, *self.nonlinears, command = self.updatenonlinear)
+        self.nonlinearmenu.config(width = 16)
+
+        self.nljacobianlabel  = Label(self.frame, text = 'Iterations per Jacobian (0 = time step):')
+        self.nljacobianentry  = Entry(self.frame, width = 15, justify= 'center', textvariable = self.nljacobian)
+
+        self.nlpredictorlabel = Label(self.frame, text = 'Initial guess:')
+        self.nlpredictormenu  = OptionMenu(self.frame, self.nlpredictor, *self.nlpredictors)
+        self.nlpredictormenu.config(width = 16)
+
         self.nlerrorlabel     = Label(self.frame, text = 'Error tolerance(%):')
         self.nlerrorentry     = Entry(self.frame, width = 15, justify= 'center', textvariable = self.nlerror)
 
@@ -176,6 +244,17 @@ class SolverOptions:
         self.timeoptionmenu.grid( row =  row, column = 1, sticky = 'WE')
         row = row + 1
 
+        if self.adv != 'Period oscillation' and self.dep != 'Deposition' and self.system.biomix == 0:
+
+            self.deltoptionlabel.grid(row =  row, column = 0, sticky = 'E', padx = 2, pady = 4)
+            self.deltoptionmenu.grid( row =  row, column = 1, sticky = 'WE')
+            row = row + 1
+
+            self.deltoptionrow = row
+            row = row + 3
+
+            self.updatedeltoption()
+
         if self.adv == 'Period oscillation':
 
             self.averageoptionlabel.grid(row =  row, column = 0, sticky = 'E', padx = 2, pady = 4)
@@ -190,6 +269,15 @@ class SolverOptions:
         self.ptotalvalue.grid(  row =  row, column = 1, pady = 2)
         row = row + 1
 
+        self.gridoptionlabel.grid(row =  row, column = 0, sticky = 'E', padx = 2, pady = 4)
+        self.gridoptionmenu.grid( row =  row, column = 1, sticky = 'WE')
+        row = row + 1
+
+        self.gridoptionrow = row
+        row = row + 1
+
+        self.updategridoption()
+
         self.deltlabel.grid(    row =  row, column = 0, sticky = 'E', padx = 2, pady = 4)
         self.deltvalue.grid(    row  =  row, column = 1, pady = 2)
         row = row + 1
@@ -205,11 +293,24 @@ class SolverOptions:
             row = row + 1
 
         if self.non_linear_check > 0:
-            
+
+            self.nonlinearlabel.grid(row =  row, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.nonlinearmenu.grid( row =  row, column = 1, sticky = 'WE')
+            row = row + 1
+
+            self.nljacobianrow = row
+            row = row + 1
+
+            self.nlpredictorlabel.grid(row =  row, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.nlpredictormenu.grid( row =  row, column = 1, sticky = 'WE')
+            row = row + 1
+
             self.nlerrorlabel.grid(  row =  row, column = 0, sticky = 'E',  padx = 2, pady = 4)
             self.nlerrorentry.grid(  row =  row, column = 1, padx = 1, pady = 2)
             row = row + 1
 
+            self.updatenonlinear()
+
         self.blank5.grid(row        =  row + 1)
         self.blank6.grid(row        =  row + 2)
 
@@ -217,6 +318,49 @@ class SolverOptions:
         self.master.geometry()
         self.master.center()
 
+    def updategridoption(self, event = None):
+        """Shows the number of grid points for the graded grid."""
+
+        if self.gridoption.get() == 'Graded':
+            if self.gridnodes.get() <= 0: self.gridnodes.set(int(self.ptotal.get() / 3))
+            self.gridnodeslabel.grid(row =  self.gridoptionrow, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.gridnodesentry.grid(row =  self.gridoptionrow, column = 1, padx = 1, pady = 2)
+        else:
+            self.gridnodeslabel.grid_forget()
+            self.gridnodesentry.grid_forget()
+
+    def updatedeltoption(self, event = None):
+        """Shows the step size bounds and error tolerance for adaptive time
+        steps."""
+
+        if self.deltoption.get() == 'Adaptive':
+            if self.deltmax.get() <= 0:              self.deltmax.set(float(self.duration.get()) / self.outputsteps.get())
+            if self.deltmax.get() < self.delt.get(): self.deltmax.set(self.delt.get())
+            if self.deltmin.get() <= 0 or self.deltmin.get() > self.delt.get(): self.deltmin.set(self.delt.get() / 100)
+            self.deltminlabel.grid(  row =  self.deltoptionrow,     column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.deltminentry.grid(  row =  self.deltoptionrow,     column = 1, padx = 1, pady = 2)
+            self.deltmaxlabel.grid(  row =  self.deltoptionrow + 1, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.deltmaxentry.grid(  row =  self.deltoptionrow + 1, column = 1, padx = 1, pady = 2)
+            self.delterrorlabel.grid(row =  self.deltoptionrow + 2, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.delterrorentry.grid(row =  self.deltoptionrow + 2, column = 1, padx = 1, pady = 2)
+        else:
+            self.deltminlabel.grid_forget()
+            self.deltminentry.grid_forget()
+            self.deltmaxlabel.grid_forget()
+            self.deltmaxentry.grid_forget()
+            self.delterrorlabel.grid_forget()
+            self.delterrorentry.grid_forget()
+
+    def updatenonlinear(self, event = None):
+        """Shows the Jacobian update option for the modified Newton method."""
+
+        if self.nonlinear.get() == 'Modified Newton method':
+            self.nljacobianlabel.grid(row =  self.nljacobianrow, column = 0, sticky = 'E',  padx = 2, pady = 4)
+            self.nljacobianentry.grid(row =  self.nljacobianrow, column = 1, padx = 1, pady = 2)
+        else:
+            self.nljacobianlabel.grid_forget()
+            self.nljacobianentry.grid_forget()
+
     def discretization(self, event = None):
         """Allows user to change discretization options."""
 
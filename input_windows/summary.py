@@ -1329,6 +1329,22 @@ class Summary:
         file.write(',Deposition option:,'+str(self.system.depoption)+'\n')
         file.write(',Steps in deposition grid,'+str(self.system.depgrid)+'\n')
         file.write(',Oscillation output options,'+str(self.system.averageoption)+'\n')
+        file.write(',Iterations per Jacobian,'+str(self.system.nljacobian)+'\n')
+        file.write(',Initial guess,'+self.system.nlpredictor+'\n')
+        file.write(',Grid spacing,'+self.system.gridoption+'\n')
+        file.write(',Graded grid points,'+str(self.system.gridnodes)+'\n')
+        file.write(',Time step control,'+self.system.deltoption+'\n')
+        file.write(',Minimum time step,'+str(self.system.deltmin)+'\n')
+        file.write(',Maximum time step,'+str(self.system.deltmax)+'\n')
+        file.write(',Time step error(%),'+str(self.system.delterror*100)+'\n')
+        file.write(',Boundary history files,'+';'.join(self.system.historyfilenames)+'\n')
+        file.write(',Output variables,'+'; '.join(self.system.outputvariables)+'\n')
+        if self.system.outputdepths is None:    file.write(',Output depths,\n')
+        else:                                   file.write(',Output depths,'+str(self.system.outputdepths[0])+'; '+str(self.system.outputdepths[1])+'\n')
+        if self.system.outputchemicals is None: file.write(',Output chemicals,\n')
+        else:                                   file.write(',Output chemicals,'+'; '.join(self.system.outputchemicals)+'\n')
+        file.write(',Observation points,'+'; '.join(['%s: %s: %s' % point for point in self.system.observations])+'\n')
+        file.write(',Observation times,'+str(self.system.observationsteps)+'\n')
 
         file.write('\n\n')
 
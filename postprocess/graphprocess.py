@@ -159,6 +159,10 @@ class Graphprocess:
             for row in file_content:    content.append(row)
             rows     = len(content)
             row = 0
+            row_flux      = 0
+            row_solid     = 0
+            row_whole     = 0
+            row_water     = 0
             row_solids    = []
             self.components.append(['Total solid'])
 
@@ -185,8 +189,12 @@ class Graphprocess:
                 MW = float(content[2][2])
 
                 concunit   = content[row_conc][1]
-                lengthunit = content[row_flux][3]
-                timeunit   = content[row_flux][5]
+                if row_flux != 0:
+                    lengthunit = content[row_flux][3]
+                    timeunit   = content[row_flux][5]
+                else:
+                    lengthunit = content[row_conc][4]
+                    timeunit   = content[row_conc][6]
 
             else:
                 MW = 1
@@ -266,7 +274,9 @@ class Graphprocess:
             for t in range(num_t):
                 self.times[-1].append(float(content[row][t+1]) * time_converter)
 
-            num_z = (row_flux-2) - (row_conc+3) + 1
+            num_z = 0
+            while row + num_z + 1 < rows and len(content[row + num_z + 1]) > 0 and content[row + num_z + 1][0] != '':
+                num_z = num_z + 1
             for z in range(num_z):
                 self.z[-1].append(float(content[row+z+1][0]) * length_converter)
 
@@ -306,9 +316,9 @@ class Graphprocess:
             for z in range(num_z):
                 for t in range(num_t):
                     self.C[-1][t,z] = float(content[row_conc + 3 + z][1 + t]) * conc_converter
-                    self.F[-1][t,z] = float(content[row_flux + 3 + z][1 + t]) * flux_converter
-                    self.q[-1][t,z] = float(content[row_solid + 3 + z][1 + t])* conc_converter
-                    self.W[-1][t,z] = float(content[row_whole + 3 + z][1 + t])* conc_converter
+                    if row_flux  != 0: self.F[-1][t,z] = float(content[row_flux + 3 + z][1 + t]) * flux_converter
+                    if row_solid != 0: self.q[-1][t,z] = float(content[row_solid + 3 + z][1 + t])* conc_converter
+                    if row_whole != 0: self.W[-1][t,z] = float(content[row_whole + 3 + z][1 + t])* conc_converter
                     for n in range(len(row_solids)):
                         self.qm[-1][t,z,n] = float(content[row_solids[n] + 3 + z][1 + t])* conc_converter
 
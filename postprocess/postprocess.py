@@ -3,7 +3,7 @@
 #!/usr/bin/env python
 #These subroutines are used in post-processing for CapSim.
 
-import matplotlib.pyplot as plt, tkMessageBox as tkmb, math, sys, os, codecs, _winreg as wreg
+import matplotlib.pyplot as plt, tkMessageBox as tkmb, math, sys, os, codecs, tempfile, shutil, _winreg as wreg
 import tkFileDialog as tkfd
 import matplotlib.patches  as patches
 import matplotlib.gridspec as gridspec
@@ -19,7 +19,8 @@ CapSimKey = wreg.OpenKey(CapSimReg, r'Software\CapSim')
 Filepath =wreg.QueryValueEx(CapSimKey, 'FilePath')[0]
 CapSimKey.Close()
 
-from numpy               import zeros, transpose, interp, array, isnan
+from numpy               import zeros, transpose, interp, array, isnan, save, load
+from numpy.lib.format    import open_memmap
 from capsim_object_types import System, CapSimWindow
 from datetime            import datetime
 from Tkinter             import Tk, Toplevel, Canvas, Frame, Label, Entry, Text, Button, Scrollbar, OptionMenu, StringVar, DoubleVar, IntVar, FLAT, RAISED, Checkbutton
@@ -53,7 +54,7 @@ class Postprocess:
         self.diffunit   = system.diffunit
 
         self.types        = ['Spatial profile', 'Time profile']
-        self.variables    = ['Concentration', 'Flux', 'Solid concentration', 'Total concentration', 'Water concentration', 'Material fraction']
+        self.variables    = get_stored_variables(output, ['Concentration', 'Flux', 'Solid concentration', 'Total concentration', 'Water concentration', 'Material fraction'])
 
         self.sketch       = {}
         self.sketch['Sketches'] = ['Show sketch', 'Hide sketch']
@@ -62,7 +63,7 @@ class Postprocess:
         self.sketch['Time']     = 0
         self.sketch['Depth']    = 0
 
-        self.chemicals  = [chemical.name for chemical in system.chemicals]
+        self.chemicals  = [chemical.name for chemical in output.chemicals]
 
         self.layer_h   =[0]
         for layer in system.layers:
@@ -169,7 +170,7 @@ class Postprocess:
 
         if self.top is None:
             self.top = CapSimWindow(master = self.master, buttons = 2)
-            self.top.make_window(GraphEditor(self.top, self.system, self.type, self.variable, self.spatialplotdatas, self.timeplotdatas, self.output.z, self.output.times))
+            self.top.make_window(GraphEditor(self.top, self.system, self.type, self.variable, self.spatialplotdatas, self.timeplotdatas, self.output.z, self.output.times, output = self.output))
 
             self.top.tk.mainloop()
 
@@ -1249,175 +1250,11 @@ class Postprocess:
     def make_csv_file(self, filename, chemical, MW):
         """This subroutine is used to create the output file for CapSim."""
 
-        lengthunits = ['um', 'cm', 'm']
-        concunits   = ['ug/L', 'mg/L', 'g/L', 'umol/L', 'mmol/L', 'mol/L']
-        timeunits   = ['s', 'min', 'hr', 'day', 'yr']
-
-        lengthunit  = lengthunits[self.system.lengthunits.index(self.lengthunit)]
-        concunit    = concunits[self.system.concunits.index(self.concunit)]
-        timeunit    = timeunits[self.system.timeunits.index(self.timeunit)]
-
-        fluxunit    = concunit[:-2]+ ',/,'+ lengthunit + '^2' + ',/,' + timeunit
-
-
-        file = open(filename + '.csv', 'w')
-
-        file.write('CapSim,'+self.system.version + '\n\n')
-
-        if self.chemicals.count(chemical) > 0:
-
-            n = self.chemicals.index(chemical)
-
-            file.write('Chemical,' + chemical + ',' + str(MW)  +'\n')
-
-            file.write('Layers')
-            for layer in self.system.layers:
-                file.write(',' + layer.type)
-            file.write('\n')
-
-            file.write('Thickness')
-            for layer in self.system.layers:
-                file.write( ',' + str(layer.h))
-            file.write('\n')
-
-            file.write('Bioturbation,')
-            if self.system.bio <> 'None':
-                file.write(str(self.system.hbio))
-            else:
-                file.write('0')
-            file.write('\n')
-            file.write('\n')
-
-            file.write('Pore water concentrations,' + concunit + '\n,Times\n Depths,')
-            for t in self.output.times: file.write('%.3e,' % t)
-            file.write('\n')
-            for i in range(len(self.output.z)):
-                file.write('%.3e,' % self.output.z[i])
-
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.output.C[j, i, n])
-
-                file.write('\n')
-            file.write('\n')
-
-            file.write('Fluxes,' + fluxunit + '\n,Times\nDepths,')
-            for t in self.output.times: file.write('%.3e,' % t)
-            file.write('\n')
-            for i in range(len(self.output.z)):
-                file.write('%.3e,' % self.output.z[i])
-
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.output.F[j, i, n])
-
-                file.write('\n')
-            file.write('\n')
-
-            file.write('Total concentrations,' + concunit  + '\n,Times\nDepths,')
-            for t in self.output.times: file.write('%.3e,' % t)
-            file.write('\n')
-
-            for i in range(len(self.output.z)):
-                file.write('%.3e' % self.output.z[i] + ',')
-
-                for j in range(len(self.output.times)):
-                    file.write('%.3e' % self.output.W[j, i, n] + ',')
-
-                file.write('\n')
-            file.write('\n')
-
-            file.write('Solid concentrations,' + 'Total solid,' + concunit[:-1] + 'kg' + '\n,Times\nDepths,')
-            for t in self.output.times: file.write('%.3e,' % t)
-            file.write('\n')
-
-            for i in range(len(self.output.z)):
-                file.write('%.3e,' % self.output.z[i])
-
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.output.q[j, i, n])
-
-                file.write('\n')
-            file.write('\n')
-
-            for component in self.system.components:
-                file.write('Solid concentrations,' + component.name + ',' + concunit[:-1] + 'kg' + '\n,Times\nDepths,')
-                for t in self.output.times: file.write('%.3e,' % t)
-                file.write('\n')
-
-                for i in range(len(self.output.z)):
-                    file.write('%.3e,' % self.output.z[i])
-
-                    for j in range(len(self.output.times)):
-                        file.write('%.3e,' % self.output.qm[j, i, n, self.system.components.index(component)])
-
-                    file.write('\n')
-                file.write('\n')
-
-            if self.system.topBCtype == 'Finite mixed water column':
-                file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
-                for t in self.output.times: file.write('%.3e,' % t)
-                file.write('\n')
-                file.write(',')
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.output.Cw[j, n])
-                file.write('\n')
-
-            elif self.system.topBCtype == 'Mass transfer':
-                file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
-                for t in self.output.times: file.write('%.3e,' % t)
-                file.write('\n')
-                file.write(',')
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.system.BCs[self.system.chemicals[n].name].Cw)
-                file.write('\n')
-
-            else:
-                file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
-                for t in self.output.times: file.write('%.3e,' % t)
-                file.write('\n')
-                file.write(',')
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.system.BCs[self.system.chemicals[n].name].Co)
-                file.write('\n')
-
-        else:
-
-            n = self.system.component_list.index(chemical)
-
-            file.write('Material,' + chemical + '\n')
-
-            file.write('Layers')
-            for layer in self.system.layers:
-                file.write(',' + layer.type)
-            file.write('\n')
-
-            file.write('Thickness')
-            for layer in self.system.layers:
-                file.write( ',' + str(layer.h))
-            file.write('\n')
-
-            file.write('Bioturbation,')
-            if self.system.bio <> 'None':
-                file.write(str(self.system.hbio))
-            else:
-                file.write('0')
-            file.write('\n')
-            file.write('\n')
-
-            file.write('Volume fraction,' + '\n,Times\n Depths,')
-            for t in self.output.times: file.write('%.3e,' % t)
-            file.write('\n')
-            for i in range(len(self.output.z)):
-                file.write('%.3e,' % self.output.z[i])
-
-                for j in range(len(self.output.times)):
-                    file.write('%.3e,' % self.output.Fi[j, i, n])
-
-                file.write('\n')
-            file.write('\n')
+        write_csv_file(filename, self.system, self.output, chemical, MW)
 
 class GraphEditor:
 
-    def __init__(self, master, system, type, variable, spatialplotdatas, timeplotdatas, outputz, outputt):
+    def __init__(self, master, system, type, variable, spatialplotdatas, timeplotdatas, outputz, outputt, output = None):
 
         self.master    = master
         self.version   = system.version
@@ -1430,8 +1267,9 @@ class GraphEditor:
         self.system    = system
 
         self.components = ['Total solid']
-        for component in system.component_list:
-            self.components.append(component)
+        if output is None or output.qm is not None:
+            for component in system.component_list:
+                self.components.append(component)
 
         rgb            = self.master.frame.winfo_rgb(self.master.frame.cget('bg'))
         self.color     = '#%02x%02x%02x' %rgb
@@ -1445,10 +1283,15 @@ class GraphEditor:
             self.variables =      ['Concentration', 'Flux', 'Solid concentration', 'Total concentration']
             self.extravariables = ['Concentration', 'Flux', 'Solid concentration', 'Total concentration', 'Water concentration']
 
+        if output is not None:
+            self.variables      = get_stored_variables(output, self.variables)
+            self.extravariables = get_stored_variables(output, self.extravariables)
+
         self.type      = StringVar(value = type)
         self.variable  = StringVar(value = variable)
 
-        self.chemical_list  = [chemical.name     for chemical in system.chemicals]
+        if output is not None: self.chemical_list  = [chemical.name     for chemical in output.chemicals]
+        else:                  self.chemical_list  = [chemical.name     for chemical in system.chemicals]
 
         self.timeunit   = system.timeunit
         self.lengthunit = system.lengthunit
@@ -2164,12 +2007,12 @@ class ResultExporter:
         self.cancelflag =  0
 
         self.types      = ['CSV file', 'Doc Report']
-        self.chemicals  = [chemical.name for chemical in system.chemicals]
-        self.MWs        = [chemical.MW   for chemical in system.chemicals]
+        self.chemicals  = [chemical.name for chemical in output.chemicals]
+        self.MWs        = [chemical.MW   for chemical in output.chemicals]
         self.components = [component.name for component in system.components]
 
-        if system.biomix == 1:  self.list = self.chemicals + self.components
-        else:                   self.list = self.chemicals
+        if system.biomix == 1 and output.Fi is not None: self.list = self.chemicals + self.components
+        else:                                            self.list = self.chemicals
 
         self.type      = StringVar(value = self.types[0])
         self.name      = StringVar(value = 'output')
@@ -2316,54 +2159,303 @@ def postprocess_data(system, output):
     
     return main
 
-def postprocess_batch(type, systems, outputs):
-    """Shows the results of the simulation."""
+class BatchWriter:
+    """Writes the results of a batch run to CSV files as each system is
+    finished, so the outputs do not have to be kept until the end of the
+    batch.  The files have the layout of "write_csv_file" and are named
+    after the system and the chemical in the output directory.  For a
+    "Continuous" batch the profiles of the pore water, solid and total
+    concentrations and fluxes of each system are spooled to .npy files in a
+    temporary directory and joined into one file for each chemical when the
+    batch is closed, so only one system is held in memory at a time."""
+
+    def __init__(self, type, path = None):
+        """Constructor method."""
+
+        self.type      = type
+        self.path      = path
+        self.filenames = []
+        self.times     = [0]
+        self.profiles  = {}
+        self.first     = None
+        self.last      = None
+        self.system    = None
+        self.storage   = None
+
+        if self.path is None: self.path = Filepath + '\output\\'
+
+    def write(self, system, output, name = None):
+        """Writes the CSV files of a finished "system" or spools the profiles
+        of "output" to be joined, and releases the output arrays.  Separate
+        files are named after "name" if it is given instead of the system."""
+
+        if name is None: name = system.filename
+
+        if self.type == 'Separate':
+            for chemical in output.chemicals:
+                filename = self.path + '\\' + name + '_' + chemical.name
+                write_csv_file(filename, system, output, chemical.name, chemical.MW)
+                self.filenames.append(filename + '.csv')
+            output.remove_store()
+        else:
+            if self.storage is None: self.storage = tempfile.mkdtemp(prefix = 'capsim_batch_')
+            if self.first is None:
+                self.first = dict([(name, getattr(output, name)[0, :, :].copy()) for name in ['C', 'F', 'q', 'W'] if getattr(output, name) is not None])
+            for name in ['C', 'F', 'q', 'W']:
+                if getattr(output, name) is not None:
+                    if not self.profiles.has_key(name): self.profiles[name] = []
+                    filename = os.path.join(self.storage, name + '_' + str(len(self.profiles[name])) + '.npy')
+                    save(filename, getattr(output, name)[1:, :, :])
+                    self.profiles[name].append(filename)
+            self.times  = self.times + output.times[1:]
+            if self.last is not None: self.last.remove_store()
+            self.last   = output
+            self.system = system
+
+    def close(self):
+        """Joins the spooled profiles of a "Continuous" batch on the grid of
+        the last system in memory-mapped arrays and writes the CSV files."""
+
+        if self.type == 'Separate' or self.last is None: return
+
+        output_s       = self.last.copy()
+        output_s.times = self.times
+
+        for name in self.profiles.keys():
+            X = open_memmap(os.path.join(self.storage, name + '.npy'), mode = 'w+', dtype = float, shape = (len(output_s.times), len(self.last.z), self.last.nchemicals))
+            X[0, (len(self.last.z)-len(self.first[name])):, :] = self.first[name]
+
+            time_index = 1
+            for filename in self.profiles[name]:
+                profiles = load(filename, mmap_mode = 'r')
+                z_index  = len(self.last.z)-profiles.shape[1]
+                X[time_index:time_index+len(profiles), z_index:, :] = profiles
+
+                time_index = time_index + len(profiles)
+                profiles   = None
+
+            setattr(output_s, name, X)
+            X = None
+
+        for chemical in self.last.chemicals:
+            filename = self.path + '\\' + self.system.filename + '_' + chemical.name
+            write_csv_file(filename, self.system, output_s, chemical.name, chemical.MW)
+            self.filenames.append(filename + '.csv')
+
+        #the joined arrays are only referenced by "output_s," so releasing
+        #them unmaps the files before the spool directory is deleted
+        output_s.remove_store()
+        for name in self.profiles.keys(): setattr(output_s, name, None)
+        output_s = None
+
+        self.remove_store()
+
+    def remove_store(self):
+        """Releases the last output and deletes the spooled profiles."""
+
+        if self.last is not None: self.last.remove_store()
+        self.last     = None
+        self.profiles = {}
+
+        if self.storage is not None:
+            shutil.rmtree(self.storage, ignore_errors = True)
+            if not os.path.exists(self.storage): self.storage = None
+
+def write_csv_file(filename, system, output, chemical, MW):
+    """Writes the profiles of "chemical" (or of the material fraction of a
+    component) in "output" to the CSV file "filename." """
+
+    lengthunits = ['um', 'cm', 'm']
+    concunits   = ['ug/L', 'mg/L', 'g/L', 'umol/L', 'mmol/L', 'mol/L']
+    timeunits   = ['s', 'min', 'hr', 'day', 'yr']
+
+    lengthunit  = lengthunits[system.lengthunits.index(system.lengthunit)]
+    concunit    = concunits[system.concunits.index(system.concunit)]
+    timeunit    = timeunits[system.timeunits.index(system.timeunit)]
+
+    fluxunit    = concunit[:-2]+ ',/,'+ lengthunit + '^2' + ',/,' + timeunit
+
+
+    file = open(filename + '.csv', 'w')
 
-    top = CapSimWindow(buttons = 1)
+    file.write('CapSim,'+system.version + '\n\n')
+
+    chemicals   = [outputchemical.name for outputchemical in output.chemicals]
+
+    if chemicals.count(chemical) > 0:
+
+        n = chemicals.index(chemical)
+
+        file.write('Chemical,' + chemical + ',' + str(MW)  +'\n')
+
+        file.write('Layers')
+        for layer in system.layers:
+            file.write(',' + layer.type)
+        file.write('\n')
+
+        file.write('Thickness')
+        for layer in system.layers:
+            file.write( ',' + str(layer.h))
+        file.write('\n')
+
+        file.write('Bioturbation,')
+        if system.bio <> 'None':
+            file.write(str(system.hbio))
+        else:
+            file.write('0')
+        file.write('\n')
+        file.write('\n')
+
+        file.write('Pore water concentrations,' + concunit + ',' + fluxunit + '\n,Times\n Depths,')
+        for t in output.times: file.write('%.3e,' % t)
+        file.write('\n')
+        for i in range(len(output.z)):
+            file.write('%.3e,' % output.z[i])
+
+            for j in range(len(output.times)):
+                file.write('%.3e,' % output.C[j, i, n])
+
+            file.write('\n')
+        file.write('\n')
+
+        if output.F is not None:
+            file.write('Fluxes,' + fluxunit + '\n,Times\nDepths,')
+            for t in output.times: file.write('%.3e,' % t)
+            file.write('\n')
+            for i in range(len(output.z)):
+                file.write('%.3e,' % output.z[i])
+
+                for j in range(len(output.times)):
+                    file.write('%.3e,' % output.F[j, i, n])
+
+                file.write('\n')
+            file.write('\n')
+
+        if output.W is not None:
+            file.write('Total concentrations,' + concunit  + '\n,Times\nDepths,')
+            for t in output.times: file.write('%.3e,' % t)
+            file.write('\n')
+
+            for i in range(len(output.z)):
+                file.write('%.3e' % output.z[i] + ',')
+
+                for j in range(len(output.times)):
+                    file.write('%.3e' % output.W[j, i, n] + ',')
+
+                file.write('\n')
+            file.write('\n')
+
+        if output.q is not None:
+            file.write('Solid concentrations,' + 'Total solid,' + concunit[:-1] + 'kg' + '\n,Times\nDepths,')
+            for t in output.times: file.write('%.3e,' % t)
+            file.write('\n')
+
+            for i in range(len(output.z)):
+                file.write('%.3e,' % output.z[i])
+
+                for j in range(len(output.times)):
+                    file.write('%.3e,' % output.q[j, i, n])
+
+                file.write('\n')
+            file.write('\n')
+
+        if output.qm is not None:
+            for component in system.components:
+                file.write('Solid concentrations,' + component.name + ',' + concunit[:-1] + 'kg' + '\n,Times\nDepths,')
+                for t in output.times: file.write('%.3e,' % t)
+                file.write('\n')
+
+                for i in range(len(output.z)):
+                    file.write('%.3e,' % output.z[i])
+
+                    for j in range(len(output.times)):
+                        file.write('%.3e,' % output.qm[j, i, n, system.components.index(component)])
+
+                    file.write('\n')
+                file.write('\n')
+
+        if system.topBCtype == 'Finite mixed water column':
+            if output.Cw is not None:
+                file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
+                for t in output.times: file.write('%.3e,' % t)
+                file.write('\n')
+                file.write(',')
+                for j in range(len(output.times)):
+                    file.write('%.3e,' % output.Cw[j, n])
+                file.write('\n')
+
+        elif system.topBCtype == 'Mass transfer':
+            file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
+            for t in output.times: file.write('%.3e,' % t)
+            file.write('\n')
+            file.write(',')
+            for j in range(len(output.times)):
+                file.write('%.3e,' % system.BCs[chemical].Cw)
+            file.write('\n')
+
+        else:
+            file.write('Overlying water concentrations,' + concunit + '\n,Times\n Depths,')
+            for t in output.times: file.write('%.3e,' % t)
+            file.write('\n')
+            file.write(',')
+            for j in range(len(output.times)):
+                file.write('%.3e,' % system.BCs[chemical].Co)
+            file.write('\n')
+
+        for i in range(len(output.points)):
+            depth, name, pointchemical = output.points[i]
+            if pointchemical == chemical:
+                times, values = output.get_observation(i)
+                file.write('\nObservation point,' + name + ',' + '%.3e' % depth + '\nTimes,')
+                for t in times: file.write('%.3e,' % t)
+                file.write('\n,')
+                for value in values: file.write('%.3e,' % value)
+                file.write('\n')
 
-    if type == 'Separate':
-        for system in systems:
-            output = outputs[systems.index(system)]
-            postprocess = Postprocess(top, system, output, batch_type = 'batch')
-            for chemical in system.chemicals:
-                filename = postprocess.graphpath + '\\' + system.filename + '_' + chemical.name
-                postprocess.make_csv_file(filename, chemical.name, chemical.MW)
     else:
-        output_s = outputs[-1].copy()
 
-        output_s.times = [0]
+        n = system.component_list.index(chemical)
 
-        for output in outputs:
-            output_s.times = output_s.times + output.times[1:]
+        file.write('Material,' + chemical + '\n')
 
-        output_s.C  = zeros((len(output_s.times), len(outputs[-1].z), systems[-1].nchemicals))
-        output_s.F  = zeros((len(output_s.times), len(outputs[-1].z), systems[-1].nchemicals))
-        output_s.q  = zeros((len(output_s.times), len(outputs[-1].z), systems[-1].nchemicals))
-        output_s.W  = zeros((len(output_s.times), len(outputs[-1].z), systems[-1].nchemicals))
+        file.write('Layers')
+        for layer in system.layers:
+            file.write(',' + layer.type)
+        file.write('\n')
 
-        output_s.C[0, (len(outputs[-1].z)-len(outputs[0].z)):, :] = outputs[0].C[0, :, :]
-        output_s.F[0, (len(outputs[-1].z)-len(outputs[0].z)):, :] = outputs[0].F[0, :, :]
-        output_s.q[0, (len(outputs[-1].z)-len(outputs[0].z)):, :] = outputs[0].q[0, :, :]
-        output_s.W[0, (len(outputs[-1].z)-len(outputs[0].z)):, :] = outputs[0].W[0, :, :]
+        file.write('Thickness')
+        for layer in system.layers:
+            file.write( ',' + str(layer.h))
+        file.write('\n')
 
-        time_index = 1
-        for output in outputs:
-            z_index = len(outputs[-1].z)-len(output.z)
-            for t in range(len(output.times)-1):
-                output_s.C[time_index+t, z_index:, :] = output.C[t+1, :, :]
-                output_s.F[time_index+t, z_index:, :] = output.F[t+1, :, :]
-                output_s.q[time_index+t, z_index:, :] = output.q[t+1, :, :]
-                output_s.W[time_index+t, z_index:, :] = output.W[t+1, :, :]
+        file.write('Bioturbation,')
+        if system.bio <> 'None':
+            file.write(str(system.hbio))
+        else:
+            file.write('0')
+        file.write('\n')
+        file.write('\n')
+
+        file.write('Volume fraction,' + '\n,Times\n Depths,')
+        for t in output.times: file.write('%.3e,' % t)
+        file.write('\n')
+        for i in range(len(output.z)):
+            file.write('%.3e,' % output.z[i])
+
+            for j in range(len(output.times)):
+                file.write('%.3e,' % output.Fi[j, i, n])
+
+            file.write('\n')
+        file.write('\n')
 
-            time_index = time_index + len(output.times) - 1
+    file.close()
 
-        postprocess = Postprocess(top, systems[-1], output_s, batch_type = 'batch')
+def get_stored_variables(output, variables):
+    """Returns the plot "variables" whose arrays are stored in "output." """
 
-        for chemical in systems[-1].chemicals:
-            filename = postprocess.graphpath + '\\' + systems[-1].filename + '_' + chemical.name
-            postprocess.make_csv_file(filename, chemical.name, chemical.MW)
+    arrays = {'Concentration': 'C', 'Flux': 'F', 'Solid concentration': 'q', 'Total concentration': 'W', 'Water concentration': 'Cw', 'Material fraction': 'Fi'}
 
-    top.destroy()
+    return [variable for variable in variables if getattr(output, arrays[variable], None) is not None]
 
 def time_interpolate(tint, t, delt, Cn, Cn_plus_1):
     """Returns the interpolated concentrations at time "tint" using the
@@ -5,7 +5,8 @@
 import tkMessageBox as tkmb, time as timer
 
 from Tkinter             import Frame, Label, Button, StringVar, IntVar
-from solver_routines     import Parameters, Output
+from solver_routines     import Parameters, Output, UnitResponses, read_BC_history
+from postprocess         import BatchWriter
 from capsim_object_types import CapSimWindow
 
 class Solver:
@@ -91,7 +92,8 @@ class Solver:
         cons    = self.parameters.con
         dep     = self.parameters.dep
         tidal   = self.parameters.tidal
-        reac    = self.parameters.reac
+        reac    = self.parameters.reac * (1 - self.parameters.splitting)    #split reactions leave the transport linear
+        split   = self.parameters.splitting
         bio     = self.parameters.bio
         biomix  = self.parameters.biomix
 
@@ -103,7 +105,7 @@ class Solver:
 
         #determine the grid, time step size, and set up the equations for the 
         #finite differencing
-        self.parameters.make_uniform_grid()
+        self.parameters.make_grid()
         if bio == 1:
             self.parameters.update_bioturbation()
             self.parameters.make_grid_Dbiops()
@@ -144,14 +146,49 @@ class Solver:
         results = self.output.converter(self.parameters, Cn, FisL)
         for variable in variable_list:
             Temp[variable].append(results[variable_list.index(variable)])
+        self.output.observe(t, self.parameters, Cn, FisL)
 
         t_start      = 0
         t_end        = 0
 
-        while t < (self.parameters.tfinal_ori + self.parameters.delt * (2 + self.parameters.steps)): #loop through time to the simulation end
+        #adaptive time steps are only taken if the matrices do not depend on
+        #a fixed step size (deposition grid, oscillation period, averaging)
+        adapt   = self.parameters.adaptive * ((dep + tidal + biomix) == 0) * (self.parameters.averageoption == 'Instaneous')
+        delt    = self.parameters.delt
+        rebuild = 0
+        retry   = 0
+
+        #the steady state is solved directly and stored as the only profile
+        steady  = self.parameters.steady
+        if steady == 1:
+            Cn      = self.parameters.steady_state_solver(Cn, Fis, FisL)
+            if self.parameters.steadyerror is not None: self.show_steady_warning(self.parameters.steadyerror)
+            results = self.output.converter(self.parameters, Cn, FisL)
+            self.output.store(t, self.parameters.tfinal_ori, self.parameters, results, results)
+            self.output.observe(self.parameters.tfinal_ori, self.parameters, Cn, FisL)
+
+        #linear systems with constant coefficients are advanced exactly from
+        #one output time to the next
+        expo    = self.parameters.exponential * ((dep + cons + tidal + biomix + sorp + reac) == 0) * (self.parameters.averageoption == 'Instaneous')
+        if expo == 1:
+            while self.output.n < len(self.output.times):
+                t_plus_1  = self.output.times[self.output.n]
+                if t_plus_1 > t:
+                    Cn_plus_1      = self.parameters.exponential_solver(Cn, t_plus_1 - t)
+                    results_plus_1 = self.output.converter(self.parameters, Cn_plus_1, FisL)
+                    self.output.store(t, t_plus_1, self.parameters, results, results_plus_1)
+                    self.output.observe(t_plus_1, self.parameters, Cn_plus_1, FisL)
+                    t       = t_plus_1
+                    Cn      = Cn_plus_1
+                    results = results_plus_1
+                else:
+                    self.output.store(t - 1, t, self.parameters, results, results)
+
+        while t < (self.parameters.tfinal_ori + self.parameters.delt * (2 + self.parameters.steps)) and ((adapt + steady + expo) == 0 or self.output.n < len(self.output.times)): #loop through time to the simulation end
 
+            if adapt == 1:  rebuild = self.parameters.set_time_step(delt, t, self.output.get_next_time(t))
             if dep  == 1:   Cn, Fis_plus_1, FisL_plus_1, FisM_plus_1 = self.parameters.update_deposition(Cn, Fis, FisL, FisM, t+self.parameters.delt)
-            self.parameters.update_time_dependents()
+            if retry == 0:  self.parameters.update_time_dependents()
             if cons == 1:
                 self.parameters.update_consolidation(t+self.parameters.delt, self.parameters.Vdar)
                 if tidal == 1: self.parameters.update_tidal(t+self.parameters.delt, self.parameters.U_plus_1)
@@ -167,14 +204,31 @@ class Solver:
             if (cons + tidal + biomix) > 0:
                 self.parameters.make_transport_parameter_vectors()
 
-            if (cons + tidal + dep + biomix + sorp + reac) > 0:
+            if tidal == 1 and (cons + dep + biomix + sorp + reac) == 0:
+                self.parameters.make_tidal_matrices(t+self.parameters.delt)
+            elif (cons + tidal + dep + biomix + sorp + reac) > 0 or rebuild == 1:
                 self.parameters.make_matrices()
 
-            if sorp == 1 or reac == 1:
+            if split == 1:
+                Cn_plus_1 = self.parameters.split_solver(Cn, Fis_plus_1)
+            elif sorp == 1 or reac == 1:
                 Cn_plus_1 = self.parameters.non_linear_solver(Cn, Fis_plus_1, FisL_plus_1)
             else:
                 Cn_plus_1 = self.parameters.get_Cn_plus_1(Cn)
 
+            #repeat the step with a smaller step size if the error is too large
+            if adapt == 1:
+                error = self.parameters.get_time_step_error(Cn, Cn_plus_1)
+                delt  = self.parameters.get_time_step(error)
+                if error is not None and error > 1:
+                    if self.parameters.delt > self.parameters.deltmin:
+                        retry = 1
+                        continue
+                    #the step cannot be reduced any further, so it is kept
+                    #and reported after the simulation
+                    self.parameters.steperrors.append(t + self.parameters.delt)
+                retry = 0
+
             #collect the pertinent data from the time step
             if self.parameters.averageoption == 'Instaneous' and dep != 1:
                 if self.output.n < len(self.output.times):
@@ -202,16 +256,16 @@ class Solver:
                     t_start = t_middle
                     t_end   = t+self.parameters.delt
 
+            self.parameters.update_history(Cn)
+
             t  = t + self.parameters.delt
-            Cn = [C for C in Cn_plus_1]
+            #the solvers and component updates return new arrays, so the
+            #state is advanced by rebinding the names instead of copying;
+            #the arrays of each step are still newly allocated
+            Cn = Cn_plus_1
             if biomix ==1 or dep == 1:
-                Fis  = {}
-                FisL = {}
-                FisM = {}
-                for component in self.parameters.components:
-                    Fis[component.name]  = [Fi for Fi in Fis_plus_1[component.name]]
-                    FisL[component.name] = [Fi for Fi in FisL_plus_1[component.name]]
-                    FisM[component.name] = [Fi for Fi in FisM_plus_1[component.name]]
+                Fis, FisL, FisM = Fis_plus_1, FisL_plus_1, FisM_plus_1
+            self.output.observe(t, self.parameters, Cn, FisL)
 
             self.progress.set('Simulation Progress: ' + str(int(t)) + ' / ' + str(int(self.parameters.tfinal_ori)) + ' ' + self.parameters.timeunit )
             self.remaintime.set('Approximate Remaining Time: %d Seconds' %((timer.time()-start)*(self.parameters.tfinal-t)/t))
@@ -220,6 +274,9 @@ class Solver:
 
         self.Cn = Cn
 
+        if self.abort.get() == 0 and len(self.parameters.steperrors) > 0:
+            self.show_step_warning(len(self.parameters.steperrors), self.parameters.steperrors[0])
+
         if self.abort.get() == 0: #checks if the abort button was invoked
 
             #postprocess and store the data in an "Output" object
@@ -238,6 +295,27 @@ class Solver:
             self.output = None
             self.frame.quit()
     
+    def show_step_warning(self, steps, t):
+        """Warns that adaptive time steps were accepted at the minimum step
+        size although their error was above the tolerance."""
+
+        tkmb.showwarning(title = 'Time Step Warning', message = 'The time ' +
+                         'step error exceeded the tolerance at the minimum ' +
+                         'time step in ' + str(steps) + ' time step(s), ' +
+                         'first at ' + str(round(t, 8)) + '.  Please ' +
+                         'decrease the minimum time step or increase the ' +
+                         'time step error to rectify this issue.')
+
+    def show_steady_warning(self, error):
+        """Warns that the nonlinear steady state iterations did not
+        converge."""
+
+        tkmb.showwarning(title = 'Steady State Warning', message = 'The ' +
+                         'steady state iterations did not converge (the ' +
+                         'relative change of the last iteration is ' +
+                         '%.3g' % error + ').  Please check the results ' +
+                         'or solve the system in time to rectify this issue.')
+
     def show_size_error(self):
         """Shows ann error if the user specifies an overly complicated system
         that requires too much memory allocation."""
@@ -267,10 +345,12 @@ class BatchSolver:
         self.remaintime = StringVar(value = '') #percent complete
         self.abort      = IntVar()              #abort flag
         self.type       = type
-        self.parameters = []
+        self.systems    = systems
         self.outputs    = []
-        for system in systems:
-            self.parameters.append(Parameters(system))     #input system
+        self.writer     = BatchWriter(type)   #writes each finished system
+
+        try:    self.tstart = systems[0].tstart
+        except: self.tstart = 0
 
     def make_widgets(self):
         """Makes widgets for the progress window while CapSim evaluates the
@@ -334,17 +414,35 @@ class BatchSolver:
 
         start = timer.time()        #real time at t = 0
 
-        for parameters in self.parameters:
+        steperrors   = 0            #adaptive steps kept above the tolerance
+        firststep    = None
+        steadyerrors = 0            #steady states that did not converge
+
+        for system in self.systems:
 
             if self.abort.get() <> 1:
 
                 if self.type == 'Separate': start = timer.time()
 
+                #the parameters of each system are only made when it is
+                #solved and released after its results are written
+                parameters = Parameters(system)
+
+                #linear systems with boundary concentration histories are
+                #evaluated for every history by superposition, the others
+                #are simulated with their constant boundary concentrations
+                if len(system.historyfilenames) > 0:
+                    if self.type == 'Separate' and solve_histories(system, parameters, self.writer) == 1:
+                        parameters = None
+                        continue
+                    self.show_history_warning(system)
+
                 sorp   = parameters.sorp
                 cons   = parameters.con
                 dep    = parameters.dep
                 tidal  = parameters.tidal
-                reac   = parameters.reac
+                reac   = parameters.reac * (1 - parameters.splitting)
+                split  = parameters.splitting
                 bio    = parameters.bio
                 biomix = parameters.biomix
 
@@ -357,7 +455,7 @@ class BatchSolver:
                 #determine the grid, time step size, and set up the equations for the
                 #finite differencing
 
-                parameters.make_uniform_grid()
+                parameters.make_grid()
                 if bio == 1:
                     parameters.update_bioturbation()
                     parameters.make_grid_Dbiops()
@@ -388,14 +486,44 @@ class BatchSolver:
                 results = output.converter(parameters, Cn, FisL)
                 for variable in variable_list:
                     Temp[variable].append(results[variable_list.index(variable)])
+                output.observe(t, parameters, Cn, FisL)
 
                 t_start      = 0
                 t_end        = 0
 
-                while t < (parameters.tfinal_ori + parameters.delt * (2 + parameters.steps)): #loop through time to the simulation end
+                adapt   = parameters.adaptive * ((dep + tidal + biomix) == 0) * (parameters.averageoption == 'Instaneous')
+                delt    = parameters.delt
+                rebuild = 0
+                retry   = 0
+
+                steady  = parameters.steady
+                if steady == 1:
+                    Cn      = parameters.steady_state_solver(Cn, Fis, FisL)
+                    if parameters.steadyerror is not None: steadyerrors = steadyerrors + 1
+                    results = output.converter(parameters, Cn, FisL)
+                    output.store(t, parameters.tfinal_ori, parameters, results, results)
+                    output.observe(parameters.tfinal_ori, parameters, Cn, FisL)
+
+                expo    = parameters.exponential * ((dep + cons + tidal + biomix + sorp + reac) == 0) * (parameters.averageoption == 'Instaneous')
+                if expo == 1:
+                    while output.n < len(output.times):
+                        t_plus_1  = output.times[output.n]
+                        if t_plus_1 > t:
+                            Cn_plus_1      = parameters.exponential_solver(Cn, t_plus_1 - t)
+                            results_plus_1 = output.converter(parameters, Cn_plus_1, FisL)
+                            output.store(t, t_plus_1, parameters, results, results_plus_1)
+                            output.observe(t_plus_1, parameters, Cn_plus_1, FisL)
+                            t       = t_plus_1
+                            Cn      = Cn_plus_1
+                            results = results_plus_1
+                        else:
+                            output.store(t - 1, t, parameters, results, results)
 
+                while t < (parameters.tfinal_ori + parameters.delt * (2 + parameters.steps)) and ((adapt + steady + expo) == 0 or output.n < len(output.times)): #loop through time to the simulation end
+
+                    if adapt == 1: rebuild = parameters.set_time_step(delt, t, output.get_next_time(t))
                     if dep  == 1: Cn, Fis_plus_1, FisL_plus_1, FisM_plus_1 = parameters.update_deposition(Cn, Fis, FisL, FisM, t+parameters.delt)
-                    parameters.update_time_dependents()
+                    if retry == 0: parameters.update_time_dependents()
                     if cons == 1: parameters.update_consolidation(t+parameters.delt, parameters.Vdar)
                     if tidal== 1: parameters.update_tidal(t+parameters.delt, parameters.U_plus_1)
 
@@ -408,14 +536,28 @@ class BatchSolver:
                     if (cons + tidal + biomix) > 0:
                         parameters.make_transport_parameter_vectors()
 
-                    if (cons + tidal + dep + biomix + reac + sorp) > 0:
+                    if tidal == 1 and (cons + dep + biomix + reac + sorp) == 0:
+                        parameters.make_tidal_matrices(t+parameters.delt)
+                    elif (cons + tidal + dep + biomix + reac + sorp) > 0 or rebuild == 1:
                         parameters.make_matrices()
 
-                    if sorp == 1 or reac == 1:
+                    if split == 1:
+                        Cn_plus_1 = parameters.split_solver(Cn, Fis_plus_1)
+                    elif sorp == 1 or reac == 1:
                         Cn_plus_1 = parameters.non_linear_solver(Cn, Fis_plus_1, FisL_plus_1)
                     else:
                         Cn_plus_1 = parameters.get_Cn_plus_1(Cn)
 
+                    if adapt == 1:
+                        error = parameters.get_time_step_error(Cn, Cn_plus_1)
+                        delt  = parameters.get_time_step(error)
+                        if error is not None and error > 1:
+                            if parameters.delt > parameters.deltmin:
+                                retry = 1
+                                continue
+                            parameters.steperrors.append(t + parameters.delt)
+                        retry = 0
+
                     #collect the pertinent data from the time step
                     if parameters.averageoption == 'Instaneous':
                         if output.n < len(output.times) and round(output.times[output.n], 8) < round(t+parameters.delt, 8):
@@ -444,28 +586,37 @@ class BatchSolver:
                             t_start = t_middle
                             t_end   = t+parameters.delt
 
+                    parameters.update_history(Cn)
+
                     t  = t + parameters.delt
-                    Cn = [C for C in Cn_plus_1]
+                    Cn = Cn_plus_1
                     if biomix ==1:
-                        Fis  = {}
-                        FisL = {}
-                        FisM = {}
-                        for component in parameters.components:
-                            Fis[component.name]  = [Fi for Fi in Fis_plus_1[component.name]]
-                            FisL[component.name] = [Fi for Fi in FisL_plus_1[component.name]]
-                            FisM[component.name] = [Fi for Fi in FisM_plus_1[component.name]]
+                        Fis, FisL, FisM = Fis_plus_1, FisL_plus_1, FisM_plus_1
+                    output.observe(t, parameters, Cn, FisL)
 
                     if self.type == 'Continuous':
-                        self.progress.set('Simulation Progress: ' + str(int(t)) + ' / ' + str(int(self.parameters[-1].tfinal_ori)) + ' ' + self.parameters[-1].timeunit )
-                        self.remaintime.set('Approximate Remaining Time: %d Seconds' %((timer.time()-start)*(self.parameters[-1].tfinal-t)/(t-self.parameters[0].tstart)))
+                        self.progress.set('Simulation Progress: ' + str(int(t)) + ' / ' + str(int(self.systems[-1].tfinal)) + ' ' + self.systems[-1].timeunit )
+                        self.remaintime.set('Approximate Remaining Time: %d Seconds' %((timer.time()-start)*(self.systems[-1].tfinal-t)/(t-self.tstart)))
                     else:
-                        self.progress.set('Simulation Progress: ' + str(self.parameters.index(parameters)) + ' / ' + str(len(self.parameters)) )
+                        self.progress.set('Simulation Progress: ' + str(self.systems.index(system)) + ' / ' + str(len(self.systems)) )
                         self.remaintime.set('Approximate Remaining Time: %d Seconds' %((timer.time()-start)*(parameters.tfinal-t)/(t)))
 
                     self.frame.update()
                     if self.abort.get() == 1: break
 
-                if self.abort.get() <> 1: self.outputs.append(output)
+                if len(parameters.steperrors) > 0:
+                    steperrors = steperrors + len(parameters.steperrors)
+                    if firststep is None: firststep = parameters.steperrors[0]
+
+                #write the results and release the output before the next
+                #system so the memory does not grow with the batch
+                if self.abort.get() <> 1:
+                    self.writer.write(system, output)
+                    output = None
+                parameters = None
+
+        if self.abort.get() == 0 and steperrors > 0:   self.show_step_warning(steperrors, firststep)
+        if self.abort.get() == 0 and steadyerrors > 0: self.show_steady_warning(steadyerrors)
 
         if self.abort.get() == 0: #checks if the abort button was invoked
 
@@ -473,6 +624,11 @@ class BatchSolver:
             self.postwidget.grid(row = 2, column = 0, columnspan = 3)
             self.frame.update()
 
+            self.writer.close()
+            self.outputs = self.writer.filenames
+
+        else: self.writer.remove_store()
+
         self.frame.quit()
 
     def abortrun(self, event = 0):
@@ -484,6 +640,40 @@ class BatchSolver:
             self.outputs = None
             self.frame.quit()
 
+    def show_step_warning(self, steps, t):
+        """Warns that adaptive time steps were accepted at the minimum step
+        size although their error was above the tolerance."""
+
+        tkmb.showwarning(title = 'Time Step Warning', message = 'The time ' +
+                         'step error exceeded the tolerance at the minimum ' +
+                         'time step in ' + str(steps) + ' time step(s), ' +
+                         'first at ' + str(round(t, 8)) + '.  Please ' +
+                         'decrease the minimum time step or increase the ' +
+                         'time step error to rectify this issue.')
+
+    def show_steady_warning(self, systems):
+        """Warns that the nonlinear steady state iterations did not converge
+        for some of the systems."""
+
+        tkmb.showwarning(title = 'Steady State Warning', message = 'The ' +
+                         'steady state iterations did not converge for ' +
+                         str(systems) + ' system(s).  Please check the ' +
+                         'results or solve the systems in time to rectify ' +
+                         'this issue.')
+
+    def show_history_warning(self, system):
+        """Warns that the boundary concentration histories of "system" are
+        not used because they can only be superposed for linear systems."""
+
+        tkmb.showwarning(title = 'Boundary History Warning', message = 'The ' +
+                         'boundary history files of ' + system.filename +
+                         ' are only used for separate runs of linear systems ' +
+                         'with constant coefficients that are solved in time ' +
+                         'without splitting and have no finite mixed water ' +
+                         'column.  The system will be ' +
+                         'simulated with its constant boundary ' +
+                         'concentrations instead.')
+
     def show_size_error(self):
         """Shows ann error if the user specifies an overly complicated system
         that requires too much memory allocation."""
@@ -522,3 +712,36 @@ def solve_batch(systems, type):
     root.destroy()
 
     return outputs, main
+
+def solve_histories(system, parameters, writer):
+    """Writes the results of "system" for each of its boundary concentration
+    histories with "writer" by superposition of the unit responses, which are
+    computed once.  Returns 0 without writing if the system is not linear
+    with constant coefficients or has a finite mixed water column, so that
+    it is simulated with its constant boundary concentrations instead."""
+
+    if (parameters.sorp + parameters.reac + parameters.con + parameters.dep + parameters.tidal + parameters.biomix + parameters.splitting + parameters.steady) > 0:
+        return 0
+
+    if parameters.topBCtype == 'Finite mixed water column': return 0
+
+    parameters.make_grid()
+    if parameters.bio == 1:
+        parameters.update_bioturbation()
+        parameters.make_grid_Dbiops()
+
+    Fis, FisL, FisM = parameters.get_initial_component_fractions()
+    Cn              = parameters.get_initial_concentrations()
+
+    parameters.make_matrix_parameter_vectors(Cn, Fis, FisL)
+    parameters.make_transport_parameter_vectors()
+    parameters.make_reaction_parameter_vectors(Cn, Fis)
+    parameters.update_time_dependents()
+
+    histories = [read_BC_history(name) for name in system.historyfilenames]
+    responses = UnitResponses(parameters, Cn, FisL, histories)
+
+    for n in range(len(histories)):
+        writer.write(system, responses.get_output(n), system.filename + '_' + system.historyfilenames[n])
+
+    return 1
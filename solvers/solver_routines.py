@@ -21,13 +21,22 @@ CapSimKey = wreg.OpenKey(CapSimReg, r'Software\CapSim')
 Filepath =wreg.QueryValueEx(CapSimKey, 'FilePath')[0]
 CapSimKey.Close()
 
-import math, cPickle as pickle
+import math, csv, tempfile, shutil, cPickle as pickle
 
-from numpy               import matrix, array, linalg, zeros, transpose, interp, ceil, exp
+from numpy.lib.format    import open_memmap
+from numpy               import matrix, array, linalg, zeros, transpose, interp, ceil, exp, arange, argmax, argmin, outer, dot, ndarray, broadcast_arrays, tanh, searchsorted, lexsort, where, prod, ix_, concatenate, in1d, ones
 from capsim_object_types import System, Layer, Chemical, BC, Reaction, Coefficient, SolidIC
 from reactioneditor      import Reactant, Product
 from capsim_functions    import consolidation, tidal, tauwater
 
+try:    from scipy.linalg.lapack import dgbtrf, dgbtrs
+except: dgbtrf, dgbtrs = None, None
+
+try:
+    from scipy.sparse        import dia_matrix, csr_matrix, hstack, vstack
+    from scipy.sparse.linalg import expm_multiply, spsolve
+except: expm_multiply = None
+
 class Parameters:
     """This object type creates the variables used for the finite 
     differencing to solve the transport equations for simulating a sediment
@@ -88,6 +97,22 @@ class Parameters:
         except: self.timeoption = 'Crank-Nicolson'
 
         self.outputsteps    = system.outputsteps
+
+        try:    self.outputvariables = system.outputvariables
+        except: self.outputvariables = ['C', 'F', 'q', 'qm', 'W', 'Cw', 'Fi']
+
+        try:    self.outputdepths    = system.outputdepths
+        except: self.outputdepths    = None
+
+        try:    self.outputchemicals = system.outputchemicals
+        except: self.outputchemicals = None
+
+        try:    self.observations    = system.observations
+        except: self.observations    = []
+
+        try:    self.observationsteps = system.observationsteps
+        except: self.observationsteps = 0
+
         self.discrete       = system.discrete
         self.ptotal         = system.ptotal
         self.delt           = system.delt
@@ -96,9 +121,46 @@ class Parameters:
         self.tvariable      = system.tvariable
         self.delz           = system.delz
         self.players        = system.players
+
+        try:    self.gridoption = system.gridoption
+        except: self.gridoption = 'Uniform'
+
+        try:    self.gridnodes  = system.gridnodes
+        except: self.gridnodes  = int(sum(self.players) / 3)
         self.tidalsteps     = system.tidalsteps
         self.nloption       = system.nonlinear
         self.nlerror        = system.nlerror
+        self.NR_LU          = None
+        self.history        = []
+        self.nliterations   = []
+        self.steperrors     = []
+
+        try:    self.nljacobian = system.nljacobian
+        except: self.nljacobian = 0
+
+        try:    self.nlpredictor = system.nlpredictor
+        except: self.nlpredictor = 'Linear extrapolation'
+
+        try:    self.deltoption = system.deltoption
+        except: self.deltoption = 'Fixed'
+
+        try:    self.deltmin    = system.deltmin
+        except: self.deltmin    = 0
+
+        if self.deltmin <= 0: self.deltmin = self.delt / 100
+
+        try:    self.deltmax    = system.deltmax
+        except: self.deltmax    = 0
+
+        if self.deltmax <= 0: self.deltmax = float(system.tfinal - self.tstart) / self.outputsteps
+
+        try:    self.delterror  = system.delterror
+        except: self.delterror  = 0.001
+
+        if self.deltoption == 'Adaptive':   self.adaptive = 1
+        else:                               self.adaptive = 0
+
+        self.deltstep       = self.delt
         self.averageoption  = system.averageoption
         self.depsteps       = system.depgrid
         self.depgrid        = 1
@@ -279,6 +341,7 @@ class Parameters:
             self.U          = self.Vdar
             self.Vtidal     = system.Vtidal
             self.ptidal     = system.ptidal
+            self.tidal_matrices = {}
         elif system.adv == 'Steady flow':
             self.U = self.Vdar
             self.tidalsteps = 0
@@ -549,6 +612,47 @@ class Parameters:
                         self.Cmax[chemical.name] = max(self.ICs[layer.name][chemical.name].uniform, self.ICs[layer.name][chemical.name].top, self.ICs[layer.name][chemical.name].bot)
                 except: pass
 
+        #the operator splitting solves the transport with Crank-Nicolson; the
+        #transport of nonlinear sorbing chemicals is not split from the reactions
+        if self.timeoption == 'Strang splitting' and self.sorp == 0:    self.splitting = 1
+        else:                                                           self.splitting = 0
+
+        if self.timeoption == 'Strang splitting': self.timeoption = 'Crank-Nicolson'
+
+        #the steady state equations are the difference of the time stepping
+        #matrices, which are assembled with Crank-Nicolson.  There is no steady
+        #state with deposition, consolidation, oscillating flow or component
+        #mixing, so these systems are stepped through time instead.
+        if self.timeoption == 'Steady state':
+            self.steady     = 1 * ((self.dep + self.con + self.tidal + self.biomix) == 0)
+            self.timeoption = 'Crank-Nicolson'
+        else:
+            self.steady     = 0
+
+        #the matrix exponential integrates the equations that are recovered
+        #from the Crank-Nicolson matrices and needs SciPy
+        if self.timeoption == 'Matrix exponential':
+            self.exponential = 1 * (expm_multiply is not None)
+            self.timeoption  = 'Crank-Nicolson'
+        else:
+            self.exponential = 0
+
+        self.operator    = None
+
+        self.networks    = {}
+
+        self.coefficient_key = None
+
+        self.components_key  = None
+
+        self.flux_key        = None
+
+    def make_grid(self):
+        """Creates the uniform or the graded grid depending on "gridoption"."""
+
+        if self.gridoption == 'Graded': self.make_graded_grid()
+        else:                           self.make_uniform_grid()
+
     def make_uniform_grid(self):
 
         """Creates a uniform grid for assessing contaminant transport in a cap
@@ -598,6 +702,50 @@ class Parameters:
 
         if self.bio == 1:            self.update_bioturbation()
 
+    def make_graded_grid(self):
+        """Creates a graded grid with approximately "gridnodes" grid points.
+        The points are shared among the layers in proportion to the uniform
+        grid and are clustered at the layer interfaces, the sediment-water
+        interface and the depth of the bioturbation layer with the spacing of
+        the uniform grid "delz," coarsening toward the layer interiors.  The
+        grid lists are the same as for the uniform grid."""
+
+        hs       = [self.delz[i] * self.players[i] for i in range(len(self.layers))]
+        factor   = float(self.gridnodes) / sum(self.players)
+        segments = []
+        points   = []
+
+        #split the layers at the bottom of the bioturbation layer and share
+        #the grid points among the segments
+        ztop = 0
+        for i in range(len(self.layers)):
+            n = max(2, int(round(self.players[i] * factor)))
+            if self.bio == 1 and ztop + self.delz[i] < self.hbio < ztop + hs[i] - self.delz[i]:
+                segments.append([[0, self.hbio - ztop], [self.hbio - ztop, hs[i]]])
+                points.append([max(1, int(round(n * (self.hbio - ztop) / hs[i])))])
+                points[-1].append(max(1, n - points[-1][0]))
+            else:
+                segments.append([[0, hs[i]]])
+                points.append([n])
+            ztop = ztop + hs[i]
+
+        self.players = [sum(point) for point in points]
+
+        self.make_uniform_grid()
+
+        z = [0]
+        for i in range(len(self.layers)):
+            ztop = z[-1]
+            for k in range(len(segments[i])):
+                top, bot = segments[i][k]
+                botcheck = int(i < len(self.layers) - 1 or k < len(segments[i]) - 1)
+                for zz in get_graded_grid(bot - top, points[i][k], self.delz[i], 1, botcheck)[1:]:
+                    z.append(ztop + top + zz)
+
+        self.z = z
+
+        if self.bio == 1:            self.update_bioturbation()
+
     def get_initial_concentrations(self):
         """Uses the list of "Layer" objects and their concentrations to fill in
         the values of concentration at each grid point "C0" """
@@ -712,158 +860,126 @@ class Parameters:
                 self.rhosL_plus_1[self.pbio] = self.rhosL_plus_1[self.pbio] + FisL[component.name][self.pbio] * component.rho
 
     def make_grid_Rs(self, Cn, Fis_plus_1, FisL_plus_1):
+        """Makes the arrays of values of "R" for the finite difference
+        equations for the grid "z" with boundary points "p" and concentrations
+        "Cn." """
 
-        """Makes the list of values of "R" for the finite difference equations
-        for the grid "z" with boundary points "p" and concentrations "Cn." """
+        if self.coefficient_key != self.get_coefficient_key(): self.make_grid_coefficients()
 
-        self.Rs_plus_1  = []
-        self.Ss_plus_1  = []
-        self.Ks_plus_1  = []
+        self.Rs_plus_1,  self.Ss_plus_1,  self.Ks_plus_1  = self.get_grid_Rs(Cn, Fis_plus_1,  FisL_plus_1, self.es_plus_1,  self.docs,  self.lnums,  self.nodes,  self.chems,  self.scomps)
+        self.RsL_plus_1, self.SsL_plus_1, self.KsL_plus_1 = self.get_grid_Rs(Cn, FisL_plus_1, FisL_plus_1, self.esL_plus_1, self.docsL, self.lnumsL, self.nodesL, self.chemsL, self.scompsL)
 
-        num     = self.nchemicals
+    def get_grid_Rs(self, Cn, Fis, FisB, es, docs, lnums, nodes, chems, scomps):
+        """Returns the retardation factors, the dissolved and the sorbed parts
+        for one side of the grid points from the coefficient tables.  The
+        partition coefficients of each chemical are evaluated for a whole
+        layer at once, and the solid chemicals at the last grid point use the
+        component fractions "FisB." """
 
-        layer  = self.layertot[0]
-        for n in range(num):
-            chemical = (self.chemicals)[n]
-            Kd_rho   = 0
-            for component in layer.components:
-                Kd_rho = Kd_rho + Fis_plus_1[component.name][0] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-            self.Rs_plus_1.append(self.es_plus_1[0] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-            self.Ss_plus_1.append(self.es_plus_1[0] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-            self.Ks_plus_1.append(Kd_rho)
-        for solidchemical in layer.solidchemicals:
-            self.Rs_plus_1.append(Fis_plus_1[layer.components[solidchemical.component_index].name][0] * layer.components[solidchemical.component_index].rho)
-            self.Ss_plus_1.append(0)
-            self.Ks_plus_1.append(Fis_plus_1[layer.components[solidchemical.component_index].name][0] * layer.components[solidchemical.component_index].rho)
+        Cn = array(Cn, dtype = float)
+        S  = zeros(len(chems))
+        K  = zeros(len(chems))
 
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for ii in range(self.ptot[j + 1] - 1 - self.ptot[j]):
-                i = ii + 1
-                for n in range(num):
-                    chemical = self.chemicals[n]
-                    Kd_rho   = 0
-                    for component in layer.components:
-                        Kd_rho = Kd_rho + Fis_plus_1[component.name][self.ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[self.cptot[j]+i*layer.nchemicals+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-                    self.Rs_plus_1.append(self.es_plus_1[self.ptot[j]+i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-                    self.Ss_plus_1.append(self.es_plus_1[self.ptot[j]+i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                    self.Ks_plus_1.append(Kd_rho)
-                for solidchemical in layer.solidchemicals:
-                    self.Rs_plus_1.append(Fis_plus_1[layer.components[solidchemical.component_index].name][self.ptot[j]+i] * layer.components[solidchemical.component_index].rho)
-                    self.Ss_plus_1.append(0)
-                    self.Ks_plus_1.append(Fis_plus_1[layer.components[solidchemical.component_index].name][self.ptot[j]+i] * layer.components[solidchemical.component_index].rho)
+        i    = (chems >= 0).nonzero()[0]
+        S[i] = array(es, dtype = float)[nodes[i]] * docs[i]
 
-            if j < len(self.ptot) - 2:
-                i = self.ptot[j+1]
-                layer = self.layertot[j]
-                for n in range(num):
-                    chemical = self.chemicals[n]
-                    Kd_rho   = 0
+        for j in range(len(self.layertot)):
+            layer = self.layertot[j]
+            for n in range(self.nchemicals):
+                chemical = self.chemicals[n]
+                i        = ((lnums == j) & (chems == n)).nonzero()[0]
+                if len(i) > 0:
                     for component in layer.components:
-                        Kd_rho = Kd_rho + Fis_plus_1[component.name][i] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[self.cptot[j + 1]+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-                    self.Rs_plus_1.append(self.es_plus_1[i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-                    self.Ss_plus_1.append(self.es_plus_1[i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                    self.Ks_plus_1.append(Kd_rho)
-                for solidchemical in self.layertot[j+1].solidchemicals:
-                    self.Rs_plus_1.append(Fis_plus_1[solidchemical.component_name][i] * self.components[self.component_list.index(solidchemical.component_name)].rho)
-                    self.Ss_plus_1.append(0)
-                    self.Ks_plus_1.append(Fis_plus_1[solidchemical.component_name][i] * self.components[self.component_list.index(solidchemical.component_name)].rho)
-
-        layer  = self.layertot[-1]
-        for n in range(num):
-            chemical = self.chemicals[n]
-            Kd_rho   = 0
-            for component in layer.components:
-                Kd_rho = Kd_rho + Fis_plus_1[component.name][-1] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[self.cptot[-1]+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-            self.Rs_plus_1.append(self.es_plus_1[-1] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-            self.Ss_plus_1.append(self.es_plus_1[-1] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-            self.Ks_plus_1.append(Kd_rho)
-        for solidchemical in layer.solidchemicals:
-            self.Rs_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][-1] * layer.components[solidchemical.component_index].rho)
-            self.Ss_plus_1.append(0)
-            self.Ks_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][-1] * layer.components[solidchemical.component_index].rho)
-
-
-        self.RsL_plus_1  = []
-        self.SsL_plus_1  = []
-        self.KsL_plus_1  = []
-
+                        K[i] = K[i] + array(Fis[component.name], dtype = float)[nodes[i]] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[i]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
+
+        for m in range(len(self.components)):
+            component = self.components[m]
+            i         = (scomps == m).nonzero()[0]
+            if len(i) > 0:
+                Fi   = array(Fis[component.name], dtype = float)[nodes[i]]
+                Fi[nodes[i] == -1] = FisB[component.name][-1]
+                K[i] = Fi * component.rho
+
+        return S + K, S, K
+
+    def get_coefficient_key(self):
+        """Returns the layout of the layers on the grid that the coefficient
+        tables are built for."""
+
+        return (tuple(self.ptot), len(self.layertot), len(self.z))
+
+    def get_node_coefficients(self, j, jsolid, e, node):
+        """Returns the coefficient table entries of the chemicals at grid point
+        "node" in layer "j" with the solid chemicals of layer "jsolid" and the
+        porosity at grid point "e." """
+
+        layer  = self.layertot[j]
+        num    = self.nchemicals
+        solids = self.layertot[jsolid].solidchemicals
+        nsolid = len(solids)
+
+        docs   = [1 + layer.doc/(10**6) * 10**(chemical.Kdoc) for chemical in self.chemicals] + [0] * nsolid
+        Dms    = [chemical.Dw for chemical in self.chemicals]                                   + [0] * nsolid
+        alphas = [layer.alpha] * num                                                            + [0] * nsolid
+        lnums  = [j % len(self.layertot)] * (num + nsolid)
+        enodes = [e] * (num + nsolid)
+        nodes  = [node] * (num + nsolid)
+        chems  = list(range(num))                                                               + [-1] * nsolid
+        scomps = [-1] * num + [self.component_list.index(solidchemical.component_name) for solidchemical in solids]
+
+        return docs, Dms, alphas, lnums, enodes, nodes, chems, scomps
+
+    def make_grid_coefficients(self):
+        """Makes the tables of the coefficients that only depend on the grid
+        and the layer properties, ordered like the unknowns in "Us" and "UsL":
+        the dissolved organic carbon enhancement "docs," the molecular
+        diffusion coefficients "Dms," the dispersivities "alphas," the layer
+        numbers "lnums," the grid points of the porosities for "Ds" "enodes"
+        and of the other properties "nodes" (-1 for the last grid point), the
+        chemical numbers "chems" (-1 for solid chemicals) and the components
+        of the solid chemicals "scomps."  The tables are rebuilt when the grid
+        changes."""
+
+        nodes = [self.get_node_coefficients(0, 0, 0, 0)]
         for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j + 1] - self.ptot[j]):
-                for n in range(num):
-                    chemical = self.chemicals[n]
-                    Kd_rho   = 0
-                    for component in layer.components:
-                        Kd_rho = Kd_rho + FisL_plus_1[component.name][self.ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[self.cptot[j]+i*layer.nchemicals+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-                    self.RsL_plus_1.append(self.esL_plus_1[self.ptot[j]+i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-                    self.SsL_plus_1.append(self.esL_plus_1[self.ptot[j]+i] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                    self.KsL_plus_1.append(Kd_rho)
-                for solidchemical in layer.solidchemicals:
-                    self.RsL_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][self.ptot[j]+i] * layer.components[solidchemical.component_index].rho)
-                    self.SsL_plus_1.append(0)
-                    self.KsL_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][self.ptot[j]+i] * layer.components[solidchemical.component_index].rho)
-
-        layer  = self.layertot[-1]
-        for n in range(num):
-            chemical = self.chemicals[n]
-            Kd_rho   = 0
-            for component in layer.components:
-                Kd_rho = Kd_rho + FisL_plus_1[component.name][-1] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[self.cptot[-1]+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
-            self.RsL_plus_1.append(self.esL_plus_1[-1] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)) + Kd_rho )
-            self.SsL_plus_1.append(self.esL_plus_1[-1] *(1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-            self.KsL_plus_1.append(Kd_rho)
-        for solidchemical in layer.solidchemicals:
-            self.RsL_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][-1] * layer.components[solidchemical.component_index].rho)
-            self.SsL_plus_1.append(0)
-            self.KsL_plus_1.append(FisL_plus_1[layer.components[solidchemical.component_index].name][-1] * layer.components[solidchemical.component_index].rho)
+            for i in range(self.ptot[j] + 1, self.ptot[j + 1]):
+                nodes.append(self.get_node_coefficients(j, j, i, i))
+            if j < len(self.ptot) - 2:
+                nodes.append(self.get_node_coefficients(j, j + 1, self.ptot[j + 1] - 1, self.ptot[j + 1]))
+        nodes.append(self.get_node_coefficients(-1, -1, -1, -1))
 
+        nodesL = []
+        for j in range(len(self.ptot) - 1):
+            for i in range(self.ptot[j], self.ptot[j + 1]):
+                nodesL.append(self.get_node_coefficients(j, j, i, i))
+        nodesL.append(self.get_node_coefficients(-1, -1, -1, -1))
 
-    def make_grid_Us(self):
-        """Makes the list of values of "D" for the finite difference equations
-        for the grid "z" with boundary points "p." """
+        self.docs, self.Dms, self.alphas, self.lnums, self.enodes, self.nodes, self.chems, self.scomps              = [array(sum([list(node[k]) for node in nodes],  [])) for k in range(8)]
+        self.docsL, self.DmsL, self.alphasL, self.lnumsL, self.enodesL, self.nodesL, self.chemsL, self.scompsL      = [array(sum([list(node[k]) for node in nodesL], [])) for k in range(8)]
 
-        self.Us_plus_1  = []
+        self.coefficient_key = self.get_coefficient_key()
 
-        layer  = self.layertot[0]
-        for chemical in (self.chemicals):
-            self.Us_plus_1.append(   self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-        for n in range(self.layertot[0].nsolidchemicals):
-            self.Us_plus_1.append(0)
+    def get_effective_Ds(self, Us, es, Dms, alphas, lnums, enodes):
+        """Returns the effective diffusion coefficients from the Darcy
+        velocities "Us," the porosities "es" and the coefficient tables, which
+        is "Layer.get_D" evaluated for all of the grid points at once."""
 
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j]+1, self.ptot[j + 1]):
-                for chemical in (self.chemicals):
-                    self.Us_plus_1.append(self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                for n in range(self.layertot[j].nsolidchemicals):
-                    self.Us_plus_1.append(0)
-            if j < len(self.ptot) - 2:
-                for chemical in (self.chemicals):
-                    self.Us_plus_1.append(self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                for n in range(self.layertot[j+1].nsolidchemicals):
-                    self.Us_plus_1.append(0)
+        e = array(es, dtype = float)[enodes]
+        D = alphas * abs(Us)
+        for j in range(len(self.layertot)):
+            i = ((lnums == j) & (Dms != 0)).nonzero()[0]
+            if len(i) > 0: D[i] = D[i] + Dms[i] * self.layertot[j].get_tortuosity()(e[i])
 
-        for chemical in (self.chemicals):
-            self.Us_plus_1.append(self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-        for n in range(self.layertot[-1].nsolidchemicals):
-            self.Us_plus_1.append(0)
+        return D
 
-        self.UsL_plus_1 = []
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j], self.ptot[j + 1]):
-                for chemical in (self.chemicals):
-                    self.UsL_plus_1.append(self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-                for n in range(self.layertot[j].nsolidchemicals):
-                    self.UsL_plus_1.append(0)
+    def make_grid_Us(self):
+        """Makes the arrays of values of "U" for the finite difference
+        equations for the grid "z" with boundary points "p." """
 
-        layer  = self.layertot[-1]
-        for chemical in (self.chemicals):
-            self.UsL_plus_1.append(self.U_plus_1 * (1 + layer.doc/(10**6) * 10**(chemical.Kdoc)))
-        for n in range(self.layertot[-1].nsolidchemicals):
-            self.UsL_plus_1.append(0)
+        if self.coefficient_key != self.get_coefficient_key(): self.make_grid_coefficients()
 
+        self.Us_plus_1  = self.U_plus_1 * self.docs
+        self.UsL_plus_1 = self.U_plus_1 * self.docsL
 
     def make_grid_Dbiops(self):
         """Makes the list of values of "D" for the finite difference equations
@@ -888,52 +1004,18 @@ class Parameters:
 
 
     def make_grid_Ds(self):
-        """Makes the list of values of "D" for the finite difference equations
-        for the grid "z" with boundary points "p." """
-
-        self.Ds_plus_1   = []
-
-        Dn = 0
+        """Makes the arrays of values of "D" for the finite difference
+        equations for the grid "z" with boundary points "p." """
 
-        layer  = self.layertot[0]
-        for chemical in (self.chemicals):
-            self.Ds_plus_1.append(layer.get_D(chemical.Dw, self.Us_plus_1[Dn], self.es_plus_1[0]))
-            Dn = Dn + 1
-        for n in range(self.layertot[0].nsolidchemicals):
-            self.Ds_plus_1.append(layer.get_D(0, 0, self.es_plus_1[0]))
-            Dn = Dn + 1
+        if self.coefficient_key != self.get_coefficient_key(): self.make_grid_coefficients()
 
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j] + 1, self.ptot[j + 1]):
-                for chemical in (self.chemicals):
-                    self.Ds_plus_1.append(layer.get_D(chemical.Dw, self.Us_plus_1[Dn], self.es_plus_1[i]))
-                    Dn = Dn + 1
-                for n in range(self.layertot[j].nsolidchemicals):
-                    self.Ds_plus_1.append(layer.get_D(0, 0, self.es_plus_1[i]))
-                    Dn = Dn + 1
-            if j < len(self.ptot)-2:
-                for chemical in (self.chemicals):
-                    self.Ds_plus_1.append(layer.get_D(chemical.Dw, self.Us_plus_1[Dn], self.es_plus_1[i]))
-                    Dn = Dn + 1
-                for n in range(self.layertot[j+1].nsolidchemicals):
-                    self.Ds_plus_1.append(layer.get_D(0, 0, self.es_plus_1[i]))
-                    Dn = Dn + 1
-
-        layer  = self.layertot[-1]
-        for chemical in (self.chemicals):
-            self.Ds_plus_1.append(layer.get_D(chemical.Dw, self.UsL_plus_1[Dn], self.esL_plus_1[-1]))
-            Dn = Dn + 1
-        for n in range(self.layertot[-1].nsolidchemicals):
-            self.Ds_plus_1.append(layer.get_D(0, 0, self.esL_plus_1[-1]))
-            Dn = Dn + 1
-
-        self.Dws_plus_1 = [D for D in self.Ds_plus_1]
+        self.Ds_plus_1  = self.get_effective_Ds(self.Us_plus_1,  list(self.es_plus_1) + [self.esL_plus_1[-1]], self.Dms,  self.alphas,  self.lnums,  self.enodes)
+        self.Dws_plus_1 = self.Ds_plus_1.copy()
 
         if self.bio == 1:
             if self.biotype == 'Uniform':
-                for n in range (self.cpbio + self.layertot[self.layerbio].nchemicals):
-                    self.Ds_plus_1[n] = self.Ds_plus_1[n] + self.Dbiopw * self.Ss_plus_1[n]
+                n = self.cpbio + self.layertot[self.layerbio].nchemicals
+                self.Ds_plus_1[:n] = self.Ds_plus_1[:n] + self.Dbiopw * array(self.Ss_plus_1[:n])
             else:
                 for j in range(len(self.ptot) - 1):
                     for i in range(self.ptot[j + 1] - self.ptot[j]):
@@ -945,34 +1027,13 @@ class Parameters:
                     for n in range(len(self.layertot[-1].chemicals)):
                         self.Ds_plus_1[self.cptot[-1]+n] = self.Ds_plus_1[self.cptot[-1]+n] + self.Dbiopw * self.Ss_plus_1[self.cptot[-1]+n]* exp(-(self.z[self.ptot[-1]]-self.z[0])**2/2/self.sigma**2)
 
-        self.DsL_plus_1   = []
-
-        Dn = 0
-
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j], self.ptot[j + 1]):
-                for chemical in (self.chemicals):
-                    self.DsL_plus_1.append(layer.get_D(chemical.Dw, self.UsL_plus_1[Dn], self.esL_plus_1[i]))
-                    Dn = Dn + 1
-                for n in range(self.layertot[j].nsolidchemicals):
-                    self.DsL_plus_1.append(layer.get_D(0, 0, self.esL_plus_1[i]))
-                    Dn = Dn + 1
-
-        layer  = self.layertot[-1]
-        for chemical in (self.chemicals):
-            self.DsL_plus_1.append(layer.get_D(chemical.Dw, self.UsL_plus_1[Dn], self.esL_plus_1[-1]))
-            Dn = Dn + 1
-        for n in range(self.layertot[-1].nsolidchemicals):
-            self.DsL_plus_1.append(layer.get_D(0, 0, self.esL_plus_1[-1]))
-            Dn = Dn + 1
-
-        self.DwsL_plus_1 = [D for D in self.DsL_plus_1]
+        self.DsL_plus_1  = self.get_effective_Ds(self.UsL_plus_1, self.esL_plus_1, self.DmsL, self.alphasL, self.lnumsL, self.enodesL)
+        self.DwsL_plus_1 = self.DsL_plus_1.copy()
 
         if self.bio == 1:
             if self.biotype == 'Uniform':
-                for n in range (self.cpbio):
-                    self.DsL_plus_1[n] = self.DsL_plus_1[n] + self.Dbiopw * self.SsL_plus_1[n] #+ self.Dbiop * self.KsL_plus_1[n]
+                n = self.cpbio
+                self.DsL_plus_1[:n] = self.DsL_plus_1[:n] + self.Dbiopw * array(self.SsL_plus_1[:n])
             else:
                 for j in range(len(self.ptot) - 1):
                     for i in range(self.ptot[j + 1] - self.ptot[j]):
@@ -980,12 +1041,11 @@ class Parameters:
                             if i < self.pbio and i < self.ptot[-1]:
                                 self.DsL_plus_1[self.cptot[j]+i*self.layertot[j].nchemicals+n] = self.DsL_plus_1[self.cptot[j]+i*self.layertot[j].nchemicals+n] + self.Dbiopw * self.SsL_plus_1[self.cptot[j]+i*self.layertot[j].nchemicals+n]* exp(-(self.z[self.ptot[j]+i]-self.z[0])**2/2/self.sigma**2)
 
-
     def make_grid_elams(self, Fis):
         """Makes the list of values of "elam" for the finite difference 
         equations for the grid "z" with boundary points "p." """
 
-        self.elams_plus_1 = zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals])
+        self.elams_plus_1 = BlockDiagonalMatrix(self.get_blocks())
 
         for j in range(len(self.ptot) - 1):
             layer  = self.layertot[j]
@@ -998,90 +1058,70 @@ class Parameters:
                         e = self.components[self.component_list.index(component_name)].e * Fis[component_name][self.ptot[j]+i]
                         for chemical in (reaction.reactants + reaction.products):
                             nn = chemical.count
-                            self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n] = (self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n]
+                            self.elams_plus_1.blocks[self.ptot[j]+i, nn, n] = (self.elams_plus_1.blocks[self.ptot[j]+i, nn, n]
                                                                                                                           +chemical.coef * self.coefficients[layer.name][reaction.name].lam * e)
                     elif reaction.name.count('_desorption') == 1:
                         component_name = reaction.component
                         rho = self.components[self.component_list.index(component_name)].rho * Fis[component_name][self.ptot[j]+i]
                         for chemical in (reaction.reactants + reaction.products):
                             nn = chemical.count
-                            self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n] = (self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n]
+                            self.elams_plus_1.blocks[self.ptot[j]+i, nn, n] = (self.elams_plus_1.blocks[self.ptot[j]+i, nn, n]
                                                                                                                           + chemical.coef * self.coefficients[layer.name][reaction.name].lam * rho)
                     else:
                         for chemical in (reaction.reactants + reaction.products):
                             nn = chemical.count
-                            self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n] = self.elams_plus_1[self.cptot[j]+i*layer.nchemicals+nn, self.cptot[j]+i*layer.nchemicals+n] \
+                            self.elams_plus_1.blocks[self.ptot[j]+i, nn, n] = self.elams_plus_1.blocks[self.ptot[j]+i, nn, n] \
                                                                                                                                             + chemical.coef * self.coefficients[layer.name][reaction.name].lam * self.es_plus_1[self.ptot[j]+i]
 
 
-    def make_grid_rates(self, Cn, Fis):
+    def get_reaction_network(self, layer):
+        """Returns the nonlinear reactions of "layer" compiled into a
+        "ReactionNetwork," which is only built the first time."""
 
-        """Makes the list of values of "rates" for the finite difference
-        equations for the grid "z" with boundary points "p." """
+        if not self.networks.has_key(layer.name): self.networks[layer.name] = ReactionNetwork(self, layer)
 
-        self.rates      = zeros(self.cptot[-1] + self.layertot[-1].nchemicals)
+        return self.networks[layer.name]
 
+    def get_layer_concentrations(self, Cn):
+        """Returns the reaction network, the grid points, the first unknown
+        and the concentrations (grid points x chemicals) of each layer with
+        nonlinear reactions."""
+
+        Cn     = array(Cn, dtype = float)
+        layers = []
         for j in range(len(self.ptot) - 1):
             layer  = self.layertot[j]
-            for i in range(self.ptot[j + 1] - self.ptot[j]):
-                #i = ii + 1
-                for reaction in layer.nlreactions:
-                    if reaction.model == 'Langmuir':
-                        component_name = reaction.component
-                        e   = self.components[self.component_list.index(component_name)].e * Fis[component_name][self.ptot[j]+i]
-                        rate = (self.coefficients[layer.name][reaction.name].lam * Cn[self.cptot[j]+i*layer.nchemicals+reaction.reactants[0].count] * e
-                                *(reaction.reactants[0].index - Cn[self.cptot[j]+i*layer.nchemicals+reaction.products[0].count]))
-                    else:
-                        if reaction.name.count('_desorption') == 1:
-                            component_name = reaction.component
-                            rho = self.components[self.component_list.index(component_name)].rho * Fis[component_name][self.ptot[j]+i]
-                            rate = self.coefficients[layer.name][reaction.name].lam * rho
-                            for reactant in reaction.reactants:
-                                if     Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] <= 0:    rate = 0
-                                else:                                                               rate = rate * Cn[self.cptot[j]+i*layer.nchemicals+reactant.count]**reactant.index
-                        else:
-                            rate = self.coefficients[layer.name][reaction.name].lam * self.es_plus_1[self.ptot[j]+i]
-                            for reactant in reaction.reactants:
-                                if     Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] <= 0:    rate = 0
-                                else:                                                               rate = rate * Cn[self.cptot[j]+i*layer.nchemicals+reactant.count]**reactant.index
+            if len(layer.nlreactions) > 0:
+                nodes  = arange(self.ptot[j], self.ptot[j + 1])
+                k      = self.cptot[j]
+                layers.append((self.get_reaction_network(layer), nodes, k, Cn[k:k + len(nodes) * layer.nchemicals].reshape(len(nodes), layer.nchemicals)))
 
-                    for chemical in (reaction.reactants + reaction.products):
-                        self.rates[self.cptot[j]+i*layer.nchemicals+chemical.count]      = self.rates[self.cptot[j]+i*layer.nchemicals+chemical.count] + rate * chemical.coef
+        return layers
 
-    def make_grid_rates_plus_1(self, Cn , Fis):
+    def get_grid_rates(self, Cn, Fis):
+        """Returns the list of values of "rates" for the concentrations "Cn"
+        and the component fractions "Fis." """
+
+        rates = zeros(self.cptot[-1] + self.layertot[-1].nchemicals)
+
+        for network, nodes, k, C in self.get_layer_concentrations(Cn):
+            rates[k:k + C.size] = network.get_rates(C, nodes, self.es_plus_1, Fis).reshape(-1)
+
+        return rates
+
+    def make_grid_rates(self, Cn, Fis):
 
         """Makes the list of values of "rates" for the finite difference
         equations for the grid "z" with boundary points "p." """
 
-        self.rates_plus_1      = zeros(self.cptot[-1] + self.layertot[-1].nchemicals)
+        self.rates = self.get_grid_rates(Cn, Fis)
 
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j + 1] - self.ptot[j]):
-                #i = ii + 1
-                for reaction in layer.nlreactions:
-                    if reaction.model == 'Langmuir':
-                        component_name = reaction.component
-                        e   = self.components[self.component_list.index(component_name)].e * Fis[component_name][self.ptot[j]+i]
-                        rate = (self.coefficients[layer.name][reaction.name].lam * Cn[self.cptot[j]+i*layer.nchemicals+reaction.reactants[0].count] * e
-                                *(reaction.reactants[0].index - Cn[self.cptot[j]+i*layer.nchemicals+reaction.products[0].count]))
-                    else:
-                        if reaction.name.count('_desorption') == 1:
-                            component_name = reaction.component
-                            rho = self.components[self.component_list.index(component_name)].rho * Fis[component_name][self.ptot[j]+i]
-                            rate = self.coefficients[layer.name][reaction.name].lam * rho
-                            for reactant in reaction.reactants:
-                                if     Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] <= 0:    rate = 0
-                                else:                                                               rate = rate * Cn[self.cptot[j]+i*layer.nchemicals+reactant.count]**reactant.index
-                        else:
-                            rate = self.coefficients[layer.name][reaction.name].lam * self.es_plus_1[self.ptot[j]+i]
-                            for reactant in reaction.reactants:
-                                if     Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] <= 0:    rate = 0
-                                else:                                                               rate = rate * Cn[self.cptot[j]+i*layer.nchemicals+reactant.count]**reactant.index
+    def make_grid_rates_plus_1(self, Cn , Fis):
 
-                    for chemical in (reaction.reactants + reaction.products):
-                        self.rates_plus_1[self.cptot[j]+i*layer.nchemicals+chemical.count]      = self.rates_plus_1[self.cptot[j]+i*layer.nchemicals+chemical.count] + rate * chemical.coef
+        """Makes the list of values of "rates" for the finite difference
+        equations for the grid "z" with boundary points "p." """
 
+        self.rates_plus_1 = self.get_grid_rates(Cn, Fis)
 
     def make_grid_rates_diff(self, Cn, Fis):
 
@@ -1089,39 +1129,10 @@ class Parameters:
         equations for the grid "z" with boundary points "p." """
 
 
-        self.rates_diff  = zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals])
-
-        for j in range(len(self.ptot) - 1):
-            layer  = self.layertot[j]
-            for i in range(self.ptot[j + 1] - self.ptot[j]):
-                #i = ii + 1
-                for reaction in layer.nlreactions:
-                    diff = zeros(layer.nchemicals)
-                    if reaction.model == 'Langmuir':
-                        component_name = reaction.component
-                        e   = self.components[self.component_list.index(component_name)].e * Fis[component_name][self.ptot[j]+i]
-                        diff[reaction.reactants[0].count] = diff[reaction.reactants[0].count] + self.coefficients[layer.name][reaction.name].lam * e * (reaction.reactants[0].index - Cn[self.cptot[j]+i*layer.nchemicals+reaction.products[0].count])
-
-                        diff[reaction.products[0].count]  = diff[reaction.products[0].count] - self.coefficients[layer.name][reaction.name].lam * e * Cn[self.cptot[j]+i*layer.nchemicals+reaction.reactants[0].count]
-                    else:
-                        if reaction.name.count('_desorption') == 1:
-                            component_name = reaction.component
-                            rho = self.components[self.component_list.index(component_name)].rho * Fis[component_name][self.ptot[j]+i]
-                            rate = self.coefficients[layer.name][reaction.name].lam * rho
-                        else:
-                            rate = self.coefficients[layer.name][reaction.name].lam * self.es_plus_1[self.ptot[j]+i]
-
-                        for reactant in reaction.reactants:
-                            if     Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] <= 0:    rate = 0
-                            else:                                                               rate = rate * Cn[self.cptot[j]+i*layer.nchemicals+reactant.count]**reactant.index
-                        for reactant in reaction.reactants:
-                            if  Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] >0:
-                                diff[reactant.count] = rate / Cn[self.cptot[j]+i*layer.nchemicals+reactant.count] * reactant.index
+        self.rates_diff = BlockDiagonalMatrix(self.get_blocks())
 
-                    for chemical in (reaction.reactants + reaction.products):
-                        for chemical_a in (reaction.reactants + reaction.products):
-                            self.rates_diff[self.cptot[j]+i*layer.nchemicals+chemical.count, self.cptot[j]+i*layer.nchemicals+chemical_a.count]      \
-                                = self.rates_diff[self.cptot[j]+i*layer.nchemicals+chemical.count, self.cptot[j]+i*layer.nchemicals+chemical_a.count] + diff[chemical_a.count] * chemical_a.coef
+        for network, nodes, k, C in self.get_layer_concentrations(Cn):
+            self.rates_diff.blocks[nodes, :network.nchemicals, :network.nchemicals] = network.get_rates_diff(C, nodes, self.es_plus_1, Fis)
 
     def make_boundary_equations(self):
         """Makes the finite difference equations for the boundary conditions."""
@@ -1307,58 +1318,14 @@ class Parameters:
             cptot.insert(self.layerbio + 1, self.cpbio)
             layers.insert(self.layerbio + 1, self.layertot[self.layerbio])
 
+        grid = self.get_grid_arrays()
+
         if self.timeoption == 'Crank-Nicolson':
 
             for j in range(len(ptot) - 1):
                 num = layers[j].nchemicals
                 for n in range(self.nchemicals):
-                    for ii in range((ptot[j+1] - 1 - (ptot[j] + 1))):
-                        i = ii + 1
-                        p = ptot[j] + i
-                        if self.biomix == 1:
-                            Ds_plus_1      = [ self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]-self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds_plus_1[cptot[j]+i*num+n],
-                                              -self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]+self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4]
-                            Ds             = [ self.DsL[cptot[j]+(i-1)*num+n]/4+self.Ds[cptot[j]+i*num+n]-self.Ds[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds[cptot[j]+i*num+n],
-                                              -self.DsL[cptot[j]+(i-1)*num+n]/4+self.Ds[cptot[j]+i*num+n]+self.Ds[cptot[j]+(i+1)*num+n]/4]
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                            KDbiops        = [( self.DbiopsL[p-1]/4+self.DbiopsL[p] - self.DbiopsL[p+1]/4)                      *self.KsL[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL[p])                                                                *self.Ks[cptot[j]+i*num+n],
-                                              (-self.DbiopsL[p-1]/4+self.DbiopsL[p] + self.DbiopsL[p+1]/4)                      *self.Ks[cptot[j]+(i+1)*num+n]]
-
-                        elif self.bio == 1:
-                            Ds_plus_1      = [ self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]-self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds_plus_1[cptot[j]+i*num+n],
-                                              -self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]+self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4]
-                            Ds             = [ self.DsL[cptot[j]+(i-1)*num+n]/4+self.Ds[cptot[j]+i*num+n]-self.Ds[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds[cptot[j]+i*num+n],
-                                              -self.DsL[cptot[j]+(i-1)*num+n]/4+self.Ds[cptot[j]+i*num+n]+self.Ds[cptot[j]+(i+1)*num+n]/4]
-
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                            KDbiops        = [( self.DbiopsL[p-1]/4+self.DbiopsL[p] - self.DbiopsL[p+1]/4)                      *self.KsL[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL[p])                                                                *self.Ks[cptot[j]+i*num+n],
-                                              (-self.DbiopsL[p-1]/4+self.DbiopsL[p] + self.DbiopsL[p+1]/4)                      *self.Ks[cptot[j]+(i+1)*num+n]]
-                        else:
-                            Ds_plus_1      = [self.DsL_plus_1[cptot[j]+i*num+n], self.Ds_plus_1[cptot[j]+i*num+n], self.Ds_plus_1[cptot[j]+i*num+n]]
-                            Ds             = [self.DsL[cptot[j]+i*num+n], self.Ds[cptot[j]+i*num+n], self.Ds[cptot[j]+i*num+n]]
-                            KDbiops_plus_1 = [0,0,0]
-                            KDbiops        = [0,0,0]
-
-                        [self.A[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+i*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] , \
-                        [self.B[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+i*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] = \
-                        get_4pt_adr_fde_CN(self.Rs[cptot[j]+i*num+n], self.Rs_plus_1[cptot[j]+i*num+n], self.Us[cptot[j]+i*num+n], self.Us_plus_1[cptot[j]+i*num+n], Ds, Ds_plus_1,  KDbiops, KDbiops_plus_1, self.delt, self.z[p-1:p+3])
-                        for np in range(num):
-                            self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] - self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]/2
-                            self.B[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.B[cptot[j]+i*num+n,cptot[j]+i*num+np] + self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]/2
-
-                        self.a[cptot[j]+i*num+n] = -self.rates_plus_1[cptot[j]+i*num+n]/2
-                        self.b[cptot[j]+i*num+n] = self.rates[cptot[j]+i*num+n]/2
-
+                    self.make_interior_equations(grid, ptot, cptot, j, num, n)
 
                     p        = ptot[j+1]
                     if self.biomix == 1:
@@ -1418,39 +1385,7 @@ class Parameters:
                 for nn in range(layers[j].nsolidchemicals):
                     solidchemical = layers[j].solidchemicals[nn]
                     n = nn + self.nchemicals
-                    for ii in range((ptot[j+1] - 1 - (ptot[j] + 1))):
-                        i = ii + 1
-                        p = ptot[j] + i
-                        if self.biomix == 1:
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                            KDbiops        = [( self.DbiopsL[p-1]/4+self.DbiopsL[p] - self.DbiopsL[p+1]/4)                      *self.KsL[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL[p])                                                                *self.Ks[cptot[j]+i*num+n],
-                                              (-self.DbiopsL[p-1]/4+self.DbiopsL[p] + self.DbiopsL[p+1]/4)                      *self.Ks[cptot[j]+(i+1)*num+n]]
-                        elif self.bio == 1:
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                            KDbiops        = [( self.DbiopsL[p-1]/4+self.DbiopsL[p] - self.DbiopsL[p+1]/4)                      *self.KsL[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL[p])                                                                *self.Ks[cptot[j]+i*num+n],
-                                              (-self.DbiopsL[p-1]/4+self.DbiopsL[p] + self.DbiopsL[p+1]/4)                      *self.Ks[cptot[j]+(i+1)*num+n]]
-                        else:
-                            KDbiops_plus_1 = [0,0,0]
-                            KDbiops        = [0,0,0]
-
-                        if self.Rs_plus_1[cptot[j]+i*num+n]/self.components[solidchemical.component_index].rho < 0.0000000001:
-                            self.A[cptot[j]+i*num+n,cptot[j]+i*num+n] = 1
-                        else:
-                            [self.A[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+i*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] , \
-                            [self.B[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+i*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] = \
-                            get_4pt_adr_fde_CN(self.Rs[cptot[j]+i*num+n], self.Rs_plus_1[cptot[j]+i*num+n], self.Us[cptot[j]+i*num+n], self.Us_plus_1[cptot[j]+i*num+n], [0,0,0], [0,0,0], KDbiops, KDbiops_plus_1, self.delt, self.z[p-1:p+3])
-                            for np in range(num):
-                                self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] - self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]/2
-                                self.B[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.B[cptot[j]+i*num+n,cptot[j]+i*num+np] + self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]/2
-
-                            self.a[cptot[j]+i*num+n] = -self.rates_plus_1[cptot[j]+i*num+n]/2
-                            self.b[cptot[j]+i*num+n] = self.rates[cptot[j]+i*num+n]/2
+                    self.make_interior_equations(grid, ptot, cptot, j, num, n, solidchemical)
 
                     p        = ptot[j+1]
                     if self.biomix == 1:
@@ -1500,38 +1435,7 @@ class Parameters:
                 num = layers[j].nchemicals
                 for n in range(self.nchemicals):
                     chemical = layers[j].chemicals[n]
-                    for ii in range((ptot[j+1] - 1 - (ptot[j] + 1))):
-                        i = ii + 1
-                        p = ptot[j] + i
-                        if self.biomix == 1:
-                            Ds_plus_1      = [ self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]-self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds_plus_1[cptot[j]+i*num+n],
-                                              -self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]+self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4]
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                        elif self.bio == 1:
-                            Ds_plus_1      = [ self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]-self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4,
-                                               self.Ds_plus_1[cptot[j]+i*num+n],
-                                              -self.DsL_plus_1[cptot[j]+(i-1)*num+n]/4+self.Ds_plus_1[cptot[j]+i*num+n]+self.Ds_plus_1[cptot[j]+(i+1)*num+n]/4]
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                        else:
-                            Ds_plus_1      = [self.DsL_plus_1[cptot[j]+i*num+n], self.Ds_plus_1[cptot[j]+i*num+n], self.Ds_plus_1[cptot[j]+i*num+n]]
-                            KDbiops_plus_1 = [0,0,0]
-
-                        [self.A[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+i*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] , \
-                        [self.B[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+i*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] = \
-                        get_4pt_adr_fde_imp(self.Rs[cptot[j]+i*num+n], self.Rs_plus_1[cptot[j]+i*num+n], self.Us_plus_1[cptot[j]+i*num+n], Ds_plus_1, KDbiops_plus_1, self.delt, self.z[p-1:p+3])
-                        for np in range(num):
-                            self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] - self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]
-                            self.B[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.B[cptot[j]+i*num+n,cptot[j]+i*num+np]
-
-                        self.a[cptot[j]+i*num+n] = -self.rates[cptot[j]+i*num+n]
-                        self.b[cptot[j]+i*num+n] = 0
-
-                        if self.Rs_plus_1[cptot[j]+i*num+n] == 0: self.A[cptot[j]+i*num+n,cptot[j]+i*num+n] = 1
+                    self.make_interior_equations(grid, ptot, cptot, j, num, n)
 
                     p        = ptot[j+1]
                     if self.biomix == 1:
@@ -1572,32 +1476,7 @@ class Parameters:
                 for nn in range(layers[j].nsolidchemicals):
                     solidchemical = layers[j].solidchemicals[nn]
                     n = nn + self.nchemicals
-                    for ii in range((ptot[j+1] - 1 - (ptot[j] + 1))):
-                        i = ii + 1
-                        p = ptot[j] + i
-                        if self.biomix == 1:
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-
-                        elif self.bio == 1:
-                            KDbiops_plus_1 = [( self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] - self.DbiopsL_plus_1[p+1]/4) *self.KsL_plus_1[cptot[j]+(i-1)*num+n],
-                                              ( self.DbiopsL_plus_1[p])                                                         *self.Ks_plus_1[cptot[j]+i*num+n],
-                                              (-self.DbiopsL_plus_1[p-1]/4+self.DbiopsL_plus_1[p] + self.DbiopsL_plus_1[p+1]/4) *self.Ks_plus_1[cptot[j]+(i+1)*num+n]]
-                        else:
-                            KDbiops_plus_1 = [0,0,0]
-
-                        if self.Rs_plus_1[cptot[j]+i*num+n]/self.components[solidchemical.component_index].rho < 0.0000000001:
-                            self.A[cptot[j]+i*num+n,cptot[j]+i*num+n] = 1
-                        else:
-                            [self.A[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+i*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.A[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] , \
-                            [self.B[cptot[j]+i*num+n,cptot[j]+(i-1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+i*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+1)*num+n], self.B[cptot[j]+i*num+n,cptot[j]+(i+2)*num+n]] = \
-                            get_4pt_adr_fde_imp(self.Rs[cptot[j]+i*num+n], self.Rs_plus_1[cptot[j]+i*num+n], self.Us_plus_1[cptot[j]+i*num+n],  [0,0,0], KDbiops_plus_1, self.delt, self.z[p-1:p+3])
-                            for np in range(num):
-                                self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] = self.A[cptot[j]+i*num+n,cptot[j]+i*num+np] - self.elams[cptot[j]+i*num+n,cptot[j]+i*num+np]#/2
-
-                            self.a[cptot[j]+i*num+n] = -self.rates_plus_1[cptot[j]+i*num+n]
-                            self.b[cptot[j]+i*num+n] = 0
+                    self.make_interior_equations(grid, ptot, cptot, j, num, n, solidchemical)
 
                     p        = ptot[j+1]
                     if self.biomix == 1:
@@ -1628,7 +1507,106 @@ class Parameters:
                         self.a[cptot[j+1]-num+n] = -self.rates_plus_1[cptot[j+1]-num+n]
                         self.b[cptot[j+1]-num+n] = 0
 
-    def make_Newton_Raphson_equations(self, Cn, Fis, FisL):
+    def get_grid_arrays(self):
+        """Returns a dictionary with the grid parameter lists converted to
+        arrays for the assembly of the finite difference equations."""
+
+        names = ['Rs', 'Rs_plus_1', 'Us', 'Us_plus_1', 'Ds', 'Ds_plus_1', 'DsL', 'DsL_plus_1', 'Ks', 'Ks_plus_1', 'KsL', 'KsL_plus_1']
+        if self.bio == 1 or self.biomix == 1: names = names + ['Dbiops', 'Dbiops_plus_1', 'DbiopsL', 'DbiopsL_plus_1']
+
+        grid      = {}
+        for name in names:
+            grid[name] = array(getattr(self, name), dtype = float)
+        grid['z'] = array(self.z, dtype = float)
+
+        return grid
+
+    def make_interior_equations(self, grid, ptot, cptot, j, num, n, solidchemical = None):
+        """Makes the finite difference equations for chemical "n" at the
+        interior grid points of layer "j" (all but the last one) at once using
+        the arrays from "get_grid_arrays."  The equations are the same as the
+        ones from "get_4pt_adr_fde_CN" and "get_4pt_adr_fde_imp" at each grid
+        point.  Solid chemicals are given by "solidchemical." """
+
+        i = arange(1, ptot[j+1] - 1 - ptot[j])
+        if len(i) == 0: return
+
+        C = cptot[j] + i * num + n
+        p = ptot[j] + i
+
+        if solidchemical is not None:
+            solid = grid['Rs_plus_1'][C] / self.components[solidchemical.component_index].rho < 0.0000000001
+            self.A[C[solid], C[solid]] = 1
+            i = i[~solid]
+            C = C[~solid]
+            p = p[~solid]
+            if len(i) == 0: return
+
+        Ds_plus_1      = zeros([4, len(i)])
+        Ds             = zeros([4, len(i)])
+        KDbiops_plus_1 = zeros([4, len(i)])
+        KDbiops        = zeros([4, len(i)])
+
+        if solidchemical is None:
+            if self.biomix == 1 or self.bio == 1:
+                Ds_plus_1[0:3] = [ grid['DsL_plus_1'][C-num]/4+grid['Ds_plus_1'][C]-grid['Ds_plus_1'][C+num]/4,
+                                   grid['Ds_plus_1'][C],
+                                  -grid['DsL_plus_1'][C-num]/4+grid['Ds_plus_1'][C]+grid['Ds_plus_1'][C+num]/4]
+                Ds[0:3]        = [ grid['DsL'][C-num]/4+grid['Ds'][C]-grid['Ds'][C+num]/4,
+                                   grid['Ds'][C],
+                                  -grid['DsL'][C-num]/4+grid['Ds'][C]+grid['Ds'][C+num]/4]
+            else:
+                Ds_plus_1[0:3] = [grid['DsL_plus_1'][C], grid['Ds_plus_1'][C], grid['Ds_plus_1'][C]]
+                Ds[0:3]        = [grid['DsL'][C], grid['Ds'][C], grid['Ds'][C]]
+
+        if self.biomix == 1 or self.bio == 1:
+            KDbiops_plus_1[0:3] = [( grid['DbiopsL_plus_1'][p-1]/4+grid['DbiopsL_plus_1'][p] - grid['DbiopsL_plus_1'][p+1]/4) *grid['KsL_plus_1'][C-num],
+                                   ( grid['DbiopsL_plus_1'][p])                                                               *grid['Ks_plus_1'][C],
+                                   (-grid['DbiopsL_plus_1'][p-1]/4+grid['DbiopsL_plus_1'][p] + grid['DbiopsL_plus_1'][p+1]/4) *grid['Ks_plus_1'][C+num]]
+            KDbiops[0:3]        = [( grid['DbiopsL'][p-1]/4+grid['DbiopsL'][p] - grid['DbiopsL'][p+1]/4)                      *grid['KsL'][C-num],
+                                   ( grid['DbiopsL'][p])                                                                      *grid['Ks'][C],
+                                   (-grid['DbiopsL'][p-1]/4+grid['DbiopsL'][p] + grid['DbiopsL'][p+1]/4)                      *grid['Ks'][C+num]]
+
+        a, b, c = get_4pt_adr_fde_coefficients(array([grid['z'][p-1], grid['z'][p], grid['z'][p+1], grid['z'][p+2]]))
+
+        R, R_plus_1, U, U_plus_1 = grid['Rs'][C], grid['Rs_plus_1'][C], grid['Us'][C], grid['Us_plus_1'][C]
+
+        if self.timeoption == 'Crank-Nicolson':
+            Arow = (-Ds_plus_1*a - KDbiops_plus_1*a - U_plus_1 * b + (2*R_plus_1/self.delt)*c)/2
+            Brow = (Ds*a + KDbiops*a + U*b + (2*R/self.delt)*c)/2
+        else:
+            Arow = - Ds_plus_1 * a - KDbiops_plus_1 * a - U_plus_1 * b + (R_plus_1/self.delt)*c
+            Brow = (R/self.delt)*c
+
+        for k in range(4):
+            self.A[C, C+(k-1)*num] = Arow[k]
+            self.B[C, C+(k-1)*num] = Brow[k]
+
+        for nn in range(num):
+            elams = self.elams[C, C-n+nn]
+            if self.timeoption == 'Crank-Nicolson':
+                self.A[C, C-n+nn] = self.A[C, C-n+nn] - elams/2
+                self.B[C, C-n+nn] = self.B[C, C-n+nn] + elams/2
+            else:
+                self.A[C, C-n+nn] = self.A[C, C-n+nn] - elams
+
+        if self.timeoption == 'Crank-Nicolson':
+            self.a[C, 0] = -self.rates_plus_1[C]/2
+            self.b[C, 0] = self.rates[C]/2
+        elif solidchemical is None:
+            self.a[C, 0] = -self.rates[C]
+            self.b[C, 0] = 0
+            self.A[C[R_plus_1 == 0], C[R_plus_1 == 0]] = 1
+        else:
+            self.a[C, 0] = -self.rates_plus_1[C]
+            self.b[C, 0] = 0
+
+    def make_Newton_Raphson_equations(self, Cn, Fis, FisL, steady = 0):
+        """Makes the Newton-Raphson matrix "NR" from the matrix "A" by replacing
+        the sorbed concentrations of the nonlinear isotherms with their
+        derivatives.  For the steady state ("steady" = 1) only the
+        bioturbation terms of the sorbed concentrations are corrected, with
+        the full spatial coefficients of the implicit equations."""
 
         self.NR     = self.A.copy()
 
@@ -1647,7 +1625,7 @@ class Parameters:
             cptot.insert(self.layerbio + 1, self.cpbio)
             layers.insert(self.layerbio + 1, self.layertot[self.layerbio])
 
-        if self.timeoption == 'Crank-Nicolson':
+        if self.timeoption == 'Crank-Nicolson' and steady == 0:
             # Correct the non-linear sorption terms in Newton Raphson Matrix
             for j in range(len(ptot) - 1):
                 layer = layers[j]
@@ -1658,11 +1636,14 @@ class Parameters:
                         for component in layer.components:
                             if self.sorptions[component.name][chemical.name].kinetic == 'Equilibrium':
                                 if self.sorptions[component.name][chemical.name].isotherm == 'Freundlich' or self.sorptions[component.name][chemical.name].isotherm == 'Langmuir':
-                                    for ii in range((ptot[j+1] - 1-(ptot[j] + 1))):
-                                        i = ii + 1
-                                        self.NR[cptot[j]+i*num+n,cptot[j]+i*num+n] = (self.NR[cptot[j]+i*num+n,cptot[j]+i*num+n]
-                                                                    -Fis[component.name][ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[cptot[j]+i*num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt
-                                                                    +Fis[component.name][ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_NR(Cn[cptot[j]+i*num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt)
+                                    i   = arange(1, ptot[j+1] - 1 - ptot[j])
+                                    C   = cptot[j]+i*num+n
+                                    Fi  = array(Fis[component.name], dtype = float)[ptot[j]+i]
+                                    K   = self.sorptions[component.name][chemical.name].get_K(component, array(Cn, dtype = float)[C]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
+                                    dK  = self.sorptions[component.name][chemical.name].get_NR(array(Cn, dtype = float)[C]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
+                                    self.NR[C,C] = (self.NR[C,C]
+                                                    -Fi * component.rho * K/self.delt
+                                                    +Fi * component.rho * dK/self.delt)
                                     p = ptot[j+1] - (ptot[j] + 1)
                                     self.NR[cptot[j+1]-num+n,cptot[j+1]-num+n] = (self.NR[cptot[j+1]-num+n,cptot[j+1]-num+n]
                                                                 -Fis[component.name][ptot[j+1]-1] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[cptot[j+1]-num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt
@@ -1670,14 +1651,7 @@ class Parameters:
 
                 # Correct the non-linear reaction terms in Newton Raphson Matrix
                 if self.reac == 1:
-                    for n in range(num):
-                        chemical = layers[j].chemicals[n]
-                        for ii in range((ptot[j+1] - 1-(ptot[j] + 1))):
-                            i = ii + 1
-                            for nn in range(num):
-                                self.NR[cptot[j]+i*num+n, cptot[j]+i*num+nn] = self.NR[cptot[j]+i*num+n, cptot[j]+i*num+nn] - self.rates_diff[cptot[j]+i*num+n, cptot[j]+i*num+nn]/2
-                        for nn in range(num):
-                            self.NR[cptot[j+1]-num+n, cptot[j+1]-num+nn] = self.NR[cptot[j+1]-num+n, cptot[j+1]-num+nn] - self.rates_diff[cptot[j+1]-num+n, cptot[j+1]-num+nn]/2
+                    self.rates_diff.add_to(self.NR, -0.5, list(range(ptot[j] + 1, ptot[j+1] - 1)) + [ptot[j+1] - 1])
 
             if self.bio == 1 and self.Dbiop > 0 and self.sorp == 1:
                 for j in range(self.layerbio+1):
@@ -1764,37 +1738,33 @@ class Parameters:
                                                                                             -self.DbiopsL_plus_1[p] * Fis[component.name][ptot[j]+2] * component.rho * self.sorptions[component.name][chemical.name].get_NR(Cn[cptot[j+1]+2*numb+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/(self.z[ptot[j+1]+1]-self.z[ptot[j+1]])/2)
 
 
-        if self.timeoption == 'Implicit':
+        if self.timeoption == 'Implicit' or steady == 1:
             # Correct the non-linear sorption terms in Newton Raphson Matrix
             for j in range(len(ptot) - 1):
                 layer = layers[j]
                 num = layers[j].nchemicals
-                if self.sorp == 1:
+                if self.sorp == 1 and steady == 0:
                     for n in range(self.nchemicals):
                         chemical = self.chemicals[n]
                         for component in layer.components:
                             if self.sorptions[component.name][chemical.name].kinetic == 'Equilibrium':
                                 if self.sorptions[component.name][chemical.name].isotherm == 'Freundlich' or self.sorptions[component.name][chemical.name].isotherm == 'Langmuir':
-                                    for ii in range((ptot[j+1] - 1-(ptot[j] + 1))):
-                                        i = ii + 1
-                                        self.NR[cptot[j]+i*num+n,cptot[j]+i*num+n] = (self.NR[cptot[j]+i*num+n,cptot[j]+i*num+n]
-                                                                    -Fis[component.name][ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[cptot[j]+i*num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt
-                                                                    +Fis[component.name][ptot[j]+i] * component.rho * self.sorptions[component.name][chemical.name].get_NR(Cn[cptot[j]+i*num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt)
+                                    i   = arange(1, ptot[j+1] - 1 - ptot[j])
+                                    C   = cptot[j]+i*num+n
+                                    Fi  = array(Fis[component.name], dtype = float)[ptot[j]+i]
+                                    K   = self.sorptions[component.name][chemical.name].get_K(component, array(Cn, dtype = float)[C]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
+                                    dK  = self.sorptions[component.name][chemical.name].get_NR(array(Cn, dtype = float)[C]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)
+                                    self.NR[C,C] = (self.NR[C,C]
+                                                    -Fi * component.rho * K/self.delt
+                                                    +Fi * component.rho * dK/self.delt)
 
                                     self.NR[cptot[j+1]-num+n,cptot[j+1]-num+n] = (self.NR[cptot[j+1]-num+n,cptot[j+1]-num+n]
                                                                 -Fis[component.name][ptot[j+1]-1] * component.rho * self.sorptions[component.name][chemical.name].get_K(component, Cn[cptot[j+1]-num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt
                                                                 +Fis[component.name][ptot[j+1]-1] * component.rho * self.sorptions[component.name][chemical.name].get_NR(Cn[cptot[j+1]-num+n]*chemical.MW, self.Cmax[chemical.name]*chemical.MW)/self.delt)
 
                 # Correct the non-linear reaction terms in Newton Raphson Matrix
-                if self.reac == 1:
-                    for n in range(num):
-                        chemical = layers[j].chemicals[n]
-                        for ii in range((ptot[j+1] - 1-(ptot[j] + 1))):
-                            i = ii + 1
-                            for nn in range(num):
-                                self.NR[cptot[j]+i*num+n, cptot[j]+i*num+nn] = self.NR[cptot[j]+i*num+n, cptot[j]+i*num+nn] - self.rates_diff[cptot[j]+i*num+n, cptot[j]+i*num+nn]
-                        for nn in range(num):
-                            self.NR[cptot[j+1]-num+n, cptot[j+1]-num+nn] = self.NR[cptot[j+1]-num+n, cptot[j+1]-num+nn] - self.rates_diff[cptot[j+1]-num+n, cptot[j+1]-num+nn]
+                if self.reac == 1 and steady == 0:
+                    self.rates_diff.add_to(self.NR, -1, list(range(ptot[j] + 1, ptot[j+1] - 1)) + [ptot[j+1] - 1])
 
             if self.bio == 1 and self.Dbiop > 0 and self.sorp == 1:
                 for j in range(self.layerbio+1):
@@ -1897,6 +1867,13 @@ class Parameters:
         self.make_grid_rates(Cn, Fis)
         self.make_grid_rates_plus_1(Cn, Fis)
 
+    def get_bandwidth(self):
+        """Returns the number of sub- and superdiagonals of the finite
+        difference equations.  The stencils reach two grid points above and
+        below a node and the reactions couple the chemicals within a node."""
+
+        return 3 * max([layer.nchemicals for layer in self.layertot])
+
     def make_matrices(self):
         """Generates the discretized variables necessary to perform a finite
         difference analysis of the underlying governing differential equations
@@ -1909,51 +1886,109 @@ class Parameters:
         Cn -- the concentrations in the grid at time n
         """
 
-        self.A = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals]))
-        self.B = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals]))
-        self.a = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, 1]))
-        self.b = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, 1]))
+        N    = self.cptot[-1] + self.layertot[-1].nchemicals
+        band = self.get_bandwidth()
+
+        self.A = BandedMatrix(N, band, band)
+        self.B = BandedMatrix(N, band, band)
+        self.a = matrix(zeros([N, 1]))
+        self.b = matrix(zeros([N, 1]))
+
+        self.A_LU = None
+
+        #the transport equations for the operator splitting leave out the
+        #reactions, which are integrated separately at each grid point
+        if self.splitting == 1:
+            reactions         = [self.elams, self.elams_plus_1, self.rates, self.rates_plus_1]
+            self.elams        = BlockDiagonalMatrix(self.get_blocks())
+            self.elams_plus_1 = BlockDiagonalMatrix(self.get_blocks())
+            self.rates        = zeros(N)
+            self.rates_plus_1 = zeros(N)
 
         self.make_boundary_equations()
         self.make_governing_equations()
 
+        if self.splitting == 1:
+            self.elams, self.elams_plus_1, self.rates, self.rates_plus_1 = reactions
+
+    def make_tidal_matrices(self, time):
+        """Makes the matrices for an oscillating flow at "time."  When the
+        time step divides the tidal period the velocities, and therefore the
+        matrices, repeat every "tidalsteps" steps, so the matrices and the
+        factorization of "A" are stored by the phase of the step and reused
+        in the following periods."""
+
+        if abs(self.tidalsteps * self.delt - self.ptidal) > 10**-8 * self.ptidal:
+            self.make_matrices()
+            return
+
+        phase = int(round(time / self.delt)) % self.tidalsteps
+
+        if self.tidal_matrices.has_key(phase):
+            self.A, self.B, self.a, self.b, self.A_LU = self.tidal_matrices[phase]
+        else:
+            self.make_matrices()
+            self.A_LU = self.factorize(self.A)
+            self.tidal_matrices[phase] = [self.A, self.B, self.a, self.b, self.A_LU]
+
+    def get_components_key(self):
+        """Returns the bioturbation coefficients, the grid and the time step
+        that the component mixing matrices are built for."""
+
+        return (self.delt, self.pbio, tuple(self.ptot), tuple(self.z), tuple(self.Dbiops), tuple(self.Dbiops_plus_1),
+                tuple(self.DbiopsL), tuple(self.DbiopsL_plus_1))
+
     def make_components_matrices(self):
+        """Makes the banded matrices for the mixing of the solid components
+        and factors "Acomp."  The matrices are only rebuilt when the
+        bioturbation coefficients, the grid or the time step change."""
 
-        self.Acomp = matrix(zeros([self.ptot[-1] + 1, self.ptot[-1] + 1]))
-        self.Bcomp = matrix(zeros([self.ptot[-1] + 1, self.ptot[-1] + 1]))
+        if self.components_key == self.get_components_key(): return
+
+        self.Acomp = BandedMatrix(self.ptot[-1] + 1, 2, 2)
+        self.Bcomp = BandedMatrix(self.ptot[-1] + 1, 2, 2)
         self.acomp = matrix(zeros([self.ptot[-1] + 1, 1]))
         self.bcomp = matrix(zeros([self.ptot[-1] + 1, 1]))
 
         self.make_components_equations()
 
+        self.Acomp_LU       = self.Acomp.factorize()
+        self.components_key = self.get_components_key()
+
     def update_time_dependents(self):
+        """Makes the parameters of the next time step the current ones.  The
+        grid builders always assemble new lists and arrays for the "_plus_1"
+        parameters, so the references are shared instead of copying every
+        list; the next rebuild replaces the "_plus_1" references.  This only
+        saves the copies, the builders still allocate the containers of
+        every time step."""
 
         self.U      = self.U_plus_1
 
         if self.bio == 1:
-            self.Dbiops = [Dbiop for Dbiop in self.Dbiops_plus_1]
-            self.DbiopsL= [Dbiop for Dbiop in self.DbiopsL_plus_1]
-
-        self.es     = [e for e in self.es_plus_1]
-        self.rhos   = [rho for rho in self.rhos_plus_1]
-        self.Dws    = [tort for tort in self.Dws_plus_1]
-        self.Ks     = [R for R in self.Ks_plus_1]
-        self.Rs     = [R for R in self.Rs_plus_1]
-        self.Ss     = [S for S in self.Ss_plus_1]
-        self.Us     = [U for U in self.Us_plus_1]
-        self.Ds     = [D for D in self.Ds_plus_1]
-
-        self.esL     = [e for e in self.esL_plus_1]
-        self.rhosL   = [rho for rho in self.rhosL_plus_1]
-        self.DwsL    = [tort for tort in self.DwsL_plus_1]
-        self.KsL     = [R for R in self.KsL_plus_1]
-        self.SsL     = [S for S in self.SsL_plus_1]
-        self.RsL     = [R for R in self.RsL_plus_1]
-        self.UsL     = [U for U in self.UsL_plus_1]
-        self.DsL     = [D for D in self.DsL_plus_1]
-
-        self.elams  = self.elams_plus_1.copy()
-        self.rates  = self.rates_plus_1.copy()
+            self.Dbiops = self.Dbiops_plus_1
+            self.DbiopsL= self.DbiopsL_plus_1
+
+        self.es     = self.es_plus_1
+        self.rhos   = self.rhos_plus_1
+        self.Dws    = self.Dws_plus_1
+        self.Ks     = self.Ks_plus_1
+        self.Rs     = self.Rs_plus_1
+        self.Ss     = self.Ss_plus_1
+        self.Us     = self.Us_plus_1
+        self.Ds     = self.Ds_plus_1
+
+        self.esL     = self.esL_plus_1
+        self.rhosL   = self.rhosL_plus_1
+        self.DwsL    = self.DwsL_plus_1
+        self.KsL     = self.KsL_plus_1
+        self.SsL     = self.SsL_plus_1
+        self.RsL     = self.RsL_plus_1
+        self.UsL     = self.UsL_plus_1
+        self.DsL     = self.DsL_plus_1
+
+        self.elams  = self.elams_plus_1
+        self.rates  = self.rates_plus_1
 
     def update_bioturbation(self):
 
@@ -1967,7 +2002,11 @@ class Parameters:
                 if (self.z[self.ptot[i]]-self.z[0]) < self.hbio:
                     i = i + 1
                 else:
-                    self.pbio = self.ptot[i-1] + int(round((self.hbio - (self.z[self.ptot[i-1]]-self.z[0])) / (self.z[self.ptot[i-1]+1] -self.z[self.ptot[i-1]] ), 8))
+                    if self.gridoption == 'Graded':
+                        zlayer    = array(self.z[self.ptot[i-1]:self.ptot[i]+1]) - self.z[0]
+                        self.pbio = self.ptot[i-1] + int(argmin(abs(zlayer - self.hbio)))
+                    else:
+                        self.pbio = self.ptot[i-1] + int(round((self.hbio - (self.z[self.ptot[i-1]]-self.z[0])) / (self.z[self.ptot[i-1]+1] -self.z[self.ptot[i-1]] ), 8))
                     self.cpbio = self.cptot[i-1] + (self.pbio - self.ptot[i-1]) * self.layertot[i-1].nchemicals
                     self.layerbio = i - 1
                     flag = 1
@@ -2252,9 +2291,10 @@ class Parameters:
         self.make_grid_Us()
         self.make_grid_Ds()
 
-    def update_nonlinear(self, Cn, Fis, FisL):
+    def update_nonlinear(self, Cn, Fis, FisL, jacobian = 1):
         """Updates the retardation factors, delt, and governing equations for
-        nonlinear sorption."""
+        nonlinear sorption.  The Newton-Raphson matrix is only rebuilt when
+        "jacobian" is set; otherwise the previous factorization is kept."""
 
         Cn = transpose(array([i for i in Cn]))
 
@@ -2266,140 +2306,586 @@ class Parameters:
             self.make_grid_rates_plus_1(Cn, Fis)
             self.make_grid_rates_diff(Cn, Fis)
 
-        self.A = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals]))
-        self.B = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, self.cptot[-1] + self.layertot[-1].nchemicals]))
-        self.a = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, 1]))
-        self.b = matrix(zeros([self.cptot[-1] + self.layertot[-1].nchemicals, 1]))
+        N    = self.cptot[-1] + self.layertot[-1].nchemicals
+        band = self.get_bandwidth()
+
+        self.A = BandedMatrix(N, band, band)
+        self.B = BandedMatrix(N, band, band)
+        self.a = matrix(zeros([N, 1]))
+        self.b = matrix(zeros([N, 1]))
+
+        self.A_LU = None
 
         self.make_boundary_equations()
         self.make_governing_equations()
-        self.make_Newton_Raphson_equations(Cn, Fis, FisL)
+
+        if jacobian == 1:
+            self.make_Newton_Raphson_equations(Cn, Fis, FisL)
+            self.NR_LU = None
 
         #return Cn_new
 
+    def get_nonlinear_error(self, Cn_new, Cn_old):
+        """Returns the largest relative root mean square change of the
+        chemical concentrations between two iterations."""
+
+        SE   = zeros((self.nchemicals))
+        AVG  = zeros((self.nchemicals))
+        RMSE = zeros((self.nchemicals))
+
+        for j in range(len(self.layertot)):
+            num = (self.layertot)[j].nchemicals
+            for n in range(self.nchemicals):
+                C = arange(self.cptot[j] + n, self.cptot[j] + (self.ptot[j+1]-self.ptot[j])*num, num)
+                SE[n]  = SE[n]  + sum((Cn_new[C]-Cn_old[C])**2)/(len(self.z)-1)
+                AVG[n] = AVG[n] + sum(abs(Cn_new[C]))/(len(self.z)-1)
+
+        for n in range(self.nchemicals):
+            if AVG[n] > 0: RMSE[n] = SE[n]/AVG[n]
+
+        return max(RMSE)
+
     def non_linear_solver(self, Cn, Fis, FisL):
+        """Solves the nonlinear system for the next time step.  Three
+        iteration strategies are available through "nloption":
+
+        Newton method           -- rebuilds and factors the Jacobian on every
+                                   iteration
+        Modified Newton method  -- keeps the factored Jacobian for
+                                   "nljacobian" iterations (0 for the whole
+                                   time step)
+        Fixed Point Iteration   -- Picard iteration with the matrices
+                                   evaluated at the previous iterate
+
+        The modified Newton and fixed point iterations fall back to the full
+        Newton method when the error stops decreasing, and their change
+        between iterations is scaled by the contraction rate before it is
+        compared with "nlerror." """
 
-        convergence_check = 0
-        A_old = self.A.copy()
         B_old = self.B.copy()
         b_old = self.b.copy()
 
-        self.update_nonlinear(Cn, Fis, FisL)
-
-        Cn_old = self.get_Cn_plus_1(Cn)
+        self.NR_LU = None
+        self.update_nonlinear(Cn, Fis, FisL, jacobian = 0)
 
-        while convergence_check == 0:
-            self.update_nonlinear(Cn_old, Fis, FisL)
-            Cn_new = Cn_old - array(transpose(linalg.solve(self.NR, self.A * transpose(matrix(Cn_old)) + self.a - B_old * transpose(matrix(Cn)) - b_old)))[0]
+        Cn_old = self.get_predictor(Cn)
 
-            SE   = zeros((self.nchemicals))
-            AVG  = zeros((self.nchemicals))
-            RMSE = zeros((self.nchemicals))
+        nloption = self.nloption
+        error    = None
+        k        = 0
 
-            for j in range(len(self.layertot)):
-                num = (self.layertot)[j].nchemicals
-                for i in range(self.ptot[j+1]-self.ptot[j]):
-                    for n in range(self.nchemicals):
-                        SE[n]  = SE[n]  + (Cn_new[self.cptot[j]+i*num + n]-Cn_old[self.cptot[j]+i*num + n])**2/(len(self.z)-1)
-                        AVG[n] = AVG[n] + abs(Cn_new[self.cptot[j]+i*num + n])/(len(self.z)-1)
+        convergence_check = 0
+        while convergence_check == 0:
 
-            RMSE[n] = SE[n]/AVG[n]
+            if nloption == 'Fixed Point Iteration':
+                self.update_nonlinear(Cn_old, Fis, FisL, jacobian = 0)
+                self.A_LU = self.factorize(self.A)
+                Cn_new = array(transpose(self.A_LU.solve(B_old * transpose(matrix(Cn)) + b_old - self.a)))[0]
+            else:
+                jacobian = (nloption == 'Newton method' or self.NR_LU is None or (self.nljacobian > 0 and k % self.nljacobian == 0))
+                self.update_nonlinear(Cn_old, Fis, FisL, jacobian = jacobian)
+                if self.NR_LU is None: self.NR_LU = self.NR.factorize()
+                Cn_new = Cn_old - array(transpose(self.NR_LU.solve(self.A * transpose(matrix(Cn_old)) + self.a - B_old * transpose(matrix(Cn)) - b_old)))[0]
+
+            k = k + 1
+
+            error_new = self.get_nonlinear_error(Cn_new, Cn_old)
+
+            #the modified Newton and fixed point iterations only converge
+            #linearly, so their change is scaled by the observed contraction
+            #rate "rho" (the remaining error is about rho / (1 - rho) times
+            #the change, squared like the error measure)
+            if nloption == 'Newton method' or error_new == 0:
+                converged = (error_new <= self.nlerror)
+            elif error is not None and error_new < error:
+                rho       = (error_new / error) ** 0.5
+                converged = (error_new * (rho / (1 - rho)) ** 2 <= self.nlerror)
+            else:
+                converged = 0
 
-            if sum([(RMSE[n] > self.nlerror) for n in range((self.nchemicals))]) == 0:
+            if converged:
                 convergence_check = 1
             else:
+                if nloption != 'Newton method' and error is not None and error_new > 0.9 * error:
+                    nloption = 'Newton method'
+                error  = error_new
                 Cn_old = Cn_new
 
-        self.update_nonlinear(Cn_new, Fis, FisL)
+        self.update_nonlinear(Cn_new, Fis, FisL, jacobian = 0)
+
+        self.nliterations.append(k)
 
         return Cn_new
 
-    def get_Fis_plus_1(self, Fis, FisL, FisM):
-        """Uses the matrices to solve the system.  Returns the concentrations
-        at the next time step in a one-dimensional row array."""
-        Fis_plus_1  = {}
-        FisL_plus_1 = {}
-        FisM_plus_1 = {}
+    def steady_state_solver(self, Cn, Fis, FisL):
+        """Solves for the steady state concentrations.  With the parameters of
+        both time levels evaluated at the same concentrations, the time
+        derivative terms cancel in the difference of the matrices, leaving
+        the steady state equations:
 
-        for component in self.components:
-            FisM_plus_1[component.name]  = list(array((transpose(linalg.solve(self.Acomp, self.Bcomp * transpose(matrix(FisL[component.name]))))))[0])
-            if self.pbio < self.ptot[-1]:
-                Fis_plus_1[component.name]   = FisM_plus_1[component.name][:self.pbio] + Fis[component.name][self.pbio:]
-                FisL_plus_1[component.name]  = FisM_plus_1[component.name][:self.pbio] + FisL[component.name][self.pbio:]
-            else:
-                Fis_plus_1[component.name]   = FisM_plus_1[component.name][:]
-                FisL_plus_1[component.name]  = FisM_plus_1[component.name][:]
+        (A - B) * C + a - b = 0
 
-        return Fis_plus_1, FisL_plus_1, FisM_plus_1
+        Nonlinear sorption and reactions are solved by Newton's method on this
+        residual, starting from the concentrations "Cn."  The relative change
+        of the last iteration is kept in "steadyerror" if the iterations do
+        not converge, otherwise "steadyerror" is None."""
 
-    def get_Cn_plus_1(self, Cn):
-        """Uses the matrices to solve the system.  Returns the concentrations
-        at the next time step in a one-dimensional row array."""
+        C = array(Cn, dtype = float)
 
-        return array((transpose(linalg.solve(self.A, self.B * transpose(matrix(Cn)) + self.b - self.a))))[0]
+        self.steadyerror = None
+        for iteration in range(50):
 
+            if self.sorp == 1:
+                self.make_grid_Rs(C, Fis, FisL)
+                self.make_grid_Ds()
 
-    def get_Cws(self, C, O = None, flag = None):
+            if self.reac == 1:
+                self.make_grid_rates_plus_1(C, Fis)
+                self.make_grid_rates_diff(C, Fis)
 
-        Cws = zeros(self.nchemicals)
+            self.update_time_dependents()
+            self.make_matrices()
 
-        for n in range (self.nchemicals):
+            M = self.A - self.B
+            F = array(M * transpose(matrix(C)) + self.a - self.b)[:, 0]
 
-            Cws[n] = ((self.U*(1 + self.taucoefs['DOC']/10**6*10**self.chemicals[n].Kdoc)+self.BCs[self.chemicals[n].name].k)/self.taucoefs['h']
-                      /(self.BCs[self.chemicals[n].name].tau+self.BCs[self.chemicals[n].name].k/self.taucoefs['h'])*C[0,n])
+            #the reaction derivatives enter the governing equations of the
+            #nodes below the top of each layer
+            if self.reac == 1:
+                self.rates_diff.add_to(M, -1, [i for i in range(self.ptot[-1]) if self.ptot.count(i) == 0])
 
-        return Cws
+            #the nonlinear isotherms enter the steady state equations through
+            #the bioturbation of the sorbed concentrations
+            if self.sorp == 1 and self.bio == 1 and self.Dbiop > 0:
+                self.make_Newton_Raphson_equations(C, Fis, FisL, steady = 1)
+                M = M - (self.A - self.NR)
 
+            dC = - array(self.factorize(M).solve(F))
+            C  = C + dC
 
-    def get_fluxes(self, C, O = None, flag = None, Cn_top = None, O_top = None):
-        """Calculates the fluxes in the domain "z" using the concentration at
-        each grid point "C," the Darcy velocity "U," and the diffusion
-        coefficient at each grid point "D." Converts units to ug/m2/yr."""
+            error = abs(dC).max() / max(abs(C).max(), 10**-20)
+            if (self.sorp + self.reac) == 0 or error <= self.nlerror: break
 
-        U       = self.U_plus_1
-        Ds      = self.Ds_plus_1
+        if (self.sorp + self.reac) > 0 and error > self.nlerror: self.steadyerror = error
 
-        ptot    = []
-        cptot   = []
-        layers  = []
-        for i in self.ptot: ptot.append(i)
-        for i in self.cptot: cptot.append(i)
+        self.nliterations.append(iteration + 1)
 
-        for layer in self.layertot:
-            layers.append(layer)
+        return C
 
-        i    = 0
-        if self.bio == 1:
+    def get_operator(self):
+        """Returns the sparse operator of the equations for a linear system
+        with constant coefficients.  With the parameters of both time levels
+        equal, the Crank-Nicolson matrices give the mass matrix
+        E = (A + B) * delt / 2 and the semi-discrete system:
 
-            if ptot.count(self.pbio) == 0:
-                ptot.insert(self.layerbio + 1, self.pbio)
-                cptot.insert(self.layerbio + 1, self.cpbio)
-                layers.insert(self.layerbio + 1, self.layertot[self.layerbio])
+        E * dC/dt = - (A - B) * C - (a - b)
 
-            if self.dep == 1 and self.toppoints > 1:
-                F = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
+        The rows without a time derivative (the boundary equations) are
+        algebraic and are eliminated, leaving dCd/dt = M * Cd + s for the
+        remaining concentrations, which is returned as the augmented sparse
+        matrix [[M, s], [0, 0]].  The operator does not depend on the time
+        interval so it is only made once."""
 
-                for n in range (self.nchemicals):
-                    chemical = self.chemicals[n]
-                    for jj in range(len(ptot) - 2):
-                        j = jj + 1
-                        for i in range(ptot[j] + 1, ptot[j+1]):
-                            ii = i - ptot[j]
-                            iii = i - self.toppoints + 1
-                            if i == self.pbio - 1 :
-                                KDbiops_plus_1  = [self.Dbiops_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
-                                                   self.Dbiops_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n]]
-                                top_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[iii,n]-C[iii-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[iii,n]+(KDbiops_plus_1[1]*C[iii,n]-KDbiops_plus_1[0]*C[iii-1,n])/(self.z[i]-self.z[i-1])
-                                bot_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[iii,n]-C[iii-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[iii,n]
-                                F[iii,n] = (top_flux + bot_flux) / 2 * self.flux_factor
-                            else:
-                                KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
-                                                   self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n],
-                                                   self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+(ii+1)*layers[j].nchemicals+n]]
-                                F[iii,n] =  get_point_flux(U* (1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[iii-1:iii+2,n], self.z[i-1:i+2]) * self.flux_factor
+        if self.operator is None:
 
-                        i = ptot[j]
-                        iii = i - self.toppoints + 1
+            A = self.A.tosparse()
+            B = self.B.tosparse()
+            K = (A - B).tocsr()
+            E = ((A + B) * (self.delt / 2)).tocsr()
+            f = array(self.a - self.b)[:, 0]
+
+            nonzero = array(abs(B).sum(1))[:, 0] != 0
+            d       = nonzero.nonzero()[0]
+            g       = (nonzero == 0).nonzero()[0]
+
+            Kgg  = K[g][:, g].tocsc()
+            X    = csr_matrix(spsolve(Kgg, K[g][:, d].tocsc()))
+            y    = spsolve(Kgg, f[g])
+            Ebar = (E[d][:, d] - E[d][:, g] * X).tocsc()
+            Kbar = (K[d][:, d] - K[d][:, g] * X).tocsc()
+            fbar = f[d] - K[d][:, g] * y
+
+            n    = len(d)
+            M    = vstack([hstack([- csr_matrix(spsolve(Ebar, Kbar)), - spsolve(Ebar, fbar).reshape(-1, 1)]), csr_matrix((1, n + 1))])
+
+            self.operator = d, g, X, y, M.tocsr()
+
+        return self.operator
+
+    def exponential_solver(self, Cn, h):
+        """Returns the concentrations a time interval "h" after "Cn" from the
+        action of the exponential of the sparse operator on "Cn," without
+        forming the exponential itself."""
+
+        d, g, X, y, M = self.get_operator()
+
+        Cn        = array(Cn, dtype = float)
+        C         = zeros(len(Cn))
+        C[d]      = expm_multiply(M * h, concatenate([Cn[d], [1.]]))[:-1]
+        C[g]      = - X * C[d] - y
+
+        return C
+
+    def get_predictor(self, Cn):
+        """Returns the initial guess for the nonlinear iterations.  The
+        concentrations are extrapolated in time from "Cn" and the accepted
+        solutions of the previous steps, falling back to the linear solve
+        with the current matrices until enough steps are available."""
+
+        Cn_guess = None
+
+        if self.nlpredictor == 'Quadratic extrapolation':
+            Cn_guess = self.get_extrapolation(Cn, 2)
+        if self.nlpredictor != 'Linear solve' and Cn_guess is None:
+            Cn_guess = self.get_extrapolation(Cn, 1)
+        if Cn_guess is None:
+            Cn_guess = self.get_Cn_plus_1(Cn)
+
+        return Cn_guess
+
+    def get_extrapolation(self, Cn, order):
+        """Extrapolates the concentrations to the end of the time step from
+        "Cn" and the last "order" accepted solutions using the actual step
+        sizes.  Returns None if there are not enough previous steps on the
+        current grid."""
+
+        Cn   = array(Cn)
+        h    = self.delt
+        hist = [(C, delt) for (C, delt) in self.history[-order:] if len(C) == len(Cn)]
+
+        if len(hist) < order: return None
+
+        if order == 2:
+            (C2, h2), (C1, h1) = hist
+            L0 = (h + h1) * (h + h1 + h2) / (h1 * (h1 + h2))
+            L1 = - h * (h + h1 + h2) / (h1 * h2)
+            L2 = h * (h + h1) / ((h1 + h2) * h2)
+            return L0 * Cn + L1 * C1 + L2 * C2
+        else:
+            C1, h1 = hist[-1]
+            return Cn + (Cn - C1) * h / h1
+
+    def update_history(self, Cn):
+        """Keeps the last two accepted solutions with the time step taken
+        from them for the predictor and the time step error estimate."""
+
+        self.history = self.history[-1:] + [(array(Cn), self.delt)]
+
+    def get_time_step_error(self, Cn, Cn_plus_1):
+        """Estimates the local truncation error of the step from "Cn" to
+        "Cn_plus_1" from its difference with an explicit extrapolation of the
+        previous solutions (Milne's device).  The error is returned relative
+        to "delterror" times the largest concentration so a step is accepted
+        for values up to one, or None until enough steps are available."""
+
+        h = self.delt
+
+        if self.timeoption == 'Crank-Nicolson':
+            Cn_pred = self.get_extrapolation(Cn, 2)
+            if Cn_pred is None: return None
+            h1, h2  = self.history[-1][1], self.history[-2][1]
+            factor  = h**2 / (h**2 + 2 * (h + h1) * (h + h1 + h2))
+        else:
+            Cn_pred = self.get_extrapolation(Cn, 1)
+            if Cn_pred is None: return None
+            h1      = self.history[-1][1]
+            factor  = h / (2 * h + h1)
+
+        Cn_plus_1 = array(Cn_plus_1)
+        scale     = max(abs(Cn_plus_1).max(), abs(array(Cn)).max())
+
+        if scale == 0: return 0.
+
+        return factor * abs(Cn_plus_1 - Cn_pred).max() / (self.delterror * scale)
+
+    def get_time_step(self, error):
+        """Returns the size of the next time step from the error estimate of
+        the last one.  The step is halved if the error is too large and only
+        doubled if the error of the doubled step (estimated from the order of
+        the time stepping scheme) stays within half the tolerance, so the
+        matrices are not rebuilt while the error stays within that band.  The
+        step stays within deltmin and deltmax."""
+
+        if self.timeoption == 'Crank-Nicolson': order = 3
+        else:                                   order = 2
+
+        delt = self.deltstep
+
+        if error is not None:
+            if error > 1:                                                   delt = self.delt / 2
+            elif error * 2**order < 0.5 and self.delt == self.deltstep:     delt = self.deltstep * 2
+
+        return min(self.deltmax, max(self.deltmin, delt))
+
+    def set_time_step(self, delt, t, tout):
+        """Sets the time step size to "delt", shortened so that the step from
+        "t" ends exactly on the next output time "tout".  The unshortened step
+        is kept in "deltstep" for the following steps.  Returns 1 if the step
+        size changed and the matrices have to be rebuilt."""
+
+        self.deltstep = delt
+
+        if tout > t:
+            if tout - t <= delt * (1 + 10**-8): delt = tout - t
+            elif tout - t < 2 * delt:           delt = (tout - t) / 2
+
+        if delt == self.delt: return 0
+
+        self.delt = delt
+
+        return 1
+
+    def get_Fis_plus_1(self, Fis, FisL, FisM):
+        """Uses the matrices to solve the system.  Returns the concentrations
+        at the next time step in a one-dimensional row array."""
+        Fis_plus_1  = {}
+        FisL_plus_1 = {}
+        FisM_plus_1 = {}
+
+        #all the components are mixed with the same matrices, so they are
+        #solved together as the columns of one right hand side
+        FisMs = self.Acomp_LU.solve(self.Bcomp * transpose(array([FisL[component.name] for component in self.components], dtype = float)))
+
+        for k, component in enumerate(self.components):
+            FisM_plus_1[component.name]  = list(FisMs[:, k])
+            if self.pbio < self.ptot[-1]:
+                Fis_plus_1[component.name]   = FisM_plus_1[component.name][:self.pbio] + Fis[component.name][self.pbio:]
+                FisL_plus_1[component.name]  = FisM_plus_1[component.name][:self.pbio] + FisL[component.name][self.pbio:]
+            else:
+                Fis_plus_1[component.name]   = FisM_plus_1[component.name][:]
+                FisL_plus_1[component.name]  = FisM_plus_1[component.name][:]
+
+        return Fis_plus_1, FisL_plus_1, FisM_plus_1
+
+    def factorize(self, M):
+        """Returns the factorization of the matrix "M."  For the operator
+        splitting the transport matrices are reordered chemical by chemical
+        so that each chemical is an independent narrow banded system."""
+
+        if self.splitting == 1: return PermutedLU(M, self.get_split_order())
+        else:                   return M.factorize()
+
+    def get_split_order(self):
+        """Returns the unknowns ordered by chemical and then by grid point."""
+
+        blocks = self.get_blocks()
+        N      = blocks[-1]
+        node   = searchsorted(blocks, arange(N), 'right') - 1
+
+        return lexsort((arange(N), arange(N) - blocks[node]))
+
+    def split_solver(self, Cn, Fis):
+        """Advances the concentrations one time step with Strang splitting:
+        the reactions over half a time step, the transport over the full time
+        step and the reactions over the second half.  The boundary and
+        interface points are then solved again from the reacted points."""
+
+        C = self.get_reaction_step(Cn, Fis, self.delt / 2)
+        C = self.get_Cn_plus_1(C)
+        C = self.get_reaction_step(C, Fis, self.delt / 2)
+        C = self.get_algebraic_step(C)
+
+        return C
+
+    def get_algebraic_step(self, C):
+        """Returns the concentrations "C" with the unknowns of the algebraic
+        equations (the rows of "B" that are zero, i.e. the boundary conditions
+        and the flux continuity at the interfaces) solved from the other
+        unknowns.  These points have no storage, so they do not react on their
+        own but follow the reacted neighboring points."""
+
+        B         = self.B.copy()
+        B.band    = abs(B.band)
+        algebraic = (B.dot(ones(B.N)) == 0).nonzero()[0]
+
+        residual  = array(transpose(self.A * transpose(matrix(C)) + self.a - self.b))[0]
+        C         = array(C, dtype = float)
+        if len(algebraic) > 0:
+            C[algebraic] = C[algebraic] - linalg.solve(self.A[algebraic[:, None], algebraic[None, :]], residual[algebraic])
+
+        return C
+
+    def get_reaction_step(self, Cn, Fis, tau):
+        """Integrates the reactions over the time "tau" with the trapezoidal
+        rule.  The grid points are independent, so the small systems of the
+        chemicals at every grid point of a layer are solved together, with
+        Newton iterations for the nonlinear reactions.  The boundary and
+        interface points have no storage and are left to the transport and
+        to "get_algebraic_step." """
+
+        C0 = array(Cn, dtype = float)
+        C  = C0.copy()
+        Rs = array(self.Rs_plus_1)
+
+        self.make_grid_rates_plus_1(C0, Fis)
+        rates0 = self.rates_plus_1.copy()
+
+        for k in range(20):
+
+            if k > 0:           self.make_grid_rates_plus_1(C, Fis)
+            if self.reac == 1:  self.make_grid_rates_diff(C, Fis)
+
+            dC = zeros(len(C))
+            for j in range(len(self.layertot)):
+                num  = self.layertot[j].nchemicals
+                i    = arange(1, self.ptot[j+1] - self.ptot[j])
+                if len(i) == 0: continue
+
+                rows = (self.cptot[j] + i * num).reshape(-1, 1) + arange(num)
+                R    = Rs[rows]
+                E    = self.elams_plus_1.blocks[self.ptot[j] + i, :num, :num]
+                J    = - E / 2
+                if self.reac == 1: J = J - self.rates_diff.blocks[self.ptot[j] + i, :num, :num] / 2
+                J[:, arange(num), arange(num)] = J[:, arange(num), arange(num)] + R / tau
+
+                G    = (R * (C[rows] - C0[rows]) / tau - (E * (C[rows] + C0[rows])[:, None, :]).sum(2) / 2
+                        - (self.rates_plus_1[rows] + rates0[rows]) / 2)
+
+                #chemicals that are not present at a grid point are unchanged
+                absent             = R < 0.0000000001
+                J[absent]          = 0
+                nodes, chemicals   = absent.nonzero()
+                J[nodes, chemicals, chemicals] = 1
+                G[absent]          = 0
+
+                dC[rows] = linalg.solve(J, -G[:, :, None])[:, :, 0]
+
+            C = C + dC
+
+            if self.reac == 0 or abs(dC).max() <= self.nlerror * max(abs(C).max(), 10**-20): break
+
+        return C
+
+    def get_blocks(self):
+        """Returns the index of the first unknown of each grid point followed
+        by the total number of unknowns."""
+
+        blocks = []
+        for j in range(len(self.layertot)):
+            blocks = blocks + list(range(self.cptot[j], self.cptot[j+1], self.layertot[j].nchemicals))
+
+        return array(blocks + [self.cptot[-1], self.cptot[-1] + self.layertot[-1].nchemicals])
+
+    def get_Cn_plus_1(self, Cn):
+        """Uses the matrices to solve the system.  Returns the concentrations
+        at the next time step in a one-dimensional row array.  The
+        factorization of "A" is kept until the matrices are rebuilt so a
+        time-invariant system is only factored once."""
+
+        if self.A_LU is None: self.A_LU = self.factorize(self.A)
+
+        return array((transpose(self.A_LU.solve(self.B * transpose(matrix(Cn)) + self.b - self.a))))[0]
+
+
+    def get_Cws(self, C, O = None, flag = None):
+
+        Cws = zeros(self.nchemicals)
+
+        for n in range (self.nchemicals):
+
+            Cws[n] = ((self.U*(1 + self.taucoefs['DOC']/10**6*10**self.chemicals[n].Kdoc)+self.BCs[self.chemicals[n].name].k)/self.taucoefs['h']
+                      /(self.BCs[self.chemicals[n].name].tau+self.BCs[self.chemicals[n].name].k/self.taucoefs['h'])*C[0,n])
+
+        return Cws
+
+
+    def get_flux_weights(self, i):
+        """Returns the three-point centered difference coefficients of the
+        fluxes at grid points "i" (one row for each of the points before, at
+        and after).  The coefficients are kept until the grid changes."""
+
+        if self.flux_key != tuple(self.z):
+            z = array(self.z, dtype = float)
+            W = zeros([3, len(z)])
+            W[0, 1:-1] = (z[1:-1] - z[2:]) / (z[1:-1] - z[:-2]) / (z[2:] - z[:-2])
+            W[1, 1:-1] = (z[:-2] + z[2:] - 2. * z[1:-1]) / (z[1:-1] - z[:-2]) / (z[2:] - z[1:-1])
+            W[2, 1:-1] = (z[1:-1] - z[:-2]) / (z[2:] - z[:-2]) / (z[2:] - z[1:-1])
+
+            self.flux_weights = W
+            self.flux_key     = tuple(self.z)
+
+        return self.flux_weights[:, i]
+
+    def select_points(self, i, points):
+        """Returns the grid points "i" that are in "points," or all of them if
+        "points" is None."""
+
+        if points is None: return i
+        else:              return i[in1d(i, points)]
+
+    def get_flux_velocities(self, U, layer):
+        """Returns the Darcy velocity "U" enhanced by the dissolved organic
+        carbon of "layer" for each chemical."""
+
+        return array([U * (1 + layer.doc/(10**6)*10**chemical.Kdoc) for chemical in self.chemicals])
+
+    def get_fluxes(self, C, O = None, flag = None, Cn_top = None, O_top = None, points = None):
+        """Calculates the fluxes in the domain "z" using the concentration at
+        each grid point "C," the Darcy velocity "U," and the diffusion
+        coefficient at each grid point "D." Converts units to ug/m2/yr.  The
+        fluxes at the interior points of the layers are evaluated for all the
+        points and chemicals of a layer at once."""
+
+        U       = self.U_plus_1
+        Ds      = self.Ds_plus_1
+
+        ptot    = []
+        cptot   = []
+        layers  = []
+        for i in self.ptot: ptot.append(i)
+        for i in self.cptot: cptot.append(i)
+
+        for layer in self.layertot:
+            layers.append(layer)
+
+        C       = array(C, dtype = float)
+        chems   = arange(self.nchemicals)
+
+        i    = 0
+        if self.bio == 1:
+
+            if ptot.count(self.pbio) == 0:
+                ptot.insert(self.layerbio + 1, self.pbio)
+                cptot.insert(self.layerbio + 1, self.cpbio)
+                layers.insert(self.layerbio + 1, self.layertot[self.layerbio])
+
+            Ds_plus_1       = array(self.Ds_plus_1,      dtype = float)
+            DsL_plus_1      = array(self.DsL_plus_1,     dtype = float)
+            Ks_plus_1       = array(self.Ks_plus_1,      dtype = float)
+            KsL_plus_1      = array(self.KsL_plus_1,     dtype = float)
+            DbiopsL_plus_1  = array(self.DbiopsL_plus_1, dtype = float)
+
+            if self.dep == 1 and self.toppoints > 1:
+                F = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
+
+                for jj in range(len(ptot) - 2):
+                    j    = jj + 1
+                    num  = layers[j].nchemicals
+                    i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                    i    = i[i != self.pbio - 1]
+                    iii  = i - self.toppoints + 1
+                    rows = cptot[j] + (i - ptot[j]).reshape(-1, 1) * num + chems
+                    KDbiops_plus_1  = [DbiopsL_plus_1[i].reshape(-1, 1)*KsL_plus_1[rows - num],
+                                       DbiopsL_plus_1[i].reshape(-1, 1)*Ks_plus_1[rows],
+                                       DbiopsL_plus_1[i].reshape(-1, 1)*Ks_plus_1[rows + num]]
+                    F[iii, :] = get_point_fluxes(self.get_flux_velocities(U, layers[j]), Ds_plus_1[rows], KDbiops_plus_1, [C[iii-1], C[iii], C[iii+1]], self.get_flux_weights(i)) * self.flux_factor
+
+                for n in range (self.nchemicals):
+                    chemical = self.chemicals[n]
+                    for jj in range(len(ptot) - 2):
+                        j = jj + 1
+                        i = self.pbio - 1
+                        if ptot[j] < i < ptot[j+1]:
+                            ii = i - ptot[j]
+                            iii = i - self.toppoints + 1
+                            KDbiops_plus_1  = [self.Dbiops_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
+                                               self.Dbiops_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n]]
+                            top_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[iii,n]-C[iii-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[iii,n]+(KDbiops_plus_1[1]*C[iii,n]-KDbiops_plus_1[0]*C[iii-1,n])/(self.z[i]-self.z[i-1])
+                            bot_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[iii+1,n]-C[iii,n])/(self.z[i+1]-self.z[i])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[iii,n]
+                            F[iii,n] = (top_flux + bot_flux) / 2 * self.flux_factor
+
+                        i = ptot[j]
+                        iii = i - self.toppoints + 1
                         KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j]+n],
                                            self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+layers[j].nchemicals+n],
                                            self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+2*layers[j].nchemicals+n]]
@@ -2423,6 +2909,7 @@ class Parameters:
                         F[-1,n] = get_boundary_flux(U* (1+layers[-1].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[-1]+n] , KDbiops_plus_1, C[-3:,n], self.z[-3:]) * self.flux_factor
 
                 if self.nsolidchemicals > 0:
+                    O = array(O, dtype = float)
                     for jj in range(len(ptot) - 2):
                         j = jj + 1
                         num = layers[j].nchemicals
@@ -2431,14 +2918,15 @@ class Parameters:
                             n  = self.solidchemical_list.index(solidchemical.name)
                             nn = self.chemical_list.index(solidchemical.chemical_name)
                             na = layer.solidchemical_list.index(solidchemical.name)
-                            for i in range(ptot[j] + 1, ptot[j+1]):
-                                ii = i - ptot[j]
-                                iii = i - self.toppoints + 1
-                                if i <= self.pbio:
-                                    KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*num+self.nchemicals+n],
-                                                       self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*num+self.nchemicals+n],
-                                                       self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+(ii+1)*num+self.nchemicals+n]]
-                                    F[iii,nn] =  F[iii,nn] + get_point_flux(0, 0, KDbiops_plus_1, O[iii-1:iii+2,n], self.z[i-1:i+2]) * self.flux_factor
+
+                            i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                            i    = i[i <= self.pbio]
+                            iii  = i - self.toppoints + 1
+                            rows = cptot[j] + (i - ptot[j]) * num + self.nchemicals + n
+                            KDbiops_plus_1  = [DbiopsL_plus_1[i]*KsL_plus_1[rows - num],
+                                               DbiopsL_plus_1[i]*Ks_plus_1[rows],
+                                               DbiopsL_plus_1[i]*Ks_plus_1[rows + num]]
+                            F[iii,nn] =  F[iii,nn] + get_point_fluxes(0, 0, KDbiops_plus_1, [O[iii-1,n], O[iii,n], O[iii+1,n]], self.get_flux_weights(i)) * self.flux_factor
 
                             i = ptot[j]
                             iii = i - self.toppoints + 1
@@ -2451,25 +2939,30 @@ class Parameters:
             else:
                 F = zeros((len(self.z), self.nchemicals))
 
+                for j in range(len(ptot) - 1):
+                    num  = layers[j].nchemicals
+                    i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                    i    = i[i != self.pbio - 1]
+                    rows = cptot[j] + (i - ptot[j]).reshape(-1, 1) * num + chems
+                    KDbiops_plus_1  = [DbiopsL_plus_1[i].reshape(-1, 1)*KsL_plus_1[rows - num],
+                                       DbiopsL_plus_1[i].reshape(-1, 1)*Ks_plus_1[rows],
+                                       DbiopsL_plus_1[i].reshape(-1, 1)*Ks_plus_1[rows + num]]
+                    F[i, :] = get_point_fluxes(self.get_flux_velocities(U, layers[j]), DsL_plus_1[rows], KDbiops_plus_1, [C[i-1], C[i], C[i+1]], self.get_flux_weights(i)) * self.flux_factor
+
                 for n in range (self.nchemicals):
                     chemical = self.chemicals[n]
                     for j in range(len(ptot) - 1):
-                        for i in range(ptot[j] + 1, ptot[j+1]):
+                        i = self.pbio - 1
+                        if ptot[j] < i < ptot[j+1]:
                             ii = i - ptot[j]
-                            if i == self.pbio - 1 :
-                                KDbiops_plus_1  = [self.DbiopsL[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
-                                                   self.Dbiops[i] *self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n]]
-                                top_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[i,n]-C[i-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]+(KDbiops_plus_1[1]*C[i,n]-KDbiops_plus_1[0]*C[i-1,n])/(self.z[i]-self.z[i-1])
-                                bot_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[i+1,n]-C[i,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]
-                                F[i,n] = (top_flux + bot_flux) / 2 * self.flux_factor
-                            else:
-                                KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
-                                                   self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n],
-                                                   self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+(ii+1)*layers[j].nchemicals+n]]
-                                F[i,n] =  get_point_flux(U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[i-1:i+2,n], self.z[i-1:i+2]) * self.flux_factor
+                            KDbiops_plus_1  = [self.DbiopsL[i]*self.KsL_plus_1[cptot[j]+(ii-1)*layers[j].nchemicals+n],
+                                               self.Dbiops[i] *self.Ks_plus_1[cptot[j]+ii*layers[j].nchemicals+n]]
+                            top_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[i,n]-C[i-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]+(KDbiops_plus_1[1]*C[i,n]-KDbiops_plus_1[0]*C[i-1,n])/(self.z[i]-self.z[i-1])
+                            bot_flux = self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n]*(C[i+1,n]-C[i,n])/(self.z[i+1]-self.z[i])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]
+                            F[i,n] = (top_flux + bot_flux) / 2 * self.flux_factor
                         i = ptot[j+1]
                         if i == self.pbio:
-                            F[i,n] = (self.Ds_plus_1[cptot[j+1]+n]*(C[i,n]-C[i-1,n])/(self.z[i-1]-self.z[i-2])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]) * self.flux_factor
+                            F[i,n] = (self.Ds_plus_1[cptot[j+1]+n]*(C[i,n]-C[i-1,n])/(self.z[i]-self.z[i-1])+ U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc)*C[i,n]) * self.flux_factor
                         else:
                             KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j+1]-2*layers[j].nchemicals+n],
                                                self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j+1]-layers[j].nchemicals+n],
@@ -2492,6 +2985,7 @@ class Parameters:
                         F[i,n] = get_boundary_flux(U* (1+layers[-1].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[-1]+n] ,KDbiops_plus_1,  C[-3:,n], self.z[-3:]) * self.flux_factor
 
                 if self.nsolidchemicals > 0:
+                    O = array(O, dtype = float)
                     for j in range(len(ptot) - 1):
                         layer = layers[j]
                         for solidchemical in layer.solidchemicals:
@@ -2500,13 +2994,14 @@ class Parameters:
                             na = layer.solidchemical_list.index(solidchemical.name)
                             nb = layer.solidchemical_list.index(solidchemical.name)
                             num = layer.nchemicals
-                            for i in range(ptot[j] + 1, ptot[j+1]):
-                                if i <= self.pbio:
-                                    ii = i - ptot[j]
-                                    KDbiops_plus_1  = [self.DbiopsL_plus_1[i]*self.KsL_plus_1[cptot[j]+(ii-1)*num+self.nchemicals+na],
-                                                       self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+ii*num+self.nchemicals+na],
-                                                       self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+(ii+1)*num+self.nchemicals+na]]
-                                    F[i,nn] =  F[i,nn] + get_point_flux(0, 0, KDbiops_plus_1, O[i-1:i+2,n], self.z[i-1:i+2]) * self.flux_factor
+
+                            i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                            i    = i[i <= self.pbio]
+                            rows = cptot[j] + (i - ptot[j]) * num + self.nchemicals + na
+                            KDbiops_plus_1  = [DbiopsL_plus_1[i]*KsL_plus_1[rows - num],
+                                               DbiopsL_plus_1[i]*Ks_plus_1[rows],
+                                               DbiopsL_plus_1[i]*Ks_plus_1[rows + num]]
+                            F[i,nn] =  F[i,nn] + get_point_fluxes(0, 0, KDbiops_plus_1, [O[i-1,n], O[i,n], O[i+1,n]], self.get_flux_weights(i)) * self.flux_factor
 
                             i = ptot[j]
                             if i <= self.pbio and j < len(ptot) - 1:
@@ -2516,23 +3011,22 @@ class Parameters:
                                                    self.DbiopsL_plus_1[i]*self.Ks_plus_1[cptot[j]+2*num+self.nchemicals+na]]
                                 F[i,nn] =  F[i,nn] + get_top_flux(0, 0, KDbiops_plus_1, O[i:i+3,n], self.z[i:i+3]) * self.flux_factor
         else:
+            Ds_plus_1 = array(self.Ds_plus_1, dtype = float)
+
             if self.dep == 1 and self.toppoints > 1:
                 F = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
 
+                for jj in range(len(ptot) - 2):
+                    j    = jj + 1
+                    i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                    iii  = i - self.toppoints + 1
+                    rows = cptot[j] + (i - ptot[j]).reshape(-1, 1) * layers[j].nchemicals + chems
+                    F[iii, :] = get_point_fluxes(self.get_flux_velocities(U, layers[j]), Ds_plus_1[rows], [0,0,0], [C[iii-1], C[iii], C[iii+1]], self.get_flux_weights(i)) * self.flux_factor
+
                 for n in range (self.nchemicals):
                     chemical = self.chemicals[n]
                     for jj in range(len(ptot) - 2):
                         j = jj + 1
-                        for i in range(ptot[j] + 1, ptot[j+1]):
-                            ii = i - ptot[j]
-                            iii = i - self.toppoints + 1
-                            if ii == 0:
-                                KDbiops_plus_1 =  [0,0,0]
-                                F[iii,n] =  get_point_flux(U* (1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[iii-1:iii+2,n], self.z[i-1:i+2]) * self.flux_factor
-                            else:
-                                KDbiops_plus_1 =  [0,0,0]
-                                F[iii,n] =  get_point_flux(U* (1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[iii-1:iii+2,n], self.z[i-1:i+2]) * self.flux_factor
-
                         i = ptot[j]
                         iii = i - self.toppoints + 1
                         KDbiops_plus_1 =  [0,0,0]
@@ -2552,21 +3046,17 @@ class Parameters:
             else:
                 F = zeros((len(self.z), self.nchemicals))
 
+                #the interior points of the layers
+                for j in range(len(ptot) - 1):
+                    i    = self.select_points(arange(ptot[j] + 1, ptot[j+1]), points)
+                    rows = cptot[j] + (i - ptot[j]).reshape(-1, 1) * layers[j].nchemicals + chems
+                    F[i, :] = get_point_fluxes(self.get_flux_velocities(U, layers[j]), Ds_plus_1[rows], [0,0,0], [C[i-1], C[i], C[i+1]], self.get_flux_weights(i)) * self.flux_factor
+
                 for n in range (self.nchemicals):
                     #top boundary
                     chemical = self.chemicals[n]
 
                     for j in range(len(ptot) - 1):
-                        #loop through the interior points of the layers
-                        for i in range(ptot[j] + 1, ptot[j+1]):
-                            ii = i - ptot[j]
-                            if ii == 0:
-                                KDbiops_plus_1 =  [0,0,0]
-                                F[i,n] =  get_point_flux(U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.DsL_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[i-1:i+2,n], self.z[i-1:i+2]) * self.flux_factor
-                            else:
-                                KDbiops_plus_1 =  [0,0,0]
-                                F[i,n] =  get_point_flux(U*(1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[j]+ii*layers[j].nchemicals+n], KDbiops_plus_1, C[i-1:i+2,n], self.z[i-1:i+2]) * self.flux_factor
-
                         i = ptot[j+1]
                         KDbiops_plus_1 =  [0,0,0]
                         F[i,n] = get_boundary_flux(U* (1+layers[j].doc/(10**6)*10**chemical.Kdoc), self.Ds_plus_1[cptot[j+1]+n], KDbiops_plus_1, C[i-2:i+1,n], self.z[i-2:i+1]) * self.flux_factor
@@ -2584,46 +3074,40 @@ class Parameters:
 
         return F
 
-    def get_qs(self, C, Fis, O = None):
+    def get_qs(self, C, Fis, O = None, points = None):
         """Calculates the solid-phase concentration "q" in the domain "z"
-        using the pore water concentration at each grid point "C." """
+        using the pore water concentration at each grid point "C," or only at
+        the grid points in "points" if it is given."""
 
         if self.dep == 1 and self.toppoints > 1:
-            q = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
-            for n in range (self.nchemicals):
-                chemical = self.chemicals[n]
-                for jj in range(len(self.ptot) - 2):
-                    j = jj + 1
-                    for i in range(self.ptot[j], self.ptot[j+1]):
-                        iii = i - self.toppoints + 1
-                        q[iii, n] = 0
-                        matrix_rho = 0
-                        for component in self.components:
-                            q[iii,n] = q[iii,n] + self.sorptions[component.name][chemical.name].get_q(C[iii,n]) * Fis[component.name][i] * component.rho
-                            matrix_rho = matrix_rho + Fis[component.name][i] * component.rho
-                            if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
-                                for solidchemical in self.solidchemicals:
-                                    if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
-                                        q[iii,n] = q[iii,n] + O[iii,self.solidchemicals.index(solidchemical)]* Fis[component.name][i] * component.rho
-                        q[iii,n] = q[iii,n]/matrix_rho
+            i   = self.select_points(arange(self.ptot[1], self.ptot[-1]), points)
+            iii = i - self.toppoints + 1
+            q   = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
+        else:
+            i   = self.select_points(arange(0, self.ptot[-1] + 1), points)
+            iii = i
+            q   = zeros((len(self.z), self.nchemicals))
 
+        Fs = {}
+        for component in self.components:
+            if points is None: Fs[component.name] = array(Fis[component.name], dtype = float)[i] * component.rho
+            else:              Fs[component.name] = array([Fis[component.name][k] for k in i], dtype = float) * component.rho
+
+        matrix_rho = zeros(len(i))
+        for component in self.components:
+            matrix_rho = matrix_rho + Fs[component.name]
+
+        for n in range (self.nchemicals):
+            chemical = self.chemicals[n]
+            for component in self.components:
+                Fi       = Fs[component.name]
+                q[iii,n] = q[iii,n] + self.sorptions[component.name][chemical.name].get_q(component, C[iii,n]) * Fi
+                if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
+                    for solidchemical in self.solidchemicals:
+                        if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
+                            q[iii,n] = q[iii,n] + O[iii,self.solidchemicals.index(solidchemical)] * Fi
+            q[iii,n] = q[iii,n]/matrix_rho
 
-        else:
-            q = zeros((len(self.z), self.nchemicals))
-            for n in range (self.nchemicals):
-                chemical = self.chemicals[n]
-                for j in range(len(self.ptot) - 1):
-                    for i in range(self.ptot[j], self.ptot[j+1]+1):
-                        q[i, n] = 0
-                        matrix_rho = 0
-                        for component in self.components:
-                            q[i,n] = q[i,n] + self.sorptions[component.name][chemical.name].get_q(C[i,n]) * Fis[component.name][i] * component.rho
-                            matrix_rho = matrix_rho + Fis[component.name][i] * component.rho
-                            if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
-                                for solidchemical in self.solidchemicals:
-                                    if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
-                                        q[i,n] = q[i,n] + O[i,self.solidchemicals.index(solidchemical)]* Fis[component.name][i] * component.rho
-                        q[i,n] = q[i,n]/matrix_rho
         return q
 
     def get_qms(self, C, Fis, O = None):
@@ -2631,44 +3115,32 @@ class Parameters:
         using the pore water concentration at each grid point "C." """
 
         if self.dep == 1 and self.toppoints > 1:
-            qm = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals, len(self.components)))
-            for n in range (self.nchemicals):
-                chemical = self.chemicals[n]
-                for jj in range(len(self.ptot) - 2):
-                    j = jj +1
-                    for i in range(self.ptot[j], self.ptot[j+1]+1):
-                        iii = i - self.toppoints + 1
-                        for component in self.components:
-                            m = self.component_list.index(component.name)
-                            if Fis[component.name][i] > 0.0001:
-                                qm[iii,n,m] = self.sorptions[component.name][chemical.name].get_q(C[iii,n])
-                                if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
-                                    for solidchemical in self.solidchemicals:
-                                        if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
-                                            qm[iii,n,m] = qm[iii,n,m] + O[iii,self.solidchemicals.index(solidchemical)]
-
+            i   = arange(self.ptot[1], self.ptot[-1] + 1)
+            iii = i - self.toppoints + 1
+            qm  = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals, len(self.components)))
         else:
-            qm = zeros((len(self.z), self.nchemicals, len(self.components)))
-            for n in range (self.nchemicals):
-                chemical = self.chemicals[n]
-                for j in range(len(self.ptot) - 1):
-                    for i in range(self.ptot[j], self.ptot[j+1]+1):
-                        for component in self.components:
-                            m = self.component_list.index(component.name)
-                            if Fis[component.name][i] > 0.0001:
-                                qm[i,n,m] = self.sorptions[component.name][chemical.name].get_q(C[i,n])
-                                if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
-                                    for solidchemical in self.solidchemicals:
-                                        if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
-                                            qm[i,n,m] = qm[i,n,m] + O[i,self.solidchemicals.index(solidchemical)]
+            i   = arange(0, self.ptot[-1] + 1)
+            iii = i
+            qm  = zeros((len(self.z), self.nchemicals, len(self.components)))
+
+        for n in range (self.nchemicals):
+            chemical = self.chemicals[n]
+            for component in self.components:
+                m = self.component_list.index(component.name)
+                k = iii[(array(Fis[component.name], dtype = float)[i] > 0.0001).nonzero()[0]]
+                qm[k,n,m] = self.sorptions[component.name][chemical.name].get_q(component, C[k,n])
+                if self.sorptions[component.name][chemical.name].kinetic == 'Transient':
+                    for solidchemical in self.solidchemicals:
+                        if solidchemical.chemical_name == chemical.name and solidchemical.component_name == component.name:
+                            qm[k,n,m] = qm[k,n,m] + O[k,self.solidchemicals.index(solidchemical)]
 
         return qm
 
 
-    def get_Ws(self,C, O = None):
+    def get_Ws(self,C, O = None, points = None):
         """Calculates the total (aqueous + solid-phase) concentration "W" in
         the domain "z" using the pore water concentration at each grid point
-        "C." """
+        "C," or only at the grid points in "points" if it is given."""
 
         if self.dep == 1 and self.toppoints > 1:
             W = zeros(((len(self.z)-self.toppoints + 1), self.nchemicals))
@@ -2677,7 +3149,7 @@ class Parameters:
                 for jj in range(len(self.ptot) - 2):
                     j = jj + 1
                     layer  = self.layertot[j]
-                    for i in range(self.ptot[j], self.ptot[j+1]+1):
+                    for i in self.select_points(arange(self.ptot[j], self.ptot[j+1]+1), points):
                         iii = i - self.toppoints + 1
                         W[iii, n] = C[iii, n] *(1+layer.doc/(10**6)*10**chemical.Kdoc)
 
@@ -2687,13 +3159,24 @@ class Parameters:
                 chemical = self.chemicals[n]
                 for j in range(len(self.ptot) - 1):
                     layer  = self.layertot[j]
-                    for i in range(self.ptot[j], self.ptot[j+1]+1):
+                    for i in self.select_points(arange(self.ptot[j], self.ptot[j+1]+1), points):
                         W[i, n] = C[i, n] *(1+layer.doc/(10**6)*10**chemical.Kdoc)
 
         return W
 
 class Output:
-    """Stores the output information from a simulation."""
+    """Stores the output information from a simulation.  Output arrays
+    larger than "memory_limit" bytes (or that cannot be allocated) are kept
+    in memory-mapped files in a temporary directory, so only the time slices
+    being stored or read are held in memory.  Only the variables, depths and
+    chemicals of the output specification of the system are stored; the
+    arrays of the other variables are None."""
+
+    memory_limit = 2**30
+
+    variables    = ['O', 'C', 'F', 'q', 'W', 'qm', 'Cw', 'Fi']
+
+    results      = ['C', 'Fi', 'F', 'q', 'qm', 'W', 'Cw']
 
     def __init__(self, parameters):
         """Constructor method.  Essentially this just lumps the output data
@@ -2713,37 +3196,109 @@ class Output:
         Fplot -- The fluxes at the times in tplot
         qplot -- The solid concentrations at the times in tplot
         Wplot -- The total concentrations at the times in tplot
+        nliterations -- The nonlinear iterations taken at each time step
+        steperrors -- The times of the adaptive steps that were accepted at
+                      the minimum step size with an error above the tolerance
+        rows  -- The grid points in the output depth window
+        columns -- The indices of the output chemicals
+        points -- The observation points (depth, variable, chemical name)
+        observation_times  -- The times of the observation samples
+        observation_values -- The values of the observation points at the
+                              observation times
         """
+        z                       = parameters.zdep + parameters.z
+        depths                  = parameters.outputdepths
+
         self.p                  = parameters.p
-        self.z                  = parameters.zdep + parameters.z
+        self.nz                 = len(z)
+        self.grid               = z
+        self.rows               = [i for i in range(len(z)) if depths is None or (round(z[i], 8) >= round(depths[0], 8) and round(z[i], 8) <= round(depths[1], 8))]
+        self.z                  = [z[i] for i in self.rows]
         self.deplayer           = parameters.deplayer
         self.layers             = parameters.layers
-        self.chemicals          = parameters.chemicals
-        self.nchemicals         = parameters.nchemicals
+        self.columns            = [n for n in range(parameters.nchemicals) if parameters.outputchemicals is None or parameters.outputchemicals.count(parameters.chemicals[n].name) > 0]
+        self.chemicals          = [parameters.chemicals[n] for n in self.columns]
+        self.nchemicals         = len(self.chemicals)
         self.outputsteps        = parameters.outputsteps
+        self.nliterations       = parameters.nliterations
+        self.steperrors         = parameters.steperrors
 
         self.solidchemicals     = parameters.solidchemicals
         self.nsolidchemicals    = parameters.nsolidchemicals
         self.solidchemical_list = parameters.solidchemical_list
 
-        self.times      = [parameters.tstart + round(i * (parameters.tfinal_ori-parameters.tstart)/self.outputsteps, 10) for i in range(self.outputsteps+1)]
+        #the pore water and solid chemical concentrations are always stored
+        self.variables          = [name for name in Output.variables if name == 'O' or name == 'C' or parameters.outputvariables.count(name) > 0]
+
+        self.times    = get_output_times(parameters)
         self.sizeflag = 0
+        self.storage  = None
+
+        shapes = {'O':  (len(self.times), len(self.z), parameters.nsolidchemicals),
+                  'C':  (len(self.times), len(self.z), self.nchemicals),
+                  'F':  (len(self.times), len(self.z), self.nchemicals),
+                  'q':  (len(self.times), len(self.z), self.nchemicals),
+                  'W':  (len(self.times), len(self.z), self.nchemicals),
+                  'qm': (len(self.times), len(self.z), self.nchemicals, len(parameters.components)),
+                  'Cw': (len(self.times), self.nchemicals),
+                  'Fi': (len(self.times), len(self.z), parameters.ncomponents)}
+
+        for name in Output.variables: setattr(self, name, None)
 
         try:
-            self.O  = zeros((len(self.times), len(self.z), parameters.nsolidchemicals))
-            self.C  = zeros((len(self.times), len(self.z), parameters.nchemicals))
-            self.F  = zeros((len(self.times), len(self.z), parameters.nchemicals))
-            self.q  = zeros((len(self.times), len(self.z), parameters.nchemicals))
-            self.W  = zeros((len(self.times), len(self.z), parameters.nchemicals))
-            self.qm = zeros((len(self.times), len(self.z), parameters.nchemicals, len(parameters.components)))
-            self.Cw = zeros((len(self.times), parameters.nchemicals))
-            self.Fi = zeros((len(self.times), len(self.z), parameters.ncomponents))
-
-        except :    self.sizeflag = 1
+            if sum([8 * prod(shapes[name]) for name in self.variables]) > self.memory_limit: raise MemoryError
+            for name in self.variables: setattr(self, name, zeros(shapes[name]))
+        except:
+            try:    self.make_store(shapes)
+            except: self.sizeflag = 1
         self.n     = 0     #index of next time to collect data
 
+        #observation points are sampled at every solver step or at the
+        #"observationsteps" times, independently of the output times
+        self.points           = parameters.observations
+        self.observationsteps = parameters.observationsteps
+        if self.observationsteps > 0 and parameters.steady == 0:
+            self.observation_times = [parameters.tstart + round(i * (parameters.tfinal_ori-parameters.tstart)/self.observationsteps, 10) for i in range(self.observationsteps+1)]
+        else:
+            self.observation_times = []
+        self.observation_values = []
+        self.last_observation   = None
+
+        self.index_maps = {}
+        self.point_maps = None
+
         self.parameters = parameters
 
+    def make_store(self, shapes):
+        """Makes the output arrays with "shapes" as memory-mapped .npy files
+        in a temporary directory.  The files are filled one time slice at a
+        time by "store" and paged in by the postprocessor as it reads them."""
+
+        for name in self.variables: setattr(self, name, None)
+        self.remove_store()
+
+        self.storage = tempfile.mkdtemp(prefix = 'capsim_output_')
+        for name in self.variables:
+            setattr(self, name, open_memmap(os.path.join(self.storage, name + '.npy'), mode = 'w+', dtype = float, shape = shapes[name]))
+
+    def remove_store(self):
+        """Releases the memory-mapped arrays and deletes their temporary
+        directory.  The output owns its arrays, so dropping its references
+        unmaps the files, which cannot be deleted on Windows while they are
+        mapped.  If a caller still holds a view of an array the directory is
+        kept to be deleted again later."""
+
+        if self.storage is not None:
+            for name in Output.variables: setattr(self, name, None)
+
+            shutil.rmtree(self.storage, ignore_errors = True)
+            if not os.path.exists(self.storage): self.storage = None
+
+    def __del__(self):
+
+        try:    self.remove_store()
+        except: pass
+
     def copy(self):
 
         output = Output(self.parameters)
@@ -2751,184 +3306,119 @@ class Output:
 
         return output
 
+    def is_stored(self, name):
+        """Returns 1 if the variable "name" is in the output specification."""
 
-    def converter (self, parameters, Cn, Fis):
+        return self.variables.count(name) > 0
 
-        """Stores the concentrations and fluxes from a given time."""
+    def select(self, X, chemicals = 1):
+        """Returns the rows of the profiles "X" in the output depth window
+        and, with "chemicals," the columns of the output chemicals."""
+
+        if chemicals == 1: return X[ix_(self.rows, self.columns)]
+        else:              return X[self.rows]
+
+    def get_profiles(self, parameters, Cn, Fis, names):
+        """Returns a dictionary of the profiles on the output grid of the
+        pore water concentrations and the variables in "names" for the
+        unknowns "Cn."  The other profiles are neither allocated nor
+        computed."""
         self.ptot       = parameters.ptot
         self.cptot      = parameters.cptot
         self.layertot   = parameters.layertot
 
         z_t             = parameters.z
 
+        profiles        = {}
+        for name in ['F', 'q', 'W']:
+            if names.count(name) > 0: profiles[name] = zeros((self.nz, parameters.nchemicals))
+        if names.count('qm') > 0:     profiles['qm'] = zeros((self.nz, parameters.nchemicals, len(parameters.components)))
+        if names.count('Cw') > 0:     profiles['Cw'] = zeros(parameters.nchemicals)
+
         if parameters.dep == 1 and parameters.toppoints > 1:
 
             toppoints           = parameters.toppoints
-            pdep                = len(self.z) - (len(parameters.z) - toppoints + 1)
-
-            Cn_2D               = zeros((len(self.z), parameters.nchemicals))
-            Solid_Cn_2D         = zeros((len(self.z), self.nsolidchemicals))
-            Fis_2D              = zeros((len(self.z), parameters.ncomponents))
-
-            F_2D                = zeros((len(self.z), parameters.nchemicals))
-            q_2D                = zeros((len(self.z), parameters.nchemicals))
-            qm_2D               = zeros((len(self.z), parameters.nchemicals, len(parameters.components)))
-            W_2D                = zeros((len(self.z), parameters.nchemicals))
-            Cw                  = zeros(parameters.nchemicals)
-
-            Cn_top_2D           = zeros((toppoints + 1, parameters.nchemicals))
-            Solid_Cn_top_2D     = zeros((toppoints + 1, self.nsolidchemicals))
-            Fis_top_2D          = zeros((toppoints + 1, parameters.ncomponents))
-
-            for jj in range(len(self.layertot) - 1):
-                j = jj + 1
-                num = self.layertot[j].nchemicals
-                for i in range((self.ptot[j+1]-self.ptot[j])):
-                    for n in range(self.nchemicals):
-                        Cn_2D[pdep + self.ptot[j] - toppoints + 1 + i,n] = Cn[self.cptot[j] + i*num + n] * self.chemicals[n].MW
-                for n in range(self.nchemicals):
-                    Cn_2D[pdep + self.ptot[-1] - toppoints + 1,n]        = Cn[self.cptot[-1] + n] * self.chemicals[n].MW
-                    Cn_2D[pdep,n]                                        = Cn[n] * self.chemicals[n].MW
-            for n in range(self.nchemicals):
-                for i in range(toppoints + 1):
-                    Cn_top_2D[i,n]        = Cn[self.layertot[0].nchemicals*i+n] * self.chemicals[n].MW
+            pdep                = self.nz - (len(parameters.z) - toppoints + 1)
 
-            if self.nsolidchemicals > 0:
-                for jj in range(len(self.layertot) - 1):
-                    j = jj + 1
-                    num = self.layertot[j].nsolidchemicals
-                    for i in range((self.ptot[j+1]-self.ptot[j])):
-                        for n in range(num):
-                            nn = parameters.solidchemical_list.index(self.layertot[j].solidchemicals[n].name)
-                            Solid_Cn_2D[pdep + self.ptot[j] - toppoints + 1 + i,nn]        = Cn[self.cptot[j] + i*(self.nchemicals + num) + self.nchemicals + n] * self.solidchemicals[nn].MW
-                for n in range(self.layertot[-1].nsolidchemicals):
-                    nn = parameters.solidchemical_list.index(self.layertot[-1].solidchemicals[n].name)
-                    Solid_Cn_2D[pdep + self.ptot[-1] - toppoints + 1, nn]                  = Cn[self.cptot[-1] + self.nchemicals + n] * self.solidchemicals[nn].MW
-                    Solid_Cn_2D[pdep,nn]                                                   = Cn[self.nchemicals + n] * self.solidchemicals[nn].MW
-
-                for n in range(self.nsolidchemicals):
-                    for i in range(toppoints + 1):
-                        Solid_Cn_top_2D[i,n]           = Cn[self.layertot[0].nchemicals*i+self.nchemicals+n] * self.chemicals[n].MW
-
-            for jj in range(len(self.layertot) - 1):
-                j = jj + 1
-                for i in range((self.ptot[j+1]-self.ptot[j])):
-                    for m in range(parameters.ncomponents):
-                        Fis_2D[pdep + self.ptot[j] - toppoints + 1 + i,m] = Fis[parameters.components[m].name][self.ptot[j] + i]
-                for m in range(parameters.ncomponents):
-                    Fis_2D[pdep + self.ptot[-1]- toppoints + 1,m]         = Fis[parameters.components[m].name][self.ptot[-1]]
-                    Fis_2D[pdep,m]                                        = Fis[parameters.components[m].name][0]
-
-                for m in range(parameters.ncomponents):
-                    for i in range(parameters.toppoints + 1):
-                        Fis_top_2D[i,m]                                   = Fis[parameters.components[m].name][i]
+            maps                = self.get_index_maps(parameters, 1)
+            Cn                  = array(Cn, dtype = float)
 
+            Cn_2D               = self.scatter(maps['C'],   Cn, pdep, (self.nz, parameters.nchemicals))
+            Solid_Cn_2D         = self.scatter(maps['O'],   Cn, pdep, (self.nz, self.nsolidchemicals))
+            if names.count('Fi') > 0:
+                profiles['Fi']  = self.scatter(maps['Fis'], self.get_fractions(parameters, Fis), pdep, (self.nz, parameters.ncomponents))
 
-            if self.nsolidchemicals > 0:
-                F_2D[pdep:, :]      = parameters.get_fluxes(Cn_2D[pdep:, :], O = Solid_Cn_2D[pdep:, :], Cn_top = Cn_top_2D, O_top = Solid_Cn_top_2D )
-                q_2D[pdep:, :]      = parameters.get_qs(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
-                W_2D[pdep:, :]      = parameters.get_Ws(Cn_2D[pdep:, :], Solid_Cn_2D[pdep:, :])
-                qm_2D[pdep:, :, :]  = parameters.get_qms(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
-            else:
-                F_2D[pdep:, :]      = parameters.get_fluxes(Cn_2D[pdep:, :], Cn_top = Cn_top_2D)
-                q_2D[pdep:, :]      = parameters.get_qs(Cn_2D[pdep:, :], Fis)
-                W_2D[pdep:, :]      = parameters.get_Ws(Cn_2D[pdep:, :])
-                qm_2D[pdep:, :, :]  = parameters.get_qms(Cn_2D[pdep:, :], Fis)
+            Cn_top_2D           = self.scatter(maps['Ctop'], Cn, 0, (toppoints + 1, parameters.nchemicals))
+            Solid_Cn_top_2D     = self.scatter(maps['Otop'], Cn, 0, (toppoints + 1, self.nsolidchemicals))
 
-            if parameters.topBCtype == 'Finite mixed water column':
-                Cw = parameters.get_Cws(Cn_2D[pdep:, :], flag = 1)
+            if self.nsolidchemicals > 0:
+                if names.count('F') > 0:  profiles['F'][pdep:, :]     = parameters.get_fluxes(Cn_2D[pdep:, :], O = Solid_Cn_2D[pdep:, :], Cn_top = Cn_top_2D, O_top = Solid_Cn_top_2D )
+                if names.count('q') > 0:  profiles['q'][pdep:, :]     = parameters.get_qs(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
+                if names.count('W') > 0:  profiles['W'][pdep:, :]     = parameters.get_Ws(Cn_2D[pdep:, :], Solid_Cn_2D[pdep:, :])
+                if names.count('qm') > 0: profiles['qm'][pdep:, :, :] = parameters.get_qms(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
             else:
-                Cw = zeros(parameters.nchemicals)
+                if names.count('F') > 0:  profiles['F'][pdep:, :]     = parameters.get_fluxes(Cn_2D[pdep:, :], Cn_top = Cn_top_2D)
+                if names.count('q') > 0:  profiles['q'][pdep:, :]     = parameters.get_qs(Cn_2D[pdep:, :], Fis)
+                if names.count('W') > 0:  profiles['W'][pdep:, :]     = parameters.get_Ws(Cn_2D[pdep:, :])
+                if names.count('qm') > 0: profiles['qm'][pdep:, :, :] = parameters.get_qms(Cn_2D[pdep:, :], Fis)
 
         else:
-            pdep            = len(self.z) - len(parameters.z)
+            pdep            = self.nz - len(parameters.z)
 
-            Cn_2D           = zeros((len(self.z), parameters.nchemicals))
-            Solid_Cn_2D     = zeros((len(self.z), self.nsolidchemicals))
-            F_2D            = zeros((len(self.z), parameters.nchemicals))
-            q_2D            = zeros((len(self.z), parameters.nchemicals))
-            qm_2D           = zeros((len(self.z), parameters.nchemicals, len(parameters.components)))
-            W_2D            = zeros((len(self.z), parameters.nchemicals))
-            Cw              = zeros(parameters.nchemicals)
+            maps            = self.get_index_maps(parameters, 0)
+            Cn              = array(Cn, dtype = float)
 
-            for j in range(len(self.layertot)):
-                num = self.layertot[j].nchemicals
-                for i in range((self.ptot[j+1]-self.ptot[j])):
-                    for n in range(self.nchemicals):
-                        Cn_2D[pdep + self.ptot[j] + i,n] = Cn[self.cptot[j] + i*num + n] * self.chemicals[n].MW
-                for n in range(self.nchemicals):
-                    Cn_2D[pdep + self.ptot[-1],n]        = Cn[self.cptot[-1] + n] * self.chemicals[n].MW
-
-            if self.nsolidchemicals > 0:
-                for j in range(len(self.layertot)):
-                    num = self.layertot[j].nsolidchemicals
-                    for i in range((self.ptot[j+1]-self.ptot[j])):
-                        for n in range(num):
-                            nn = parameters.solidchemical_list.index(self.layertot[j].solidchemicals[n].name)
-                            Solid_Cn_2D[pdep + self.ptot[j] + i,nn]        = Cn[self.cptot[j] + i*(self.nchemicals + num) + self.nchemicals + n] * self.solidchemicals[nn].MW
-                for n in range(self.layertot[-1].nsolidchemicals):
-                    nn = parameters.solidchemical_list.index(self.layertot[-1].solidchemicals[n].name)
-                    Solid_Cn_2D[pdep + self.ptot[-1],nn]        = Cn[self.cptot[-1] + self.nchemicals + n] * self.solidchemicals[nn].MW
-
-
-            Fis_2D           = zeros((len(self.z), parameters.ncomponents))
-            for j in range(len(self.layertot)):
-                for i in range((self.ptot[j+1]-self.ptot[j])):
-                    for m in range(parameters.ncomponents):
-                        Fis_2D[pdep + self.ptot[j] + i,m]        = Fis[parameters.components[m].name][self.ptot[j] + i]
-                for m in range(parameters.ncomponents):
-                    Fis_2D[pdep + self.ptot[-1],m]               = Fis[parameters.components[m].name][self.ptot[-1]]
+            Cn_2D           = self.scatter(maps['C'],   Cn, pdep, (self.nz, parameters.nchemicals))
+            Solid_Cn_2D     = self.scatter(maps['O'],   Cn, pdep, (self.nz, self.nsolidchemicals))
+            if names.count('Fi') > 0:
+                profiles['Fi'] = self.scatter(maps['Fis'], self.get_fractions(parameters, Fis), pdep, (self.nz, parameters.ncomponents))
 
             if self.nsolidchemicals > 0:
-                F_2D[pdep:, :]      = parameters.get_fluxes(Cn_2D[pdep:, :], O = Solid_Cn_2D[pdep:, :])
-                q_2D[pdep:, :]      = parameters.get_qs(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
-                W_2D[pdep:, :]      = parameters.get_Ws(Cn_2D[pdep:, :], Solid_Cn_2D[pdep:, :])
-                qm_2D[pdep:, :, :]  = parameters.get_qms(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
+                if names.count('F') > 0:  profiles['F'][pdep:, :]     = parameters.get_fluxes(Cn_2D[pdep:, :], O = Solid_Cn_2D[pdep:, :])
+                if names.count('q') > 0:  profiles['q'][pdep:, :]     = parameters.get_qs(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
+                if names.count('W') > 0:  profiles['W'][pdep:, :]     = parameters.get_Ws(Cn_2D[pdep:, :], Solid_Cn_2D[pdep:, :])
+                if names.count('qm') > 0: profiles['qm'][pdep:, :, :] = parameters.get_qms(Cn_2D[pdep:, :], Fis, Solid_Cn_2D[pdep:, :])
             else:
-                F_2D[pdep:, :]      = parameters.get_fluxes(Cn_2D[pdep:, :])
-                q_2D[pdep:, :]      = parameters.get_qs(Cn_2D[pdep:, :], Fis)
-                W_2D[pdep:, :]      = parameters.get_Ws(Cn_2D[pdep:, :])
-                qm_2D[pdep:, :, :]  = parameters.get_qms(Cn_2D[pdep:, :], Fis)
+                if names.count('F') > 0:  profiles['F'][pdep:, :]     = parameters.get_fluxes(Cn_2D[pdep:, :])
+                if names.count('q') > 0:  profiles['q'][pdep:, :]     = parameters.get_qs(Cn_2D[pdep:, :], Fis)
+                if names.count('W') > 0:  profiles['W'][pdep:, :]     = parameters.get_Ws(Cn_2D[pdep:, :])
+                if names.count('qm') > 0: profiles['qm'][pdep:, :, :] = parameters.get_qms(Cn_2D[pdep:, :], Fis)
 
-            if parameters.topBCtype == 'Finite mixed water column':
-                Cw = parameters.get_Cws(Cn_2D[pdep:, :], flag = 1)
-            else:
-                Cw = zeros(parameters.nchemicals)
+        if parameters.topBCtype == 'Finite mixed water column' and names.count('Cw') > 0:
+            profiles['Cw'] = array(parameters.get_Cws(Cn_2D[pdep:, :], flag = 1))
+
+        profiles['C'] = Cn_2D
+
+        return profiles
+
+    def converter (self, parameters, Cn, Fis):
+
+        """Stores the concentrations and fluxes from a given time.  The
+        variables that are not in the output specification are not computed
+        and are returned as empty arrays."""
 
-        return [Cn_2D, Fis_2D, F_2D, q_2D, qm_2D, W_2D, Cw]
+        profiles = self.get_profiles(parameters, Cn, Fis, self.variables)
+
+        results  = []
+        for name in self.results:
+            if not self.is_stored(name):    results.append(zeros(0))
+            elif name == 'Fi':              results.append(self.select(profiles[name], 0))
+            elif name == 'Cw':              results.append(profiles[name][self.columns])
+            else:                           results.append(self.select(profiles[name]))
+
+        return results
 
     def store(self, t, t_plus_1, parameters, variables, variables_plus_1):
+        """Stores the variables of the output specification at the output
+        times between "t" and "t_plus_1" from the results of "converter." """
 
         delt                  = t_plus_1 - t
 
-        Cn_2D                 = variables[0]
-        Fis_2D                = variables[1]
-        F_2D                  = variables[2]
-        q_2D                  = variables[3]
-        qm_2D                 = variables[4]
-        W_2D                  = variables[5]
-        Cw_2D                 = variables[6]
-
-        Cn_plus_1_2D          = variables_plus_1[0]
-        Fis_plus_1_2D         = variables_plus_1[1]
-        F_plus_1_2D           = variables_plus_1[2]
-        q_plus_1_2D           = variables_plus_1[3]
-        qm_plus_1_2D          = variables_plus_1[4]
-        W_plus_1_2D           = variables_plus_1[5]
-        Cw_plus_1_2D          = variables_plus_1[6]
-
         while self.n < len(self.times) and round(self.times[self.n], 8) <= round(t_plus_1, 8):
 
             time = self.times[self.n]
-            self.C[self.n, :, :]         = time_interpolate(time, t, delt, Cn_2D, Cn_plus_1_2D)
-            self.Fi[self.n, :, :]        = time_interpolate(time, t, delt, Fis_2D, Fis_plus_1_2D)
-            self.F[self.n, :, :]         = time_interpolate(time, t, delt, F_2D,  F_plus_1_2D)
-            self.q[self.n, :, :]         = time_interpolate(time, t, delt, q_2D,  q_plus_1_2D)
-            self.qm[self.n, :, :, :]     = time_interpolate(time, t, delt, qm_2D, qm_plus_1_2D)
-            self.W[self.n, :, :]         = time_interpolate(time, t, delt, W_2D,  W_plus_1_2D)
-            if parameters.topBCtype == 'Finite mixed water column':
-                for n in range(parameters.nchemicals):
-                    self.Cw[self.n, :] = time_interpolate(self.times[self.n], t, delt, Cw_2D, Cw_plus_1_2D)
+            for name, X, X_plus_1 in zip(self.results, variables, variables_plus_1):
+                if self.is_stored(name): getattr(self, name)[self.n] = time_interpolate(time, t, delt, X, X_plus_1)
 
             self.n = self.n + 1
 
@@ -2940,72 +3430,844 @@ class Output:
         self.layertot   = parameters.layertot
 
         delt            = t_plus_1 - t
-        pdep            = len(self.z) - len(parameters.z)
+        pdep            = self.nz - len(parameters.z)
+
+        #the grid points of the depth window below the deposition layer
+        rows            = [i - pdep for i in self.rows if i >= pdep]
+        start           = len(self.rows) - len(rows)
 
         z_t             = len(parameters.z)
-        Cn_2D           = zeros((z_t, parameters.nchemicals))
-        Cn_plus_1_2D    = zeros((z_t, parameters.nchemicals))
+        maps            = self.get_index_maps(parameters, 0)
+        Cn              = array(Cn, dtype = float)
+        Cn_plus_1       = array(Cn_plus_1, dtype = float)
 
-        for j in range(len(self.layertot)):
-            num = self.layertot[j].nchemicals
-            for i in range((self.ptot[j+1]-self.ptot[j])):
-                for n in range(self.nchemicals):
-                    Cn_2D[self.ptot[j] + i,n]        = Cn[self.cptot[j] + i*num + n] * self.chemicals[n].MW
-                    Cn_plus_1_2D[self.ptot[j] + i,n] = Cn_plus_1[self.cptot[j] + i*num + n] * self.chemicals[n].MW
-            for n in range(self.nchemicals):
-                Cn_2D[self.ptot[-1],n]        = Cn[self.cptot[-1] + n] * self.chemicals[n].MW
-                Cn_plus_1_2D[self.ptot[-1],n] = Cn_plus_1[self.cptot[-1] + n] * self.chemicals[n].MW
+        Cn_2D           = self.scatter(maps['C'], Cn,        0, (z_t, parameters.nchemicals))
+        Cn_plus_1_2D    = self.scatter(maps['C'], Cn_plus_1, 0, (z_t, parameters.nchemicals))
 
         if self.nsolidchemicals > 0:
-            Solid_Cn_2D        = zeros((z_t, self.nsolidchemicals))
-            Solid_Cn_plus_1_2D = zeros((z_t, self.nsolidchemicals))
+            Solid_Cn_2D        = self.scatter(maps['O'], Cn,        0, (z_t, self.nsolidchemicals))
+            Solid_Cn_plus_1_2D = self.scatter(maps['O'], Cn_plus_1, 0, (z_t, self.nsolidchemicals))
 
-            for j in range(len(self.layertot)):
-                num = self.layertot[j].nsolidchemicals
-                for i in range((self.ptot[j+1]-self.ptot[j])):
-                    for n in range(num):
-                        nn = parameters.solidchemical_list.index(self.layertot[j].solidchemicals[n].name)
-                        Solid_Cn_2D[self.ptot[j] + i,nn]        = Cn[self.cptot[j] + i*(self.nchemicals + num) + self.nchemicals + n] * self.solidchemicals[nn].MW
-                        Solid_Cn_plus_1_2D[self.ptot[j] + i,nn] = Cn_plus_1[self.cptot[j] + i*(self.nchemicals + num) + self.nchemicals + n] * self.solidchemicals[nn].MW
-
-            for n in range(self.layertot[-1].nsolidchemicals):
-                nn = parameters.solidchemical_list.index(self.layertot[-1].solidchemicals[n].name)
-                Solid_Cn_2D[self.ptot[-1],nn]        = Cn[self.cptot[-1] + self.nchemicals + n] * self.solidchemicals[nn].MW
-                Solid_Cn_plus_1_2D[self.ptot[-1],nn] = Cn_plus_1[self.cptot[-1]  + self.nchemicals + n] * self.solidchemicals[nn].MW
-
-        Fis_2D           = zeros((z_t, parameters.ncomponents))
-        Fis_plus_1_2D    = zeros((z_t, parameters.ncomponents))
-        for j in range(len(self.layertot)):
-            for i in range((self.ptot[j+1]-self.ptot[j])):
-                for m in range(parameters.ncomponents):
-                    Fis_2D[self.ptot[j] + i,m]        = Fis[parameters.components[m].name][self.ptot[j] + i]
-                    Fis_plus_1_2D[self.ptot[j] + i,m] = Fis_plus_1[parameters.components[m].name][self.ptot[j] + i]
-            for m in range(parameters.ncomponents):
-                Fis_2D[self.ptot[-1],m]               = Fis[parameters.components[m].name][self.ptot[-1]]
-                Fis_plus_1_2D[self.ptot[-1],m]        = Fis_plus_1[parameters.components[m].name][self.ptot[-1]]
+        Fis_2D           = self.scatter(maps['Fis'], self.get_fractions(parameters, Fis),        0, (z_t, parameters.ncomponents))
+        Fis_plus_1_2D    = self.scatter(maps['Fis'], self.get_fractions(parameters, Fis_plus_1), 0, (z_t, parameters.ncomponents))
 
         while self.n < len(self.times) and round(self.times[self.n], 8) <= round(t_plus_1, 8):
-            self.C[self.n, pdep:, :]         = time_interpolate(self.times[self.n], t, delt, Cn_2D, Cn_plus_1_2D)
-            self.Fi[self.n, pdep:, :]        = time_interpolate(self.times[self.n], t, delt, Fis_2D, Fis_plus_1_2D)
+            C = time_interpolate(self.times[self.n], t, delt, Cn_2D, Cn_plus_1_2D)
+            self.C[self.n, start:, :]            = C[ix_(rows, self.columns)]
+            if self.is_stored('Fi'):
+                self.Fi[self.n, start:, :]       = time_interpolate(self.times[self.n], t, delt, Fis_2D, Fis_plus_1_2D)[rows]
             if self.nsolidchemicals > 0:
-                self.O[self.n, pdep:, :]     = time_interpolate(self.times[self.n], t, delt, Solid_Cn_2D, Solid_Cn_plus_1_2D)
-                if self.n != 0:
-                    self.F[self.n, pdep:, :] = time_interpolate(self.times[self.n], t, delt, parameters.get_fluxes(Cn_2D, O = Solid_Cn_2D, flag = 1), parameters.get_fluxes(Cn_plus_1_2D, O = Solid_Cn_plus_1_2D))
-                self.q[self.n, pdep:, :]     = time_interpolate(self.times[self.n], t, delt, parameters.get_qs(Cn_2D, Fis, Solid_Cn_2D), parameters.get_qs(Cn_plus_1_2D, Fis_plus_1, Solid_Cn_plus_1_2D))
-                self.W[self.n, pdep:, :]     = parameters.get_Ws(self.C[self.n, pdep:], self.O[self.n, pdep:])
-                self.qm[self.n, pdep:, :, :] = parameters.get_qms(self.C[self.n, pdep:], Fis_plus_1, self.O[self.n, pdep:])
+                O = time_interpolate(self.times[self.n], t, delt, Solid_Cn_2D, Solid_Cn_plus_1_2D)
+                self.O[self.n, start:, :]        = O[rows]
+                if self.n != 0 and self.is_stored('F'):
+                    self.F[self.n, start:, :]    = time_interpolate(self.times[self.n], t, delt, parameters.get_fluxes(Cn_2D, O = Solid_Cn_2D, flag = 1), parameters.get_fluxes(Cn_plus_1_2D, O = Solid_Cn_plus_1_2D))[ix_(rows, self.columns)]
+                if self.is_stored('q'):
+                    self.q[self.n, start:, :]    = time_interpolate(self.times[self.n], t, delt, parameters.get_qs(Cn_2D, Fis, Solid_Cn_2D), parameters.get_qs(Cn_plus_1_2D, Fis_plus_1, Solid_Cn_plus_1_2D))[ix_(rows, self.columns)]
+                if self.is_stored('W'):
+                    self.W[self.n, start:, :]    = parameters.get_Ws(C, O)[ix_(rows, self.columns)]
+                if self.is_stored('qm'):
+                    self.qm[self.n, start:, :, :]= parameters.get_qms(C, Fis_plus_1, O)[ix_(rows, self.columns)]
             else:
-                if self.n != 0:
-                    self.F[self.n, pdep:, :] = time_interpolate(self.times[self.n], t, delt, parameters.get_fluxes(Cn_2D, flag = 1), parameters.get_fluxes(Cn_plus_1_2D))
-                self.q[self.n, pdep:, :]     = time_interpolate(self.times[self.n], t, delt, parameters.get_qs(Cn_2D, Fis), parameters.get_qs(Cn_plus_1_2D, Fis_plus_1))
-                self.qm[self.n, pdep:, :, :] = parameters.get_qms(self.C[self.n, pdep:], Fis_plus_1)
-                self.W[self.n, pdep:, :]     = parameters.get_Ws(self.C[self.n, pdep:])
+                if self.n != 0 and self.is_stored('F'):
+                    self.F[self.n, start:, :]    = time_interpolate(self.times[self.n], t, delt, parameters.get_fluxes(Cn_2D, flag = 1), parameters.get_fluxes(Cn_plus_1_2D))[ix_(rows, self.columns)]
+                if self.is_stored('q'):
+                    self.q[self.n, start:, :]    = time_interpolate(self.times[self.n], t, delt, parameters.get_qs(Cn_2D, Fis), parameters.get_qs(Cn_plus_1_2D, Fis_plus_1))[ix_(rows, self.columns)]
+                if self.is_stored('qm'):
+                    self.qm[self.n, start:, :, :]= parameters.get_qms(C, Fis_plus_1)[ix_(rows, self.columns)]
+                if self.is_stored('W'):
+                    self.W[self.n, start:, :]    = parameters.get_Ws(C)[ix_(rows, self.columns)]
+
+            if parameters.topBCtype == 'Finite mixed water column' and self.is_stored('Cw'):
+                self.Cw[self.n, :] = time_interpolate(self.times[self.n], t, delt, parameters.get_Cws(Cn_2D, flag = 1), parameters.get_Cws(Cn_plus_1_2D))[self.columns]
+
+            self.n = self.n + 1
+
+    def observe(self, t, parameters, Cn, Fis):
+        """Samples the observation points at time "t" from the unknowns "Cn."
+        Without "observationsteps" every call is kept; otherwise the samples
+        are interpolated to the observation times since the last call."""
+
+        if len(self.points) == 0 or round(t, 8) > round(self.times[-1], 8): return
+
+        values = self.get_point_values(parameters, Cn, Fis)
+
+        if self.observationsteps == 0 or parameters.steady == 1:
+            self.observation_times.append(t)
+            self.observation_values.append(values)
+        else:
+            while len(self.observation_values) < len(self.observation_times) and round(self.observation_times[len(self.observation_values)], 8) <= round(t, 8):
+                if self.last_observation is None or self.last_observation[0] == t:
+                    self.observation_values.append(values)
+                else:
+                    t_last, values_last = self.last_observation
+                    self.observation_values.append(time_interpolate(self.observation_times[len(self.observation_values)], t_last, t - t_last, values_last, values))
+
+        self.last_observation = (t, values)
+
+    def get_point_values(self, parameters, Cn, Fis):
+        """Returns the values of the observation points for the unknowns "Cn"
+        interpolated between the two grid points around each depth.  Only the
+        concentrations at those grid points (and their neighbours for the
+        fluxes) are taken from "Cn," and the variables are only computed at
+        those grid points."""
+
+        if parameters.dep == 1 and parameters.toppoints > 1:
+            deposition = 1
+            pdep       = self.nz - (len(parameters.z) - parameters.toppoints + 1)
+        else:
+            deposition = 0
+            pdep       = self.nz - len(parameters.z)
 
-            if parameters.topBCtype == 'Finite mixed water column':
+        brackets, points, maps = self.get_point_maps(parameters, deposition, pdep)
+        names                  = [point[1] for point in self.points]
+
+        Cn          = array(Cn, dtype = float)
+        Cn_2D       = self.scatter(maps['C'], Cn, 0, (self.nz - pdep, parameters.nchemicals))
+        Solid_Cn_2D = self.scatter(maps['O'], Cn, 0, (self.nz - pdep, self.nsolidchemicals))
+
+        if deposition == 1:
+            Cn_top_2D       = self.scatter(maps['Ctop'], Cn, 0, (parameters.toppoints + 1, parameters.nchemicals))
+            Solid_Cn_top_2D = self.scatter(maps['Otop'], Cn, 0, (parameters.toppoints + 1, self.nsolidchemicals))
+        else:
+            Cn_top_2D       = None
+            Solid_Cn_top_2D = None
+
+        profiles = {'C': Cn_2D}
+        if names.count('F') > 0:  profiles['F']  = parameters.get_fluxes(Cn_2D, O = Solid_Cn_2D, Cn_top = Cn_top_2D, O_top = Solid_Cn_top_2D, points = points)
+        if names.count('q') > 0:  profiles['q']  = parameters.get_qs(Cn_2D, Fis, Solid_Cn_2D, points = points)
+        if names.count('W') > 0:  profiles['W']  = parameters.get_Ws(Cn_2D, Solid_Cn_2D, points = points)
+        if names.count('Cw') > 0:
+            if parameters.topBCtype == 'Finite mixed water column': profiles['Cw'] = array(parameters.get_Cws(Cn_2D, flag = 1))
+            else:                                                   profiles['Cw'] = zeros(parameters.nchemicals)
+
+        chemicals = [chemical.name for chemical in parameters.chemicals]
+
+        values    = zeros(len(self.points))
+        for i in range(len(self.points)):
+            depth, name, chemical = self.points[i]
+            n = chemicals.index(chemical)
+            if name == 'Cw': values[i] = profiles['Cw'][n]
+            else:
+                top, bot = brackets[i]
+                X        = [0., 0.]
+                if top >= pdep: X[0] = profiles[name][top - pdep, n]
+                if bot >= pdep: X[1] = profiles[name][bot - pdep, n]
+                values[i] = interp(depth, [self.grid[top], self.grid[bot]], X)
+
+        return values
+
+    def get_point_maps(self, parameters, deposition, pdep):
+        """Returns the grid points of the output grid around the depth of each
+        observation point, the grid points of "parameters" where the variables
+        of the observation points are computed and the index maps restricted
+        to the grid points whose concentrations are needed.  The grid points
+        below the top of the sediment "pdep" are counted from the top of the
+        sediment in the maps.  The maps are only rebuilt when the grid changes
+        with deposition."""
+
+        key = (tuple(parameters.ptot), tuple(parameters.cptot), len(parameters.layertot), parameters.toppoints, deposition, pdep)
+
+        if self.point_maps is None or self.point_maps[0] != key:
+
+            shift    = (parameters.toppoints - 1) * deposition
+
+            brackets = []
+            rows     = []
+            for depth, name, chemical in self.points:
+                j = min(max(searchsorted(self.grid, depth), 1), self.nz - 1)
+                brackets.append((j - 1, j))
+                if   name == 'Cw':  rows = rows + [pdep]
+                elif name == 'F':   rows = rows + [j + k for k in range(-3, 3)]
+                else:               rows = rows + [j - 1, j]
+
+            points = []
+            for bracket in brackets:
+                for j in bracket:
+                    if j >= pdep and points.count(j - pdep + shift) == 0: points.append(j - pdep + shift)
+            rows   = [j - pdep for j in rows if j >= pdep and j < self.nz]
+
+            maps = {}
+            for name, index in self.get_index_maps(parameters, deposition).items():
+                if name == 'C' or name == 'O':
+                    mask       = in1d(index[0], rows)
+                    maps[name] = tuple([X[mask] for X in index])
+                else: maps[name] = index
+
+            self.point_maps = (key, (brackets, points, maps))
+
+        return self.point_maps[1]
+
+    def get_observation(self, i):
+        """Returns the times and values of the observation point "i" as
+        one-dimensional arrays."""
+
+        times  = self.observation_times[:len(self.observation_values)]
+        values = [observation[i] for observation in self.observation_values]
+
+        return array(times, dtype = float), array(values, dtype = float)
+
+    def get_index_maps(self, parameters, deposition):
+        """Returns the index maps that scatter the unknowns into the profiles
+        of the pore water concentrations "C," the solid concentrations "O,"
+        the component fractions "Fis" and, with "deposition," the points of
+        the top layer "Ctop" and "Otop."  Each map holds the rows (counted
+        from the top of the sediment) and columns of the entries, the
+        positions of the values and their molecular weights.  The maps are
+        only rebuilt when the grid changes with deposition."""
+
+        key = (tuple(parameters.ptot), tuple(parameters.cptot), len(parameters.layertot), parameters.toppoints)
+
+        if not self.index_maps.has_key(deposition) or self.index_maps[deposition][0] != key:
+
+            ptot     = parameters.ptot
+            cptot    = parameters.cptot
+            layertot = parameters.layertot
+            MW       = [chemical.MW for chemical in parameters.chemicals]
+            sMW      = [solidchemical.MW for solidchemical in self.solidchemicals]
+            ncomp    = parameters.ncomponents
+
+            C, O, Ctop, Otop, F = {}, {}, {}, {}, {}
+
+            if deposition == 1:
+                top = parameters.toppoints
+                for j in range(1, len(layertot)):
+                    num = layertot[j].nchemicals
+                    for i in range(ptot[j+1]-ptot[j]):
+                        for n in range(parameters.nchemicals):     C[ptot[j] - top + 1 + i, n] = cptot[j] + i*num + n, MW[n]
+                        for m in range(ncomp):               F[ptot[j] - top + 1 + i, m] = (ptot[j] + i)*ncomp + m, 1
+                    for n in range(parameters.nchemicals):
+                        C[ptot[-1] - top + 1, n] = cptot[-1] + n, MW[n]
+                        C[0, n]                  = n, MW[n]
+                    for m in range(ncomp):
+                        F[ptot[-1] - top + 1, m] = ptot[-1]*ncomp + m, 1
+                        F[0, m]                  = m, 1
                 for n in range(parameters.nchemicals):
-                    self.Cw[self.n, :] = time_interpolate(self.times[self.n], t, delt, parameters.get_Cws(Cn_2D, flag = 1), parameters.get_Cws(Cn_plus_1_2D))
+                    for i in range(top + 1):                 Ctop[i, n] = layertot[0].nchemicals*i + n, MW[n]
 
-            self.n = self.n + 1
+                if self.nsolidchemicals > 0:
+                    for j in range(1, len(layertot)):
+                        num = layertot[j].nsolidchemicals
+                        for i in range(ptot[j+1]-ptot[j]):
+                            for n in range(num):
+                                nn = parameters.solidchemical_list.index(layertot[j].solidchemicals[n].name)
+                                O[ptot[j] - top + 1 + i, nn] = cptot[j] + i*(parameters.nchemicals + num) + parameters.nchemicals + n, sMW[nn]
+                    for n in range(layertot[-1].nsolidchemicals):
+                        nn = parameters.solidchemical_list.index(layertot[-1].solidchemicals[n].name)
+                        O[ptot[-1] - top + 1, nn] = cptot[-1] + parameters.nchemicals + n, sMW[nn]
+                        O[0, nn]                  = parameters.nchemicals + n, sMW[nn]
+                    for n in range(self.nsolidchemicals):
+                        for i in range(top + 1):             Otop[i, n] = layertot[0].nchemicals*i + parameters.nchemicals + n, MW[n]
+            else:
+                for j in range(len(layertot)):
+                    num = layertot[j].nchemicals
+                    for i in range(ptot[j+1]-ptot[j]):
+                        for n in range(parameters.nchemicals):     C[ptot[j] + i, n] = cptot[j] + i*num + n, MW[n]
+                        for m in range(ncomp):               F[ptot[j] + i, m] = (ptot[j] + i)*ncomp + m, 1
+                    for n in range(parameters.nchemicals):         C[ptot[-1], n] = cptot[-1] + n, MW[n]
+                    for m in range(ncomp):                   F[ptot[-1], m] = ptot[-1]*ncomp + m, 1
+
+                if self.nsolidchemicals > 0:
+                    for j in range(len(layertot)):
+                        num = layertot[j].nsolidchemicals
+                        for i in range(ptot[j+1]-ptot[j]):
+                            for n in range(num):
+                                nn = parameters.solidchemical_list.index(layertot[j].solidchemicals[n].name)
+                                O[ptot[j] + i, nn] = cptot[j] + i*(parameters.nchemicals + num) + parameters.nchemicals + n, sMW[nn]
+                    for n in range(layertot[-1].nsolidchemicals):
+                        nn = parameters.solidchemical_list.index(layertot[-1].solidchemicals[n].name)
+                        O[ptot[-1], nn] = cptot[-1] + parameters.nchemicals + n, sMW[nn]
+
+            maps = {}
+            for name, entries in [('C', C), ('O', O), ('Ctop', Ctop), ('Otop', Otop), ('Fis', F)]:
+                keys     = entries.keys()
+                maps[name] = (array([k[0] for k in keys], dtype = int), array([k[1] for k in keys], dtype = int),
+                              array([entries[k][0] for k in keys], dtype = int), array([entries[k][1] for k in keys], dtype = float))
+
+            self.index_maps[deposition] = (key, maps)
+
+        return self.index_maps[deposition][1]
+
+    def scatter(self, index, values, offset, shape):
+        """Returns an array of "shape" with the "values" of the index map
+        "index" multiplied by their weights, with the rows moved down by
+        "offset." """
+
+        rows, columns, positions, weights = index
+
+        X = zeros(shape)
+        X[rows + offset, columns] = values[positions] * weights
+
+        return X
+
+    def get_fractions(self, parameters, Fis):
+        """Returns the component fractions "Fis" as one array ordered by grid
+        point and then by component for the index maps."""
+
+        if parameters.ncomponents == 0: return zeros(0)
+
+        return transpose(array([Fis[component.name] for component in parameters.components], dtype = float)).reshape(-1)
+
+    def get_next_time(self, t):
+        """Returns the first output time after "t"."""
+
+        n = self.n
+        while n < len(self.times) - 1 and round(self.times[n], 8) <= round(t, 8): n = n + 1
+
+        return self.times[n]
+
+class ReactionNetwork:
+    """The nonlinear reactions of a layer compiled into arrays.  The
+    reactants, exponents, stoichiometric coefficients and component lookups
+    are collected once so that the rates and their derivatives are evaluated
+    for all the grid points of the layer at once, with the power terms of the
+    reactants shared between the rates and the derivatives."""
+
+    def __init__(self, parameters, layer):
+        """Constructor method.  Compiles the nonlinear reactions of "layer"
+        with the coefficients and components of "parameters." """
+
+        self.nchemicals = layer.nchemicals
+        self.reactions  = []
+
+        for reaction in layer.nlreactions:
+            lam       = parameters.coefficients[layer.name][reaction.name].lam
+            chemicals = reaction.reactants + reaction.products
+            if reaction.model == 'Langmuir':
+                component = parameters.components[parameters.component_list.index(reaction.component)]
+                model     = 'Langmuir'
+                factor    = component.e
+            elif reaction.name.count('_desorption') == 1:
+                component = parameters.components[parameters.component_list.index(reaction.component)]
+                model     = 'Desorption'
+                factor    = component.rho
+            else:
+                component = None
+                model     = 'Power'
+                factor    = 1
+
+            self.reactions.append({'model':      model,
+                                   'lam':        lam,
+                                   'component':  component,
+                                   'factor':     factor,
+                                   'reactants':  [(reactant.count, reactant.index) for reactant in reaction.reactants],
+                                   'products':   [product.count for product in reaction.products],
+                                   'chemicals':  [(chemical.count, chemical.coef) for chemical in chemicals],
+                                   'pairs':      [(chemical.count, chemical_a.count, chemical_a.coef) for chemical in chemicals for chemical_a in chemicals]})
+
+    def get_scales(self, reaction, nodes, es, Fis):
+        """Returns the porosities or the component fractions that scale the
+        rate of "reaction" at grid points "nodes." """
+
+        if reaction['model'] == 'Power': return array(es, dtype = float)[nodes]
+        else:                            return reaction['factor'] * array(Fis[reaction['component'].name], dtype = float)[nodes]
+
+    def get_rate(self, reaction, C, scales):
+        """Returns the rates of "reaction" at the grid points with
+        concentrations "C" (grid points x chemicals)."""
+
+        if reaction['model'] == 'Langmuir':
+            (r, index), p = reaction['reactants'][0], reaction['products'][0]
+            return reaction['lam'] * C[:, r] * scales * (index - C[:, p])
+
+        rate = reaction['lam'] * scales
+        for r, index in reaction['reactants']:
+            positive = C[:, r] > 0
+            rate     = where(positive, rate * where(positive, C[:, r], 1) ** index, 0)
+
+        return rate
+
+    def get_rates(self, C, nodes, es, Fis):
+        """Returns the rates of change of the chemicals (grid points x
+        chemicals) due to the reactions at grid points "nodes." """
+
+        rates = zeros(C.shape)
+        for reaction in self.reactions:
+            rate = self.get_rate(reaction, C, self.get_scales(reaction, nodes, es, Fis))
+            for count, coef in reaction['chemicals']:
+                rates[:, count] = rates[:, count] + rate * coef
+
+        return rates
+
+    def get_rates_diff(self, C, nodes, es, Fis):
+        """Returns the derivatives of the rates of change of the chemicals
+        (grid points x chemicals x chemicals) at grid points "nodes." """
+
+        diffs = zeros((C.shape[0], self.nchemicals, self.nchemicals))
+        for reaction in self.reactions:
+            scales = self.get_scales(reaction, nodes, es, Fis)
+            diff   = zeros(C.shape)
+            if reaction['model'] == 'Langmuir':
+                (r, index), p = reaction['reactants'][0], reaction['products'][0]
+                diff[:, r] = diff[:, r] + reaction['lam'] * scales * (index - C[:, p])
+                diff[:, p] = diff[:, p] - reaction['lam'] * scales * C[:, r]
+            else:
+                rate = self.get_rate(reaction, C, scales)
+                for r, index in reaction['reactants']:
+                    positive   = C[:, r] > 0
+                    diff[:, r] = where(positive, rate / where(positive, C[:, r], 1) * index, diff[:, r])
+
+            for count, count_a, coef_a in reaction['pairs']:
+                diffs[:, count, count_a] = diffs[:, count, count_a] + diff[:, count_a] * coef_a
+
+        return diffs
+
+class UnitResponses:
+    """Unit step responses of a linear system to its boundary concentrations.
+    Because the equations are linear in the top ("Co" or "Cw") and bottom
+    ("Cb") concentrations, the concentrations for a piecewise constant
+    boundary history follow from Duhamel's principle:
+
+    C(t) = C0(t) + sum over the changes j of dU_j * S(t - t_j)
+
+    where "C0" is the response to the initial conditions with zero boundary
+    concentrations and "S" the unit step responses.  The responses are time
+    stepped once for all the histories and only kept at the times after the
+    changes that fall on an output time, so each history only costs a sum."""
+
+    def __init__(self, parameters, Cn, FisL, histories):
+        """Constructor method.  Time steps the responses with the matrices of
+        "parameters" from the initial concentrations "Cn" for the boundary
+        concentration "histories" (from "read_BC_history")."""
+
+        self.parameters = parameters
+        self.FisL       = FisL
+        self.delt       = parameters.delt
+        self.steps      = int(ceil(round(parameters.tfinal_ori / parameters.delt, 8)))
+        self.times      = get_output_times(parameters)
+
+        #the boundary concentrations that enter the equations
+        self.inputs = []
+        for chemical in parameters.chemicals:
+            if chemical.soluable == 1:
+                if parameters.topBCtype == 'Fixed Concentration': self.inputs.append(('Top', chemical, 'Co'))
+                if parameters.topBCtype == 'Mass transfer':       self.inputs.append(('Top', chemical, 'Cw'))
+            if parameters.botBCtype == 'Fixed Concentration' or parameters.botBCtype == 'Flux-matching':
+                self.inputs.append(('Bottom', chemical, 'Cb'))
+
+        self.values  = [getattr(parameters.BCs[chemical.name], name) for boundary, chemical, name in self.inputs]
+        self.changes = [self.get_history(history) for history in histories]
+
+        #the responses are needed at the output times for the initial
+        #conditions and at the output times after each change for the units;
+        #with zero initial conditions and boundary concentrations the
+        #solution stays zero, so the units need no correction
+        self.base  = self.get_response(Cn, [0 for i in self.inputs], self.times)
+        self.units = []
+        for i in range(len(self.inputs)):
+            unit    = [0 for input in self.inputs]
+            unit[i] = 1
+            lags    = []
+            for changes in self.changes:
+                for tj, dU in changes[i]:
+                    lags = lags + [t - tj for t in self.times if t >= tj]
+            self.units.append(self.get_response(zeros(len(Cn)), unit, lags))
+
+        self.set_values(self.values)
+        parameters.make_matrices()
+
+    def set_values(self, values):
+        """Sets the boundary concentrations to "values." """
+
+        for (boundary, chemical, name), value in zip(self.inputs, values):
+            setattr(self.parameters.BCs[chemical.name], name, value)
+
+    def get_response(self, Cn, values, lags):
+        """Returns the concentrations from "Cn" with the boundary
+        concentrations "values" at the times "lags" from the start, as a
+        dictionary of the concentrations keyed by the rounded time."""
+
+        self.set_values(values)
+        self.parameters.make_matrices()
+
+        lags     = sorted(set([round(lag, 10) for lag in lags]))
+        response = {}
+        C        = array(Cn, dtype = float)
+        i        = 0
+        for k in range(self.steps):
+            if i == len(lags): break
+            C_plus_1 = self.parameters.get_Cn_plus_1(C)
+            while i < len(lags) and round(lags[i] / self.delt, 8) <= k + 1:
+                response[lags[i]] = C + (lags[i] / self.delt - k) * (C_plus_1 - C)
+                i = i + 1
+            C = C_plus_1
+
+        for lag in lags[i:]: response[lag] = C
+
+        return response
+
+    def get_history(self, history):
+        """Returns the times and values of the changes of each boundary
+        concentration in "history" (from "read_BC_history").  Boundaries
+        without a history keep the concentration of the system."""
+
+        times, columns = history
+        changes        = []
+        for (boundary, chemical, name), value in zip(self.inputs, self.values):
+            if columns.has_key((boundary, chemical.name)):
+                U      = [C / chemical.MW for C in columns[(boundary, chemical.name)]]
+                change = [(times[0], U[0])] + [(times[j], U[j] - U[j - 1]) for j in range(1, len(times))]
+            else:
+                change = [(0, value)]
+            changes.append(change)
+
+        return changes
+
+    def get_concentrations(self, t, changes):
+        """Returns the concentrations at time "t" and the boundary
+        concentrations at that time for the "changes" of the history."""
+
+        C      = self.base[round(t, 10)]
+        values = []
+        for unit, change in zip(self.units, changes):
+            value = 0
+            for tj, dU in change:
+                if tj <= t:
+                    C     = C + dU * unit[round(t - tj, 10)]
+                    value = value + dU
+            values.append(value)
+
+        return C, values
+
+    def get_output(self, n):
+        """Returns the "Output" for the "n"th boundary concentration history."""
+
+        parameters = self.parameters
+        output     = Output(parameters)
+
+        for time in output.times:
+            C, values = self.get_concentrations(time, self.changes[n])
+            self.set_values(values)
+            results   = output.converter(parameters, C, self.FisL)
+            output.store(time - 1, time, parameters, results, results)
+
+        self.set_values(self.values)
+
+        return output
+
+class BandedMatrix:
+    """Square matrix with "kl" subdiagonals and "ku" superdiagonals stored in
+    the LAPACK band format (element [i, j] is kept in band[ku + i - j, j]).
+    Elements are read and written with the same [row, column] indexing as a
+    dense matrix so the finite difference equations assemble unchanged, and
+    the band is widened automatically if an equation reaches outside it."""
+
+    def __init__(self, N, kl, ku):
+        """Constructor method.  Makes an empty N x N banded matrix."""
+
+        self.N    = N
+        self.kl   = kl
+        self.ku   = ku
+        self.band = zeros([kl + ku + 1, N])
+
+    def __getitem__(self, index):
+        """Returns the element [i, j], or the elements for arrays of row and
+        column indices."""
+
+        i, j = index
+        if isinstance(i, ndarray) or isinstance(j, ndarray):
+            i, j   = broadcast_arrays(i, j)
+            values = zeros(i.shape)
+            inband = (j - i <= self.ku) & (i - j <= self.kl)
+            values[inband] = self.band[self.ku + i[inband] - j[inband], j[inband]]
+            return values
+
+        if -self.kl <= j - i <= self.ku: return self.band[self.ku + i - j, j]
+        else:                            return 0.
+
+    def __setitem__(self, index, value):
+        """Sets the element [i, j], or the elements for arrays of row and
+        column indices."""
+
+        i, j = index
+        if isinstance(i, ndarray) or isinstance(j, ndarray):
+            i, j = broadcast_arrays(i, j)
+            if i.size == 0: return
+            if (j - i).max() > self.ku or (i - j).max() > self.kl:
+                self.widen(max(self.kl, (i - j).max()), max(self.ku, (j - i).max()))
+            self.band[self.ku + i - j, j] = value
+            return
+
+        if j - i > self.ku or i - j > self.kl:
+            if value == 0: return
+            self.widen(max(self.kl, i - j), max(self.ku, j - i))
+        self.band[self.ku + i - j, j] = value
+
+    def __mul__(self, x):
+        """Returns the product of the matrix with the vector (or columns) "x"
+        as the same type as "x." """
+
+        y = self.dot(array(x, dtype = float))
+        if isinstance(x, matrix): y = matrix(y)
+
+        return y
+
+    def __sub__(self, M):
+        """Returns the difference with the banded matrix "M." """
+
+        D = self.copy()
+        D.widen(max(self.kl, M.kl), max(self.ku, M.ku))
+        D.band[D.ku - M.ku:D.ku + M.kl + 1, :] = D.band[D.ku - M.ku:D.ku + M.kl + 1, :] - M.band
+
+        return D
+
+    def widen(self, kl, ku):
+        """Enlarges the band to "kl" subdiagonals and "ku" superdiagonals."""
+
+        band = zeros([kl + ku + 1, self.N])
+        band[ku - self.ku:ku + self.kl + 1, :] = self.band
+
+        self.band = band
+        self.kl   = kl
+        self.ku   = ku
+
+    def copy(self):
+
+        M      = BandedMatrix(self.N, self.kl, self.ku)
+        M.band = self.band.copy()
+
+        return M
+
+    def dot(self, x):
+        """Multiplies the matrix with the array "x" one diagonal at a time."""
+
+        N = self.N
+        y = zeros(x.shape)
+        for d in range(-self.kl, self.ku + 1):
+            diagonal = self.band[self.ku - d, max(d, 0):N + min(d, 0)]
+            if len(x.shape) == 2: diagonal = diagonal.reshape(-1, 1)
+            if d >= 0: y[:N - d] = y[:N - d] + diagonal * x[d:]
+            else:      y[-d:]    = y[-d:]    + diagonal * x[:N + d]
+
+        return y
+
+    def permute(self, order):
+        """Returns the matrix with the rows and columns reordered so that its
+        element [k, l] is the element [order[k], order[l]] of this matrix."""
+
+        N                  = self.N
+        position           = zeros(N, dtype = int)
+        position[order]    = arange(N)
+
+        M = BandedMatrix(N, 0, 0)
+        for d in range(-self.kl, self.ku + 1):
+            i      = arange(max(0, -d), min(N, N - d))
+            values = self.band[self.ku - d, i + d]
+            i      = i[values != 0]
+            M[position[i], position[i + d]] = values[values != 0]
+
+        return M
+
+    def todense(self):
+
+        M = matrix(zeros([self.N, self.N]))
+        for d in range(-self.kl, self.ku + 1):
+            for i in range(max(0, -d), min(self.N, self.N - d)):
+                M[i, i + d] = self.band[self.ku - d, i + d]
+
+        return M
+
+    def tosparse(self):
+        """Returns the matrix as a SciPy sparse matrix, which uses the same
+        column-aligned storage of the diagonals."""
+
+        return dia_matrix((self.band, arange(self.ku, -self.kl - 1, -1)), shape = (self.N, self.N)).tocsr()
+
+    def factorize(self):
+        """Returns the LU factorization of the matrix."""
+
+        return BandedLU(self)
+
+    def solve(self, rhs):
+        """Solves the system for the right hand side "rhs" (one or more
+        columns) and returns the solution as the same type as "rhs." """
+
+        return self.factorize().solve(rhs)
+
+class BlockDiagonalMatrix:
+    """Square matrix that only couples the unknowns of the same grid point,
+    where grid point k has the unknowns blocks[k] to blocks[k+1].  The
+    blocks are stored in an array (grid points x chemicals x chemicals) and
+    the elements are read and written with the same [row, column] indexing
+    as a dense matrix."""
+
+    def __init__(self, blocks):
+        """Constructor method.  Makes an empty matrix with the grid point
+        blocks of unknowns "blocks." """
+
+        self.starts = array(blocks[:-1])
+        self.sizes  = array(blocks[1:]) - self.starts
+        self.N      = blocks[-1]
+        self.blocks = zeros([len(self.starts), self.sizes.max(), self.sizes.max()])
+
+    def locate(self, i, j):
+        """Returns the grid points and the positions in the blocks of the
+        elements [i, j] and whether they lie inside the blocks."""
+
+        node   = searchsorted(self.starts, i, 'right') - 1
+        k, l   = i - self.starts[node], j - self.starts[node]
+        inside = (l >= 0) & (l < self.sizes[node])
+
+        return node, k, l, inside
+
+    def __getitem__(self, index):
+        """Returns the element [i, j], or the elements for arrays of row and
+        column indices."""
+
+        i, j = index
+        if isinstance(i, ndarray) or isinstance(j, ndarray):
+            i, j                = broadcast_arrays(i, j)
+            node, k, l, inside  = self.locate(i, j)
+            values              = zeros(i.shape)
+            values[inside]      = self.blocks[node[inside], k[inside], l[inside]]
+            return values
+
+        node, k, l, inside = self.locate(i, j)
+        if inside: return self.blocks[node, k, l]
+        else:      return 0.
+
+    def __setitem__(self, index, value):
+        """Sets the element [i, j], or the elements for arrays of row and
+        column indices, which must lie inside the blocks."""
+
+        i, j = index
+        if isinstance(i, ndarray) or isinstance(j, ndarray):
+            i, j               = broadcast_arrays(i, j)
+            value              = broadcast_arrays(i, array(value, dtype = float))[1]
+            node, k, l, inside = self.locate(i, j)
+            if (value[inside == 0] != 0).any(): raise ValueError('element outside the diagonal blocks')
+            self.blocks[node[inside], k[inside], l[inside]] = value[inside]
+            return
+
+        node, k, l, inside = self.locate(i, j)
+        if inside:          self.blocks[node, k, l] = value
+        elif value != 0:    raise ValueError('element outside the diagonal blocks')
+
+    def copy(self):
+
+        M        = BlockDiagonalMatrix(list(self.starts) + [self.N])
+        M.blocks = self.blocks.copy()
+
+        return M
+
+    def add_to(self, M, factor = 1, nodes = None):
+        """Adds "factor" times the blocks of grid points "nodes" (all of them
+        by default) to the matrix "M." """
+
+        if nodes is None: nodes = arange(len(self.starts))
+        nodes  = array(nodes, dtype = int)
+        size   = self.blocks.shape[1]
+        inside = arange(size) < self.sizes[nodes].reshape(-1, 1)
+        inside = inside[:, :, None] & inside[:, None, :]
+        rows   = self.starts[nodes].reshape(-1, 1) + arange(size)
+        i, j   = broadcast_arrays(rows[:, :, None], rows[:, None, :])
+
+        M[i[inside], j[inside]] = M[i[inside], j[inside]] + factor * self.blocks[nodes][inside]
+
+class BandedLU:
+    """LU factorization with partial pivoting of a BandedMatrix.  Uses the
+    LAPACK banded routines if SciPy is available, otherwise performs the
+    elimination column by column over the band so the cost grows linearly
+    with the number of grid points."""
+
+    def __init__(self, M):
+        """Constructor method.  Factors the banded matrix "M." """
+
+        N      = M.N
+        kl     = M.kl
+        ku     = M.ku
+        ku2    = kl + ku
+
+        self.N  = N
+        self.kl = kl
+        self.ku = ku
+
+        lu          = zeros([2 * kl + ku + 1, N])
+        lu[kl:, :]  = M.band
+
+        if dgbtrf is not None:
+            self.lu, self.piv, info = dgbtrf(lu, kl, ku)
+            if info > 0: raise linalg.LinAlgError('Singular matrix')
+            return
+
+        piv = range(N)
+        for k in range(N):
+            rows = min(kl, N - 1 - k)
+            ncol = min(ku2, N - 1 - k)
+            cols = arange(k, k + ncol + 1)
+
+            p = int(argmax(abs(lu[ku2:ku2 + rows + 1, k])))
+            if lu[ku2 + p, k] == 0: raise linalg.LinAlgError('Singular matrix')
+            piv[k] = k + p
+            if p > 0:
+                temp                         = lu[ku2 + k - cols, cols]
+                lu[ku2 + k - cols, cols]     = lu[ku2 + k + p - cols, cols]
+                lu[ku2 + k + p - cols, cols] = temp
+
+            if rows > 0:
+                lu[ku2 + 1:ku2 + rows + 1, k] = lu[ku2 + 1:ku2 + rows + 1, k] / lu[ku2, k]
+                if ncol > 0:
+                    I = arange(k + 1, k + rows + 1).reshape(-1, 1)
+                    J = cols[1:].reshape(1, -1)
+                    lu[ku2 + I - J, J] = lu[ku2 + I - J, J] - outer(lu[ku2 + 1:ku2 + rows + 1, k], lu[ku2 + k - cols[1:], cols[1:]])
+
+        self.lu  = lu
+        self.piv = piv
+
+    def solve(self, rhs):
+        """Returns the solution for the right hand side "rhs" as the same type
+        as "rhs." """
+
+        x = array(rhs, dtype = float)
+
+        if dgbtrf is not None:
+            x, info = dgbtrs(self.lu, self.kl, self.ku, x, self.piv)
+        else:
+            N   = self.N
+            kl  = self.kl
+            ku2 = self.kl + self.ku
+            lu  = self.lu
+            for k in range(N):
+                if self.piv[k] != k:
+                    temp             = x[k].copy()
+                    x[k]             = x[self.piv[k]]
+                    x[self.piv[k]]   = temp
+                rows = min(kl, N - 1 - k)
+                if rows > 0:
+                    l = lu[ku2 + 1:ku2 + rows + 1, k]
+                    if len(x.shape) == 2: l = l.reshape(-1, 1)
+                    x[k + 1:k + rows + 1] = x[k + 1:k + rows + 1] - l * x[k]
+            for k in range(N - 1, -1, -1):
+                ncol = min(ku2, N - 1 - k)
+                if ncol > 0:
+                    cols = arange(k + 1, k + ncol + 1)
+                    x[k] = x[k] - dot(lu[ku2 + k - cols, cols], x[k + 1:k + ncol + 1])
+                x[k] = x[k] / lu[ku2, k]
+
+        if isinstance(rhs, matrix): x = matrix(x)
+
+        return x
+
+class PermutedLU:
+    """Factorization of a BandedMatrix with its rows and columns reordered by
+    "order," for matrices that become narrow banded after reordering.  The
+    right hand sides and solutions are in the original order."""
+
+    def __init__(self, M, order):
+        """Constructor method.  Factors the reordered matrix "M." """
+
+        self.order = order
+        self.LU    = M.permute(order).factorize()
+
+    def solve(self, rhs):
+        """Returns the solution for the right hand side "rhs" as the same type
+        as "rhs." """
+
+        x             = array(rhs, dtype = float)
+        x[self.order] = self.LU.solve(x[self.order])
+
+        if isinstance(rhs, matrix): x = matrix(x)
+
+        return x
 
 def first_deriv_2pt_fwd(x):
     """Returns the finite difference coefficients for the first derivative for
@@ -3095,6 +4357,35 @@ def get_delzmax(U, D, elam):
 
     return delzmax
 
+def get_graded_grid(h, n, delz, top = 1, bot = 1):
+    """Returns the depths of the n + 1 grid points of a segment of thickness
+    "h" stretched with a hyperbolic tangent function so that the spacing at
+    the clustered ends ("top" and/or "bot") is approximately "delz."  The
+    points are uniform if "delz" is not smaller than the uniform spacing."""
+
+    xi = arange(n + 1) / float(n)
+
+    if n < 2 or (top + bot) == 0 or delz >= float(h) / n:
+        return h * xi
+
+    def stretch(beta):
+        if top == 1 and bot == 1:   return (1 + tanh(beta * (2 * xi - 1)) / tanh(beta)) / 2
+        elif top == 1:              return 1 + tanh(beta * (xi - 1)) / tanh(beta)
+        else:                       return tanh(beta * xi) / tanh(beta)
+
+    #bisect for the stretching factor that gives the spacing at the ends
+    low  = 10**-6
+    high = 50.
+    for k in range(100):
+        beta = (low + high) / 2
+        x    = stretch(beta)
+        if top == 1: spacing = h * (x[1] - x[0])
+        else:        spacing = h * (x[-1] - x[-2])
+        if spacing > delz: low  = beta
+        else:              high = beta
+
+    return h * stretch(low)
+
 def get_max_time_step(delz, D, R):
     """Calculates the maximum time step size from the Courant-Friedrichs-Lewy
     condition (R * delz**2 / 2D).  "R" is the retardation factor, "delz" is
@@ -3216,6 +4507,35 @@ def get_4pt_adr_fde_CN(R, R_plus_1, U, U_plus_1, D, D_plus_1, K, K_plus_1, delt,
 
     return (-array(D_plus_1 + [0])*a - array(K_plus_1 + [0])*a - U_plus_1 * b + (2*R_plus_1/delt)*c)/2, (array(D + [0])*a + array(K + [0])*a + U*b + (2*R/delt)*c)/2
 
+def get_4pt_adr_fde_coefficients(z):
+    """Returns the coefficients for the second derivative "a," the first
+    derivative "b," and the time derivative "c" of the four-point finite
+    difference equations in "get_4pt_adr_fde_CN" and "get_4pt_adr_fde_imp"
+    for many grid points at once.  Each column of "z" contains the four
+    points used in the discretization at a grid point."""
+
+    a      = zeros(z.shape)
+    y      = zeros(z.shape)
+    w      = zeros(z.shape)
+    c      = zeros(z.shape)
+
+    a[0]   =  2. / (z[2] - z[0]) / (z[1] - z[0])
+    a[1]   = -2. / (z[1] - z[0]) / (z[2] - z[1])
+    a[2]   =  2. / (z[2] - z[0]) / (z[2] - z[1])
+
+    y[0]   = (z[1] - z[2]) / (z[1] - z[0]) / (z[2] - z[0])
+    y[1]   = (z[0] + z[2] - 2. * z[1]) / (z[1] - z[0]) / (z[2] - z[1])
+    y[2]   = (z[1] - z[0]) / (z[2] - z[0]) / (z[2] - z[1])
+
+    w[1]   = (2. * z[1] - z[2] - z[3]) / (z[2] - z[1]) / (z[3] - z[1])
+    w[2]   = (z[3] - z[1]) / (z[2] - z[1]) / (z[3] - z[2])
+    w[3]   = (z[2] - z[1]) / (z[3] - z[1]) / (z[2] - z[3])
+
+    b      = 2. / 3 * y + 1. / 3 * w
+    c[1]   = 1
+
+    return a, b, c
+
 def get_3pt_adr_fde_CN(R, R_plus_1, U, U_plus_1, D, D_plus_1, K, K_plus_1, delt, z):
     """Returns the LHS of the finite difference equation at a point for the 
     advection-diffusion-reaction equation with sorption using one point 
@@ -3231,6 +4551,12 @@ def get_3pt_adr_fde_CN(R, R_plus_1, U, U_plus_1, D, D_plus_1, K, K_plus_1, delt,
 
     return (-array(D_plus_1) * a - array(K_plus_1) * a- U_plus_1*b + (2*R_plus_1/delt)*c)/2, (array(D)*a + array(K)*a + U*b + (2*R/delt)*c)/2
 
+def get_output_times(parameters):
+    """Returns the output times of the system."""
+
+    if parameters.steady == 1: return [parameters.tfinal_ori]
+    else:                      return [parameters.tstart + round(i * (parameters.tfinal_ori-parameters.tstart)/parameters.outputsteps, 10) for i in range(parameters.outputsteps+1)]
+
 def time_interpolate(tint, t, delt, Cn, Cn_plus_1):
     """Returns the interpolated concentrations at time "tint" using the
     concentrations "Cn" at time "t" and concentrations "Cn_plus_1" at time 
@@ -3275,6 +4601,17 @@ def get_point_flux(U, D, KD, C, z):
 
     return U * C[1] + D * sum(first_deriv_3pt_cen(z) *  C) + sum(array(KD) * first_deriv_3pt_cen(z) * C)
 
+def get_point_fluxes(U, D, KD, C, w):
+    """Returns the fluxes at many grid points that are not boundaries at once.
+    Same as "get_point_flux" with the properties and the concentrations "C"
+    before, at and after the points given as arrays (points or points x
+    chemicals), and the centered difference coefficients "w" of the points
+    from "first_deriv_3pt_cen" in the rows."""
+
+    w = w.reshape(w.shape + (1,) * (len(C[1].shape) - 1))
+
+    return U * C[1] + D * (w[0] * C[0] + w[1] * C[1] + w[2] * C[2]) + (KD[0] * w[0] * C[0] + KD[1] * w[1] * C[1] + KD[2] * w[2] * C[2])
+
 def get_2_point_upwind_flux(U, D, C, z):
     """Returns the flux at a grid point that is not a boundary.  Uses the three-
     point centered difference, the diffusion coefficient at the point "D," the
@@ -3298,3 +4635,23 @@ def get_nonpoint_flux(U, D, C1, C2, z1, z2):
     at the point "D." """
     
     return U * (C1 + C2) / 2 + D * (C2 - C1) / (z2 - z1)
+
+def read_BC_history(name):
+    """Reads a boundary concentration history from the CSV file "name" in the
+    batch file directory.  The first row has the headings "Time" and then
+    "Top" or "Bottom" followed by a chemical name, and the other rows the
+    times and the concentrations, which are held until the next time.
+    Returns the times and a dictionary of the concentrations keyed by the
+    boundary and chemical name."""
+
+    file    = open(Filepath + r'/batch_files/' + name + '.csv', 'r')
+    content = [row for row in csv.reader(file) if len(row) > 0]
+    file.close()
+
+    times   = [float(row[0]) for row in content[1:]]
+    columns = {}
+    for i in range(1, len(content[0])):
+        boundary, name = content[0][i].strip().split(' ', 1)
+        columns[(boundary, name.strip())] = [float(row[i]) for row in content[1:]]
+
+    return times, columns
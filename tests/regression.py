@@ -0,0 +1,449 @@
+#! /usr/bin/env python
+#
+#This file is a regression check for the solvers.  A set of canonical systems
+#(linear sorption, Freundlich sorption, bioturbation, deposition, linear and
+#nonlinear reactions) is built without the GUI and simulated with "Solver,"
+#and the pore water concentrations and fluxes are compared with the baseline
+#profiles stored in "baselines.npz."  The time options (adaptive steps, Strang
+#splitting, steady state, matrix exponential and boundary histories) are
+#compared with Crank-Nicolson solutions of the same systems.
+#
+#Usage:  python tests/regression.py          compares with the baselines
+#        python tests/regression.py update   rewrites the baselines
+
+import sys, os
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(path)
+sys.path.append(path + r'/input_windows')
+sys.path.append(path + r'/database')
+sys.path.append(path + r'/solvers')
+sys.path.append(path + r'/postprocess')
+
+from numpy               import array, zeros, savez, load, abs
+from capsim_object_types import System, Chemical, Matrix, MatrixComponent, Sorption, Layer, Reaction, Coefficient, BC, IC, SolidIC
+from reactioneditor      import Reactant, Product
+from solver_routines     import Parameters, UnitResponses
+from solver              import Solver
+
+baselinefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.npz')
+
+class Widget:
+    """Stands in for the widgets and the window of the solver.  Every
+    attribute is another stand-in and every call returns 0, so the progress
+    updates do nothing and the abort flag is never set."""
+
+    def __getattr__(self, name): return Widget()
+
+    def __call__(self, *args, **kwargs): return 0
+
+class HeadlessSolver(Solver):
+    """Runs the time loop of "Solver" for a system without the GUI."""
+
+    def __init__(self, system):
+        """Constructor method."""
+
+        self.parameters = Parameters(system)
+        self.output     = None
+
+    def __getattr__(self, name): return Widget()
+
+def make_system(chemicals = ['A'], layers = [('Layer 1', 'Sand', 10., 20), ('Layer 2', 'Sediment', 5., 10)]):
+    """Returns a "System" with the "chemicals" (names) and the "layers"
+    (name, matrix, thickness in cm and grid points).  The system has upflow
+    through the cap, mass transfer to clean overlying water, a fixed pore
+    water concentration below and contaminated sediment under a clean cap.
+    The cases below change the properties they exercise."""
+
+    system = System('3.5', 'Arial 10', 'Calibri 11')
+
+    system.lengthunits = [u'\u03BCm', 'cm', 'm']
+    system.concunits   = [u'\u03BCg/L', 'mg/L', 'g/L', u'\u03BCmol/L', 'mmol/L', 'mol/L']
+    system.timeunits   = ['s', 'min', 'hr', 'day', 'yr']
+    system.diffunits   = [u'cm\u00B2/s', u'cm\u00B2/yr']
+    system.lengthunit  = system.lengthunits[1]
+    system.concunit    = system.concunits[1]
+    system.timeunit    = system.timeunits[4]
+    system.diffunit    = system.diffunits[0]
+
+    system.nchemicals  = len(chemicals)
+    system.chemicals   = []
+    for name in chemicals:
+        chemical         = Chemical(len(system.chemicals) + 1, 1)
+        chemical.name    = name
+        chemical.formula = name
+        chemical.MW      = 100.
+        chemical.temp    = 20.
+        chemical.Dw      = 5.e-6
+        chemical.Koc     = 0.
+        chemical.Kdoc    = 0.
+        chemical.Ref     = ''
+        chemical.Kf      = 0.
+        chemical.N       = 0.
+        system.chemicals.append(chemical)
+
+    system.matrices       = []
+    system.components     = []
+    system.component_list = []
+    for name, e, rho, foc in [('Sand', 0.4, 1.6, 0.001), ('Sediment', 0.6, 1.0, 0.02)]:
+        component           = MatrixComponent(1)
+        component.name      = name
+        component.e         = e
+        component.rho       = rho
+        component.foc       = foc
+        component.sorp      = 'Linear--Kd specified'
+        component.tort      = 'None'
+        component.fraction  = 1.
+        component.mfraction = 1.
+        matrix              = Matrix(len(system.matrices) + 1)
+        matrix.name         = name
+        matrix.e            = e
+        matrix.rho          = rho
+        matrix.foc          = foc
+        matrix.model        = 'Linear'
+        matrix.components   = [component]
+        system.matrices.append(matrix)
+        system.components.append(component)
+        system.component_list.append(name)
+
+    system.sorptions = {}
+    for component, K in zip(system.components, [10., 100.]):
+        system.sorptions[component.name] = {}
+        for chemical in system.chemicals:
+            sorption          = Sorption(component, chemical)
+            sorption.isotherm = 'Linear--Kd specified'
+            sorption.K        = K
+            system.sorptions[component.name][chemical.name] = sorption
+
+    matrix_list    = [matrix.name for matrix in system.matrices]
+    system.nlayers = len(layers)
+    system.layers  = []
+    system.delz    = []
+    system.players = []
+    for name, type, h, points in layers:
+        if name == 'Deposition': layer = Layer(0)
+        else:                    layer = Layer(len(system.layers) + 1)
+        layer.name       = name
+        layer.type       = type
+        layer.type_index = matrix_list.index(type)
+        layer.h          = h
+        layer.tort       = 'Millington & Quirk'
+        layer.alpha      = 0.5
+        layer.doc        = 0.
+        system.layers.append(layer)
+        system.delz.append(h / points)
+        system.players.append(points)
+
+    system.nreactions   = 0
+    system.reactions    = []
+    system.coefficients = {}
+    for layer in system.layers: system.coefficients[layer.name] = {}
+
+    system.adv    = 'Steady flow'
+    system.Vdar   = 10.
+    system.Vtidal = 0.
+    system.ptidal = 0.
+    system.bio    = 'None'
+    system.hbio   = 0.
+    system.sigma  = 10.
+    system.Dbiop  = 0.
+    system.Dbiopw = 0.
+    system.con    = 'None'
+    system.hcon   = 0.
+    system.t90    = 1.
+    system.biomix = 0
+
+    system.topBCtype = 'Mass transfer'
+    system.botBCtype = 'Fixed Concentration'
+    system.BCs       = {}
+    for chemical in system.chemicals:
+        system.BCs[chemical.name]    = BC(chemical.name, 1)
+        system.BCs[chemical.name].k  = 0.1
+        system.BCs[chemical.name].Cw = 0.
+        system.BCs[chemical.name].Cb = 1.
+
+    system.ICs      = {}
+    system.SolidICs = {}
+    for layer in system.layers:
+        system.ICs[layer.name]      = {}
+        system.SolidICs[layer.name] = {}
+        for chemical in system.chemicals:
+            system.ICs[layer.name][chemical.name] = IC(layer.name, chemical.name)
+            if layer.type == 'Sediment': system.ICs[layer.name][chemical.name].uniform = 1.
+        for component in system.matrices[layer.type_index].components:
+            system.SolidICs[layer.name][component.name] = {}
+            for chemical in system.chemicals:
+                system.SolidICs[layer.name][component.name][chemical.name] = SolidIC(layer.name, component.name, chemical.name)
+
+    system.taucoefs          = {}
+    system.taucoefs['Q']     = 1.
+    system.taucoefs['V']     = 100.
+    system.taucoefs['h']     = 1.
+    system.taucoefs['DOC']   = 0.
+    system.taucoefs['Qevap'] = 0.
+    system.taucoefs['Decay'] = 'None'
+    system.taucoefs['Evap']  = 'None'
+
+    system.dep           = 0
+    system.Vdep          = 0
+    system.tstart        = 0.
+    system.tfinal        = 20.
+    system.outputsteps   = 20
+    system.timeoption    = 'Crank-Nicolson'
+    system.discrete      = 'Manual'
+    system.ptotal        = sum(system.players)
+    system.delt          = 0.05
+    system.ptype         = 'Uniform'
+    system.tvariable     = 'Uniform'
+    system.tidalsteps    = 10
+    system.nonlinear     = 'Newton method'
+    system.nlerror       = 1.e-6
+    system.depoption     = 'Time step size'
+    system.depgrid       = 1
+    system.averageoption = 'Instaneous'
+
+    return system
+
+def add_reaction(system, name, reactants, products, lam):
+    """Adds a "Fundamental" reaction of the "reactants" (name, coefficient,
+    order) to the "products" (name, coefficient) with the rate coefficient
+    "lam" in every layer."""
+
+    reaction           = Reaction(len(system.reactions) + 1)
+    reaction.name      = name
+    reaction.model     = 'Fundamental'
+    reaction.equation  = name
+    reaction.reactants = []
+    reaction.products  = []
+    for chemical, coef, index in reactants:
+        reactant          = Reactant(len(reaction.reactants) + 1)
+        reactant.name     = chemical
+        reactant.formula  = chemical
+        reactant.MW       = 100.
+        reactant.coef     = coef
+        reactant.index    = index
+        reaction.reactants.append(reactant)
+    for chemical, coef in products:
+        product           = Product(len(reaction.products) + 1)
+        product.name      = chemical
+        product.formula   = chemical
+        product.MW        = 100.
+        product.coef      = coef
+        reaction.products.append(product)
+
+    system.reactions.append(reaction)
+    system.nreactions = len(system.reactions)
+    for layer in system.layers:
+        system.coefficients[layer.name][name]     = Coefficient(layer, reaction)
+        system.coefficients[layer.name][name].lam = lam
+
+def make_linear():
+
+    return make_system()
+
+def make_freundlich():
+
+    system         = make_system()
+    system.nlerror = 1.e-16
+    for chemical in system.chemicals:
+        sorption          = system.sorptions['Sand'][chemical.name]
+        sorption.isotherm = 'Freundlich'
+        sorption.Kf       = 10.
+        sorption.N        = 0.8
+
+    return system
+
+def make_bioturbation():
+
+    system        = make_system()
+    system.bio    = 'Uniform'
+    system.hbio   = 5.
+    system.Dbiop  = 1.
+    system.Dbiopw = 100.
+
+    return system
+
+def make_deposition():
+
+    system      = make_system(layers = [('Deposition', 'Sediment', 0.5, 2), ('Layer 1', 'Sand', 10., 20), ('Layer 2', 'Sediment', 5., 10)])
+    system.dep  = 'Deposition'
+    system.Vdep = system.layers[0].h
+    system.depgrid = 10
+
+    return system
+
+def make_reactions():
+
+    system = make_system(chemicals = ['A', 'B'])
+    add_reaction(system, 'Decay', [('A', 1., 1.)], [('B', 1.)], 0.5)
+
+    return system
+
+def make_nonlinear_reactions():
+
+    system         = make_system(chemicals = ['A', 'B'])
+    system.nlerror = 1.e-16
+    add_reaction(system, 'Dimerization', [('A', 2., 2.)], [('B', 1.)], 0.5)
+
+    return system
+
+#the canonical systems compared with the stored baselines and the
+#tolerances; the nonlinear systems are converged tightly so that the
+#profiles hardly depend on the initial guess of the iterations
+cases = [('linear',              make_linear,              1.e-8),
+         ('freundlich',          make_freundlich,          1.e-5),
+         ('bioturbation',        make_bioturbation,        1.e-8),
+         ('deposition',          make_deposition,          1.e-8),
+         ('reactions',           make_reactions,           1.e-8),
+         ('nonlinear_reactions', make_nonlinear_reactions, 1.e-6)]
+
+def run(system):
+    """Simulates "system" and returns the "Output" instance."""
+
+    solver = HeadlessSolver(system)
+    solver.solve_system()
+
+    return solver.output
+
+def get_profiles(output):
+    """Returns the pore water concentrations and the fluxes of "output." """
+
+    return array(output.C), array(output.F)
+
+def get_error(X, Y):
+    """Returns the largest difference of "X" and "Y" relative to the largest
+    value of "Y." """
+
+    return abs(X - Y).max() / max(abs(Y).max(), 1.e-30)
+
+def run_histories(system, histories):
+    """Returns the outputs of "system" for the boundary concentration
+    "histories" (times, {(boundary, chemical name): concentrations}) by
+    superposition, like "solve_histories" with the histories already read."""
+
+    parameters = Parameters(system)
+    parameters.make_grid()
+    if parameters.bio == 1:
+        parameters.update_bioturbation()
+        parameters.make_grid_Dbiops()
+
+    Fis, FisL, FisM = parameters.get_initial_component_fractions()
+    Cn              = parameters.get_initial_concentrations()
+
+    parameters.make_matrix_parameter_vectors(Cn, Fis, FisL)
+    parameters.make_transport_parameter_vectors()
+    parameters.make_reaction_parameter_vectors(Cn, Fis)
+    parameters.update_time_dependents()
+
+    responses = UnitResponses(parameters, Cn, FisL, histories)
+
+    return [responses.get_output(n) for n in range(len(histories))]
+
+def check_options():
+    """Compares the time options with Crank-Nicolson and returns a list of
+    the names, the errors and the tolerances."""
+
+    checks = []
+
+    #adaptive time steps against fixed steps of the initial size, which are
+    #also taken before the error can be estimated
+    system            = make_linear()
+    system.delt       = 0.01
+    C, F              = get_profiles(run(system))
+    system.deltoption = 'Adaptive'
+    system.deltmin    = 0.001
+    system.deltmax    = 1.
+    system.delterror  = 0.0001
+    Ca, Fa            = get_profiles(run(system))
+    checks.append(('adaptive', get_error(Ca, C), 0.001))
+
+    #Strang splitting of the reactions in both layers
+    for make in [make_reactions, make_nonlinear_reactions]:
+        system            = make()
+        system.delt       = 0.01
+        C, F              = get_profiles(run(system))
+        system.timeoption = 'Strang splitting'
+        Cs, Fs            = get_profiles(run(system))
+        checks.append(('strang_' + make.__name__[5:], get_error(Cs, C), 0.001))
+
+    #Strang splitting with larger steps and the chemical in both layers, so
+    #the interface point has to follow the reacted neighboring points
+    system            = make_reactions()
+    system.delt       = 0.1
+    for layer in system.layers: system.ICs[layer.name]['A'].uniform = 1.
+    C, F              = get_profiles(run(system))
+    system.timeoption = 'Strang splitting'
+    Cs, Fs            = get_profiles(run(system))
+    checks.append(('strang_interface', get_error(Cs, C), 0.003))
+
+    #steady state against a long Crank-Nicolson run
+    system             = make_reactions()
+    system.tfinal      = 200.
+    system.outputsteps = 10
+    system.delt        = 0.5
+    C, F               = get_profiles(run(system))
+    system.timeoption  = 'Steady state'
+    Cs, Fs             = get_profiles(run(system))
+    checks.append(('steady', get_error(Cs[-1], C[-1]), 0.001))
+
+    #matrix exponential against small Crank-Nicolson steps, which converge
+    #slowly after the jump of the initial concentrations at the interface
+    system             = make_linear()
+    system.delt        = 0.002
+    C, F               = get_profiles(run(system))
+    system.timeoption  = 'Matrix exponential'
+    Ce, Fe             = get_profiles(run(system))
+    checks.append(('exponential', get_error(Ce, C), 0.001))
+
+    #a bottom concentration history against the system with that
+    #concentration, which the superposition of the unit responses recovers
+    system             = make_linear()
+    for chemical in system.chemicals: system.BCs[chemical.name].Cb = 2.
+    C, F               = get_profiles(run(system))
+    system             = make_linear()
+    outputs            = run_histories(system, [([0.], {('Bottom', 'A'): [2.]})])
+    Ch, Fh             = get_profiles(outputs[0])
+    checks.append(('histories', get_error(Ch, C), 1.e-8))
+
+    return checks
+
+def report(name, error, tolerance):
+    """Prints the result of a check and returns 1 if it failed."""
+
+    if error > tolerance: result = 'FAILED'
+    else:                 result = 'ok'
+    print('%-30s %10.3e  %s' % (name, error, result))
+
+    return 1 * (error > tolerance)
+
+def main(update = 0):
+    """Runs the cases and compares them with the baselines, or rewrites the
+    baselines if "update" is 1.  Returns the number of failed checks."""
+
+    profiles = {}
+    for name, make, tolerance in cases:
+        C, F = get_profiles(run(make()))
+        profiles[name + '_C'] = C
+        profiles[name + '_F'] = F
+
+    if update == 1:
+        savez(baselinefile, **profiles)
+        print('Baselines written to ' + baselinefile)
+        return 0
+
+    baselines = load(baselinefile)
+    failures  = 0
+    for name, make, tolerance in cases:
+        for variable in ['C', 'F']:
+            key      = name + '_' + variable
+            failures = failures + report(key, get_error(profiles[key], baselines[key]), tolerance)
+
+    for name, error, tolerance in check_options():
+        failures = failures + report(name, error, tolerance)
+
+    return failures
+
+if __name__ == '__main__':
+
+    if main(update = 1 * (sys.argv[1:] == ['update'])) > 0: sys.exit(1)